@@ -1,28 +1,59 @@
+import os
+import secrets
 from flask import Flask
 from flask_cors import CORS
 from app.config.settings import Config
-from app.services.data_service import DataService
+from app.json_provider import FastJSONProvider
 import logging
 
 logger = logging.getLogger(__name__)
 
+def _ensure_secret_key(app):
+    """Fall back to a random per-process SECRET_KEY, which only works with a single worker."""
+    if app.config.get('SECRET_KEY'):
+        return
+    if int(os.getenv('WEB_CONCURRENCY', '1')) > 1:
+        raise RuntimeError(
+            "SECRET_KEY must be set when serving with more than one worker: each worker would sign "
+            "sessions with its own random key and reject the other workers' sessions."
+        )
+    logger.warning(
+        "SECRET_KEY is not set; sessions are signed with a random key of this process. Logins and the "
+        "OAuth callback break when other worker processes serve the same users. Set SECRET_KEY."
+    )
+    app.config['SECRET_KEY'] = secrets.token_hex(32)
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    app.json = FastJSONProvider(app)
+    _ensure_secret_key(app)
     
     # Initialize extensions
     CORS(app)
     
-    # Initialize DataService and load Spotify data
-    data_service = DataService()
-    spotify_data = data_service.load_spotify_data()
-    if spotify_data is None:
-        logger.error("Failed to load Spotify data at startup")
-    else:
-        logger.info(f"Successfully loaded Spotify data with {len(spotify_data)} rows")
+    # Load the Spotify data and build the services once for the whole application.
+    # Imported here so scoring worker processes can import app.services modules cheaply.
+    from app.services.service_registry import ServiceRegistry
+    registry = ServiceRegistry(app.config).init_app(app)
+    warmup = app.config['SERVICE_WARMUP']
+    if warmup == 'background':
+        registry.start_warmup()
+    elif warmup != 'lazy':
+        registry.load()
+        if not registry.ready:
+            logger.error(f"Failed to initialize services at startup: {registry.error}")
     
     # Register blueprints
+    from app.routes.health_routes import health_bp
+    app.register_blueprint(health_bp)
     from app.routes.spotify_routes import spotify_bp
     app.register_blueprint(spotify_bp, url_prefix='/api')
+    from app.routes.metrics_routes import metrics_bp
+    app.register_blueprint(metrics_bp)
+    
+    # Register CLI commands (e.g. `flask build-index`)
+    from app.cli import register_commands
+    register_commands(app)
     
-    return app 
\ No newline at end of file
+    return app
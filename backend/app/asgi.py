@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_cookie
+
+from app.routes.spotify_routes import (
+    CURSOR_EXPIRED, SESSION_KEY, not_ready_payload, playlist_recommendation_args, recommendation_page,
+    user_spotify_service
+)
+from app.services.async_spotify_service import AsyncSpotifyService
+from app.services.metrics import METRICS, server_timing_header, stage, start_request_timing
+from app.services.service_registry import EXTENSION_KEY
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRoutes:
+    """
+    ASGI application serving the Spotify-bound endpoints without blocking a
+    worker per request. Spotify calls are awaited on a pooled HTTP client and
+    CPU-bound scoring runs on a thread pool; every other request is passed
+    through to the Flask app.
+    """
+
+    def __init__(self, flask_app, scoring_workers=None):
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.registry = flask_app.extensions[EXTENSION_KEY]
+        self.executor = ThreadPoolExecutor(
+            max_workers=scoring_workers or flask_app.config['ASYNC_SCORING_WORKERS']
+        )
+        self.routes = {
+            '/api/recommendations/playlist': self.playlist_recommendations,
+            '/api/top-songs': self.top_songs,
+            '/api/top-playlists': self.top_playlists,
+        }
+        self._spotify = None
+
+    @property
+    def spotify(self):
+        """Async Spotify client, created on first use inside the event loop."""
+        if self._spotify is None:
+            self._spotify = AsyncSpotifyService(
+                self.registry.spotify_service, self.flask_app.config['ASYNC_MAX_CONNECTIONS']
+            )
+        return self._spotify
+
+    def _session_id(self, scope):
+        """Spotify session id from the Flask session cookie, if the request has a valid one."""
+        cookie = dict(scope['headers']).get(b'cookie')
+        serializer = self.flask_app.session_interface.get_signing_serializer(self.flask_app)
+        if not cookie or serializer is None:
+            return None
+        value = parse_cookie(cookie.decode('latin-1')).get(self.flask_app.config['SESSION_COOKIE_NAME'])
+        if value is None:
+            return None
+        try:
+            max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+            return serializer.loads(value, max_age=max_age).get(SESSION_KEY)
+        except BadSignature:
+            return None
+
+    def _user_spotify(self, scope):
+        """Async client for the session's own Spotify client, sharing the connection pool."""
+        service = user_spotify_service(self.registry, self._session_id(scope))
+        return AsyncSpotifyService(service, client=self.spotify.client)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+        handler = None
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            handler = self.routes.get(scope['path'])
+        if handler is None:
+            return await self.wsgi_app(scope, receive, send)
+        if not self.registry.ready:
+            # Requests served here skip the Flask before_request hook that starts a lazy warm-up
+            self.registry.start_warmup()
+
+        # Each request runs in its own task, so its stage timings stay apart from others
+        start = time.perf_counter()
+        timings = start_request_timing()
+        args = MultiDict(parse_qsl(scope['query_string'].decode('latin-1')))
+        status, body, headers = await handler(scope, args)
+        with stage('json_serialize'):
+            payload = self.flask_app.json.dumps(body).encode('utf-8')
+        elapsed = time.perf_counter() - start
+        METRICS.observe('http_request_duration_seconds', elapsed, endpoint=scope['path'], method='GET')
+        METRICS.inc('http_requests_total', endpoint=scope['path'], method='GET', status=str(status))
+        if self.flask_app.config['SERVER_TIMING']:
+            headers = {**headers, 'server-timing': server_timing_header(timings, elapsed)}
+        await self._send_json(send, status, payload, headers)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def aclose(self):
+        if self._spotify is not None:
+            await self._spotify.aclose()
+        self.executor.shutdown(wait=False)
+
+    async def _refresh_catalog(self):
+        """Apply catalog changes made through any worker, off the event loop."""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.registry.refresh_catalog)
+        except Exception as e:
+            logger.error(f"Error refreshing catalog: {str(e)}")
+
+    async def _send_json(self, send, status, payload, headers):
+        headers = {
+            'content-type': 'application/json',
+            'content-length': str(len(payload)),
+            # Same policy as CORS(app) on the Flask routes
+            'access-control-allow-origin': '*',
+            **headers,
+        }
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def playlist_recommendations(self, scope, args):
+        """Async version of GET /api/recommendations/playlist."""
+        try:
+            params, error = playlist_recommendation_args(
+                args, self.flask_app.config['SECRET_KEY'], self._session_id(scope)
+            )
+            if error:
+                return 400, {"error": error}, {}
+
+            if not self.registry.ready:
+                return 503, not_ready_payload(self.registry.status()), {}
+
+            if self.registry.data_service.has_pending_changes():
+                await self._refresh_catalog()
+            recommendation_service = self.registry.recommendation_service
+            cache = self.registry.recommendation_cache
+            cursor = params['cursor']
+            if cursor is not None and cursor['version'] != recommendation_service.version:
+                return 410, {"error": CURSOR_EXPIRED}, {}
+            try:
+                recommendation_service.check_filters(params['filters'])
+            except ValueError as e:
+                return 400, {"error": str(e)}, {}
+
+            spotify = self._user_spotify(scope)
+            cache_status = 'MISS'
+            if cursor is None:
+                snapshot_id = (await spotify.get_playlist_snapshot(params['playlist_id']))['snapshot_id']
+                cache_key = cache.key(
+                    params['playlist_id'], snapshot_id, params['limit'],
+                    recommendation_service.version, params['exact'], params['nprobe'], params['fields'],
+                    params['filters']
+                )
+                result = cache.get(cache_key)
+                if result is not None:
+                    return 200, result, {'x-cache': 'HIT'}
+            else:
+                snapshot_id = cursor['snapshot_id']
+                cache_status = 'HIT'
+
+            ranked_key = self.registry.ranked_lists.key(
+                params['playlist_id'], snapshot_id, recommendation_service.version, params['exact'],
+                params['nprobe'], params['filters']
+            )
+            ranked = self.registry.ranked_lists.get(ranked_key)
+            if ranked is None:
+                cache_status = 'MISS'
+                playlist_data = await spotify.get_playlist_tracks(params['playlist_id'])
+                # Scored in a copy of this request's context so the scoring stages reach its timings
+                ranking = await asyncio.get_running_loop().run_in_executor(
+                    self.executor,
+                    partial(
+                        contextvars.copy_context().run,
+                        recommendation_service.rank_playlist,
+                        playlist_data['tracks'],
+                        max(params['limit'], self.flask_app.config['RECOMMENDATION_RANKING_DEPTH']),
+                        exact=params['exact'],
+                        nprobe=params['nprobe'],
+                        filters=params['filters'],
+                    ),
+                )
+                ranked = {
+                    "playlist_name": playlist_data['playlist_name'],
+                    "playlist_description": playlist_data['playlist_description'],
+                    "ranking": ranking,
+                }
+                self.registry.ranked_lists.set(ranked_key, ranked)
+            result = recommendation_page(
+                recommendation_service, ranked, params, snapshot_id, self.flask_app.config['SECRET_KEY']
+            )
+            if cursor is None:
+                cache.set(cache_key, result)
+            return 200, result, {'x-cache': cache_status}
+
+        except Exception as e:
+            logger.error(f"Error in playlist recommendations endpoint: {str(e)}")
+            return 500, {"error": str(e)}, {}
+
+    async def top_songs(self, scope, args):
+        try:
+            if self.registry.spotify_service is None:
+                return 503, not_ready_payload(self.registry.status()), {}
+            top_songs = await self._user_spotify(scope).get_top_songs()
+            return 200, {"top_songs": top_songs, "total": len(top_songs)}, {}
+        except Exception as e:
+            logger.error(f"Error in top-songs endpoint: {str(e)}")
+            return 500, {"error": str(e)}, {}
+
+    async def top_playlists(self, scope, args):
+        try:
+            if self.registry.spotify_service is None:
+                return 503, not_ready_payload(self.registry.status()), {}
+            top_playlists = await self._user_spotify(scope).get_top_playlists()
+            return 200, {"top_playlists": top_playlists, "total": len(top_playlists)}, {}
+        except Exception as e:
+            logger.error(f"Error in top-playlists endpoint: {str(e)}")
+            return 500, {"error": str(e)}, {}
+
+
+def create_asgi_app(flask_app):
+    return AsyncRoutes(flask_app)
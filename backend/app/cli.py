@@ -0,0 +1,111 @@
+import json
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from app.services.batch_recommendations import BatchRecommender
+from app.services.recommendation_params import ENGINES, parse_fields
+from app.services.service_registry import get_registry
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The catalog and scoring modules are imported by the commands that use them, so
+# registering the commands (and running unrelated ones like `flask routes`) stays cheap
+
+
+@click.command('build-index')
+@click.option('--output', type=click.Path(file_okay=False), default=None,
+              help='Directory to write the index to (defaults to FEATURE_INDEX_DIR).')
+@click.option('--engine', type=click.Choice(ENGINES), default=None,
+              help='Similarity engine to build indexes for (defaults to RECOMMENDER_ENGINE).')
+@with_appcontext
+def build_index_command(output, engine):
+    """Build the catalog feature indexes offline and save them to disk."""
+    from app.services.data_service import DataService
+    from app.services.recommendation_service import RecommendationService
+    data_service = DataService(current_app.config['DATA_DIR'], current_app.config['COLUMNAR_DIR'])
+    spotify_data = data_service.load_spotify_data()
+    if spotify_data is None:
+        raise click.ClickException("Failed to load Spotify data")
+
+    index_dir = output or current_app.config['FEATURE_INDEX_DIR']
+    recommendation_service = RecommendationService(spotify_data, engine=engine)
+    recommendation_service.save_indexes(index_dir)
+    click.echo(f"Indexes for the {recommendation_service.engine} engine written to {index_dir}")
+
+
+@click.command('convert-catalog')
+@with_appcontext
+def convert_catalog_command():
+    """Convert spotify_data.csv into memory-mappable columnar files."""
+    from app.services.data_service import DataService
+    data_service = DataService(current_app.config['DATA_DIR'], current_app.config['COLUMNAR_DIR'])
+    rows = data_service.convert_to_columnar()
+    click.echo(f"Wrote {rows} rows to {data_service.columnar_dir}")
+
+
+@click.command('compact-catalog')
+@click.option('--engine', type=click.Choice(ENGINES), default=None,
+              help='Similarity engine to rebuild indexes for (defaults to RECOMMENDER_ENGINE).')
+@with_appcontext
+def compact_catalog_command(engine):
+    """Fold logged catalog changes into the catalog files and rebuild the indexes."""
+    from app.services.data_service import DataService
+    from app.services.recommendation_service import RecommendationService
+    data_service = DataService(current_app.config['DATA_DIR'], current_app.config['COLUMNAR_DIR'])
+    if data_service.load_spotify_data() is None:
+        raise click.ClickException("Failed to load Spotify data")
+
+    index_dir = current_app.config['FEATURE_INDEX_DIR']
+
+    def build_indexes(spotify_data):
+        RecommendationService(spotify_data, engine=engine).save_indexes(index_dir)
+
+    spotify_data = data_service.compact(before_log_compaction=build_indexes)
+    click.echo(f"Compacted catalog to {len(spotify_data)} rows; indexes written to {index_dir}")
+
+
+@click.command('recommend-batch')
+@click.option('--input', 'input_file', type=click.File('r'), default='-',
+              help='Playlist ids, one per line, or JSON objects with playlist_id and tracks (default stdin).')
+@click.option('--output', 'output_file', type=click.File('w'), default='-',
+              help='File to write NDJSON results to (default stdout).')
+@click.option('--limit', type=click.IntRange(1, 50), default=10, help='Recommendations per playlist.')
+@click.option('--batch-size', type=click.IntRange(1), default=None,
+              help='Playlists scored per catalog pass (defaults to BATCH_SCORING_SIZE).')
+@click.option('--fields', default=None, help='Comma-separated recommendation keys to output (default all).')
+@with_appcontext
+def recommend_batch_command(input_file, output_file, limit, batch_size, fields):
+    """Write recommendations for many playlists as NDJSON, one line per playlist."""
+    try:
+        fields = parse_fields(fields)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--fields')
+    registry = get_registry().load()
+    if not registry.ready:
+        raise click.ClickException(f"Services are not available: {registry.error}")
+
+    playlists = []
+    for number, line in enumerate(input_file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            playlists.append(BatchRecommender.parse_playlist(json.loads(line) if line.startswith('{') else line))
+        except ValueError as e:
+            raise click.ClickException(f"Line {number}: {e}")
+
+    recommender = BatchRecommender(registry.recommendation_service, registry.spotify_service, batch_size)
+    failed = 0
+    for result in recommender.recommend(playlists, limit, fields):
+        failed += 'error' in result
+        output_file.write(current_app.json.dumps(result) + '\n')
+        output_file.flush()
+    click.echo(f"Processed {len(playlists)} playlists, {failed} failed", err=True)
+
+
+def register_commands(app):
+    app.cli.add_command(build_index_command)
+    app.cli.add_command(convert_catalog_command)
+    app.cli.add_command(compact_catalog_command)
+    app.cli.add_command(recommend_batch_command)
@@ -1,10 +1,118 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 
+BASE_DIR = Path(__file__).parent.parent.parent
+
 class Config:
     SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
     SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
     SPOTIFY_REDIRECT_URI = os.getenv('SPOTIFY_REDIRECT_URI', 'http://localhost:5000/callback')
-    SPOTIFY_SCOPES = 'user-top-read playlist-read-private playlist-read-collaborative user-read-recently-played' 
\ No newline at end of file
+    SPOTIFY_SCOPES = 'user-top-read playlist-read-private playlist-read-collaborative user-read-recently-played'
+    # Signs the session cookie that identifies a logged-in user. Required when more
+    # than one worker process serves requests (WEB_CONCURRENCY > 1), since each
+    # would otherwise sign with its own random key; set it so sessions survive restarts
+    SECRET_KEY = os.getenv('SECRET_KEY')
+
+    # Catalog and prebuilt recommendation index locations
+    DATA_DIR = Path(os.getenv('SPOTIFY_DATA_DIR', BASE_DIR / 'data' / 'spotify_data'))
+    FEATURE_INDEX_DIR = Path(os.getenv('FEATURE_INDEX_DIR', DATA_DIR / 'index'))
+    COLUMNAR_DIR = Path(os.getenv('COLUMNAR_DIR', DATA_DIR / 'columnar'))
+    # 'auto' memory-maps the columnar catalog when it is up to date and falls back to the CSV
+    CATALOG_FORMAT = os.getenv('CATALOG_FORMAT', 'auto')
+    # When the catalog is loaded and the services built: 'eager' in create_app,
+    # 'background' on a warm-up thread started by create_app, 'lazy' on a warm-up
+    # thread started by the first request. /healthz answers at once in every
+    # mode; /readyz and the catalog routes return 503 until the load finishes
+    SERVICE_WARMUP = os.getenv('SERVICE_WARMUP', 'eager')
+
+    # Similarity engine: 'text' (TF-IDF over names and tokenised numbers),
+    # 'audio' (standardised audio-feature vectors) or 'hybrid' (blend of both)
+    RECOMMENDER_ENGINE = os.getenv('RECOMMENDER_ENGINE', 'text')
+    RECOMMENDER_TEXT_WEIGHT = float(os.getenv('RECOMMENDER_TEXT_WEIGHT', '0.3'))
+    # Text features of the 'text' and 'hybrid' engines: 'tfidf' fits a vocabulary
+    # on the catalog, 'hashed' hashes terms into TEXT_HASH_FEATURES float32
+    # columns with IDF weights computed at build time, so vectorizing tracks
+    # needs no fitted vocabulary
+    TEXT_FEATURES = os.getenv('TEXT_FEATURES', 'tfidf')
+    TEXT_HASH_FEATURES = int(os.getenv('TEXT_HASH_FEATURES', str(2 ** 20)))
+    # Per-feature weight overrides for the audio engine, e.g. "energy:2,tempo:0.5"
+    AUDIO_FEATURE_WEIGHTS = os.getenv('AUDIO_FEATURE_WEIGHTS', '')
+    # Catalog rows scored per chunk; bounds peak scoring memory
+    SCORING_CHUNK_SIZE = int(os.getenv('SCORING_CHUNK_SIZE', '65536'))
+    # Exact scoring split into this many catalog shards, each scored by a warm
+    # worker process over shared memory (0 or 1 scores in the request thread)
+    SCORING_SHARDS = int(os.getenv('SCORING_SHARDS', '0'))
+    # Incremental catalog changes (POST/DELETE /api/catalog/tracks, allowed with
+    # this bearer token only) go to a change log that every worker replays;
+    # index rows appended since load are merged into the base matrices in the
+    # background once there are this many
+    CATALOG_ADMIN_TOKEN = os.getenv('CATALOG_ADMIN_TOKEN')
+    CATALOG_DELTA_MERGE_ROWS = int(os.getenv('CATALOG_DELTA_MERGE_ROWS', '50000'))
+    # Approximate nearest-neighbour search: 'exact' scans the whole catalog,
+    # 'ivf' only scores tracks in the ANN_NPROBE closest of ANN_NLIST clusters
+    ANN_MODE = os.getenv('ANN_MODE', 'exact')
+    ANN_NLIST = int(os.getenv('ANN_NLIST', '0'))  # 0 picks ~4 * sqrt(catalog size)
+    ANN_NPROBE = int(os.getenv('ANN_NPROBE', '8'))
+    # Random-projection size used to cluster TF-IDF vectors
+    ANN_DIMENSIONS = int(os.getenv('ANN_DIMENSIONS', '128'))
+
+    # Per-user Spotify clients: tokens are shared by all workers through a SQLite
+    # store ('' keeps them in memory) and refreshed this many seconds before expiry
+    SPOTIFY_TOKEN_STORE_PATH = os.getenv('SPOTIFY_TOKEN_STORE_PATH', str(DATA_DIR / 'spotify_tokens.sqlite3'))
+    SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+    SPOTIFY_MAX_USER_CLIENTS = int(os.getenv('SPOTIFY_MAX_USER_CLIENTS', '10000'))
+    SPOTIFY_HTTP_POOL_SIZE = int(os.getenv('SPOTIFY_HTTP_POOL_SIZE', '32'))
+
+    # Every Spotify call of a worker process goes through one scheduler: a token
+    # bucket of SPOTIFY_RATE_LIMIT calls/s (bursts of SPOTIFY_RATE_BURST), with
+    # 429/5xx retries capped per call and at SPOTIFY_RETRY_BUDGET retries per call overall
+    SPOTIFY_RATE_LIMIT = float(os.getenv('SPOTIFY_RATE_LIMIT', '20'))
+    SPOTIFY_RATE_BURST = int(os.getenv('SPOTIFY_RATE_BURST', '20'))
+    SPOTIFY_MAX_RETRIES = int(os.getenv('SPOTIFY_MAX_RETRIES', '5'))
+    SPOTIFY_RETRY_BUDGET = float(os.getenv('SPOTIFY_RETRY_BUDGET', '0.2'))
+
+    # Playlist pages and audio-feature batches are fetched on a bounded thread pool
+    SPOTIFY_CONCURRENT_FETCH = os.getenv('SPOTIFY_CONCURRENT_FETCH', 'true').lower() == 'true'
+    SPOTIFY_FETCH_WORKERS = int(os.getenv('SPOTIFY_FETCH_WORKERS', '8'))
+
+    # Audio features cache shared by all workers on the host ('' disables the disk layer)
+    AUDIO_FEATURES_CACHE_PATH = os.getenv('AUDIO_FEATURES_CACHE_PATH', str(DATA_DIR / 'audio_features_cache.sqlite3'))
+    AUDIO_FEATURES_CACHE_MAX_ENTRIES = int(os.getenv('AUDIO_FEATURES_CACHE_MAX_ENTRIES', '1000000'))
+    AUDIO_FEATURES_CACHE_MEMORY_ENTRIES = int(os.getenv('AUDIO_FEATURES_CACHE_MEMORY_ENTRIES', '50000'))
+    AUDIO_FEATURES_CACHE_TTL = int(os.getenv('AUDIO_FEATURES_CACHE_TTL', str(30 * 24 * 3600)))
+
+    # /api/top-playlists is ranked from a per-user listening history store shared by
+    # all workers ('' keeps it in memory). New recently-played items are ingested at
+    # most every LISTENING_HISTORY_SYNC_INTERVAL seconds and the playlist listing is
+    # refreshed every LISTENING_HISTORY_PLAYLISTS_TTL seconds
+    LISTENING_HISTORY_PATH = os.getenv('LISTENING_HISTORY_PATH', str(DATA_DIR / 'listening_history.sqlite3'))
+    LISTENING_HISTORY_SYNC_INTERVAL = int(os.getenv('LISTENING_HISTORY_SYNC_INTERVAL', '60'))
+    LISTENING_HISTORY_PLAYLISTS_TTL = int(os.getenv('LISTENING_HISTORY_PLAYLISTS_TTL', '600'))
+
+    # ASGI entry point (asgi.py): pooled keep-alive connections to the Spotify API
+    # per worker, and threads that run recommendation scoring off the event loop
+    ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', '100'))
+    ASYNC_SCORING_WORKERS = int(os.getenv('ASYNC_SCORING_WORKERS', '4'))
+
+    # Batch recommendations: playlists fetched concurrently and scored together
+    # in micro-batches of BATCH_SCORING_SIZE stacked centroids per catalog pass
+    BATCH_SCORING_SIZE = int(os.getenv('BATCH_SCORING_SIZE', '64'))
+    BATCH_FETCH_WORKERS = int(os.getenv('BATCH_FETCH_WORKERS', '8'))
+
+    # GET /metrics exports per-stage timings, Spotify call counts and cache hit
+    # rates of the worker that serves it; SERVER_TIMING adds each response's
+    # stage breakdown as a Server-Timing header
+    SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() == 'true'
+
+    # Playlist recommendation results, keyed by playlist snapshot and index version
+    RECOMMENDATION_CACHE_MAX_ENTRIES = int(os.getenv('RECOMMENDATION_CACHE_MAX_ENTRIES', '1024'))
+    RECOMMENDATION_CACHE_TTL = int(os.getenv('RECOMMENDATION_CACHE_TTL', '3600'))
+    # The first page of playlist recommendations ranks this many candidates and
+    # keeps them for RECOMMENDATION_CURSOR_TTL seconds; its next_cursor serves
+    # the following pages from that list
+    RECOMMENDATION_RANKING_DEPTH = int(os.getenv('RECOMMENDATION_RANKING_DEPTH', '1000'))
+    RECOMMENDATION_CURSOR_TTL = int(os.getenv('RECOMMENDATION_CURSOR_TTL', '1800'))
+    RECOMMENDATION_RANKED_LISTS_MAX_ENTRIES = int(os.getenv('RECOMMENDATION_RANKED_LISTS_MAX_ENTRIES', '256'))
@@ -0,0 +1,43 @@
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library encoder is used instead
+    orjson = None
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider for jsonify, the NDJSON streams and the ASGI routes that
+    encodes with orjson when it is installed. orjson serialises NumPy arrays
+    and scalars natively and writes NaN as null; everything else keeps the
+    behaviour of Flask's default provider, including sorted keys.
+    """
+
+    def _options(self):
+        options = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        # Encoded straight to bytes, skipping the str round trip of dumps
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE),
+            mimetype=self.mimetype,
+        )
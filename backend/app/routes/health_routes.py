@@ -0,0 +1,15 @@
+from flask import Blueprint, jsonify
+from app.services.service_registry import get_registry
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/healthz')
+def healthz():
+    """Liveness: the worker is up and serving requests, whether or not the catalog is loaded."""
+    return jsonify({"status": "ok"})
+
+@health_bp.route('/readyz')
+def readyz():
+    """Readiness: 200 once the catalog and indexes are loaded, 503 while loading or after a failed load."""
+    status = get_registry().status()
+    return jsonify(status), 200 if status['state'] == 'ready' else 503
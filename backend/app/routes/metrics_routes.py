@@ -0,0 +1,41 @@
+import time
+from flask import Blueprint, Response, current_app, g, request
+from app.services.metrics import METRICS, start_request_timing, server_timing_header, stop_request_timing
+from app.services.service_registry import get_registry
+import logging
+
+logger = logging.getLogger(__name__)
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.before_app_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    g.request_timings = start_request_timing()
+
+@metrics_bp.after_app_request
+def record_timing(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    # The route pattern, not the path, keeps ids out of the labels
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    METRICS.observe('http_request_duration_seconds', elapsed, endpoint=endpoint, method=request.method)
+    METRICS.inc('http_requests_total', endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if current_app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = server_timing_header(g.pop('request_timings', []), elapsed)
+    return response
+
+@metrics_bp.teardown_app_request
+def stop_timing(error):
+    stop_request_timing()
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's stage timings, Spotify calls and cache statistics."""
+    try:
+        samples = get_registry().metric_samples()
+    except Exception as e:
+        logger.error(f"Error collecting service metrics: {str(e)}")
+        samples = []
+    return Response(METRICS.render(samples), mimetype='text/plain; version=0.0.4')
@@ -1,19 +1,133 @@
-from flask import Blueprint, jsonify, request
-from app.services.spotify_service import SpotifyService
-from app.services.data_service import DataService
-from app.services.recommendation_service import RecommendationService
+import hmac
+from flask import Blueprint, Response, current_app, jsonify, redirect, request, session, stream_with_context
+from werkzeug.datastructures import MultiDict
+from app.services.batch_recommendations import BatchRecommender
+from app.services.metrics import stage
+from app.services.recommendation_cache import decode_cursor, encode_cursor
+from app.services.recommendation_params import parse_fields, parse_filters, parse_playlist_id
+from app.services.service_registry import get_registry
 import logging
 
 logger = logging.getLogger(__name__)
 spotify_bp = Blueprint('spotify', __name__)
-spotify_service = SpotifyService()
-data_service = DataService()
-recommendation_service = None
 
-# Initialize recommendation service with data
-spotify_data = data_service.load_spotify_data()
-if spotify_data is not None:
-    recommendation_service = RecommendationService(spotify_data)
+MAX_BATCH_TRACK_IDS = 10000
+MAX_BATCH_PLAYLISTS = 10000
+MAX_CATALOG_CHANGES = 10000
+# Session cookie key holding the id of the user's Spotify client
+SESSION_KEY = 'spotify_session'
+# Arguments that select a page of a ranked recommendation list rather than the ranking
+PAGE_ARGS = ('limit', 'fields', 'cursor')
+CURSOR_EXPIRED = "Cursor expired because the catalog or its indexes changed. Request the first page again."
+
+def not_ready_payload(status):
+    """Error body describing why the services are not available yet."""
+    if status['state'] == 'failed':
+        message = "Recommendation service failed to initialize."
+    else:
+        message = "Recommendation service not initialized. Please try again later."
+    return {
+        "error": message,
+        "status": status
+    }
+
+def _not_ready_response():
+    return jsonify(not_ready_payload(get_registry().status())), 503
+
+def catalog_admin_error():
+    """Error response unless the request carries the catalog admin token."""
+    token = current_app.config.get('CATALOG_ADMIN_TOKEN')
+    if not token:
+        return jsonify({
+            "error": "Catalog changes are disabled. Set CATALOG_ADMIN_TOKEN to enable them."
+        }), 403
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({
+            "error": "Invalid catalog admin token"
+        }), 401
+    return None
+
+def user_spotify_service(registry, session_id):
+    """The session's own Spotify client, or the shared one if the session is not logged in."""
+    if registry.spotify_clients is not None:
+        service = registry.spotify_clients.get(session_id)
+        if service is not None:
+            return service
+    return registry.spotify_service
+
+def playlist_recommendation_args(args, secret_key, session_id=None):
+    """
+    Validated playlist recommendation query parameters, as (params, error message).
+    A cursor brings back the arguments its list was ranked with; only limit and
+    fields can change from page to page. Cursors are signed with secret_key and
+    only valid in the session that got the first page.
+    """
+    cursor = None
+    if args.get('cursor'):
+        try:
+            cursor = decode_cursor(args['cursor'], secret_key)
+        except ValueError as e:
+            return None, str(e)
+        if cursor['session'] != session_id:
+            return None, "Invalid cursor"
+        args = MultiDict(
+            cursor['args'] + [[name, value] for name, value in args.items(multi=True) if name in ('limit', 'fields')]
+        )
+    params = {
+        'playlist_id': args.get('playlist_id'),
+        'limit': args.get('limit', default=10, type=int),
+        'exact': args.get('exact', default='false').lower() == 'true',
+        'nprobe': args.get('nprobe', type=int),
+        'cursor': cursor,
+        'session_id': session_id,
+        'ranking_args': [[name, value] for name, value in args.items(multi=True) if name not in PAGE_ARGS],
+    }
+    if not params['playlist_id']:
+        return None, "playlist_id parameter is required"
+    try:
+        params['playlist_id'] = parse_playlist_id(params['playlist_id'])
+    except ValueError as e:
+        return None, str(e)
+    if params['limit'] < 1 or params['limit'] > 50:
+        return None, "Invalid limit parameter. Must be between 1 and 50."
+    if params['nprobe'] is not None and params['nprobe'] < 1:
+        return None, "Invalid nprobe parameter. Must be at least 1."
+    try:
+        params['fields'] = parse_fields(args.get('fields'))
+        params['filters'] = parse_filters(args)
+    except ValueError as e:
+        return None, str(e)
+    return params, None
+
+def recommendation_page(recommendation_service, ranked, params, snapshot_id, secret_key):
+    """Response body for one page of a ranked list, with the cursor of the next page if there is one."""
+    offset = params['cursor']['offset'] if params['cursor'] is not None else 0
+    recommendations = recommendation_service.format_page(ranked['ranking'], offset, params['limit'], params['fields'])
+    next_offset = offset + params['limit']
+    next_cursor = None
+    if next_offset < len(ranked['ranking'][0]):
+        next_cursor = encode_cursor({
+            'args': params['ranking_args'],
+            'offset': next_offset,
+            'snapshot_id': snapshot_id,
+            'version': recommendation_service.version,
+            'session': params['session_id'],
+        }, secret_key)
+    return {
+        "playlist_name": ranked['playlist_name'],
+        "playlist_description": ranked['playlist_description'],
+        "recommendations": recommendations,
+        "total": len(recommendations),
+        "next_cursor": next_cursor
+    }
+
+@spotify_bp.before_request
+def refresh_catalog():
+    # Pick up catalog changes made through any worker
+    try:
+        get_registry().refresh_catalog()
+    except Exception as e:
+        logger.error(f"Error refreshing catalog: {str(e)}")
 
 # @spotify_bp.route('/recommendations')
 # def get_recommendations():
@@ -40,42 +154,250 @@ if spotify_data is not None:
 @spotify_bp.route('/recommendations/playlist')
 def get_playlist_recommendations():
     try:
-        playlist_id = request.args.get('playlist_id')
-        limit = request.args.get('limit', default=10, type=int)
+        params, error = playlist_recommendation_args(
+            request.args, current_app.config['SECRET_KEY'], session.get(SESSION_KEY)
+        )
+        if error:
+            return jsonify({
+                "error": error
+            }), 400
+        playlist_id, limit, exact, nprobe, fields, filters, cursor = (
+            params['playlist_id'], params['limit'], params['exact'], params['nprobe'], params['fields'],
+            params['filters'], params['cursor']
+        )
+            
+        registry = get_registry()
+        if not registry.ready:
+            return _not_ready_response()
+
+        recommendation_service = registry.recommendation_service
+        # The session's own client, so a logged-in user's private playlists are readable
+        spotify_service = user_spotify_service(registry, session.get(SESSION_KEY))
+        if cursor is not None and cursor['version'] != recommendation_service.version:
+            return jsonify({
+                "error": CURSOR_EXPIRED
+            }), 410
+        try:
+            recommendation_service.check_filters(filters)
+        except ValueError as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+
+        result = None
+        cache_status = 'HIT'
+        if cursor is None:
+            # A cheap metadata call tells whether the playlist changed since it was last scored
+            snapshot_id = spotify_service.get_playlist_snapshot(playlist_id)['snapshot_id']
+            cache_key = registry.recommendation_cache.key(
+                playlist_id, snapshot_id, limit, recommendation_service.version, exact, nprobe, fields, filters
+            )
+            result = registry.recommendation_cache.get(cache_key)
+        else:
+            # Later pages come from the list ranked for the first one, without calling Spotify
+            snapshot_id = cursor['snapshot_id']
+
+        if result is None:
+            # First pages report the result cache, later ones whether their ranked list was still held
+            if cursor is None:
+                cache_status = 'MISS'
+            ranked_key = registry.ranked_lists.key(
+                playlist_id, snapshot_id, recommendation_service.version, exact, nprobe, filters
+            )
+            ranked = registry.ranked_lists.get(ranked_key)
+            if ranked is None:
+                cache_status = 'MISS'
+                # Get playlist tracks
+                playlist_data = spotify_service.get_playlist_tracks(playlist_id)
+                
+                # Rank enough candidates for the following pages too
+                ranked = {
+                    "playlist_name": playlist_data['playlist_name'],
+                    "playlist_description": playlist_data['playlist_description'],
+                    "ranking": recommendation_service.rank_playlist(
+                        playlist_data['tracks'],
+                        max(limit, current_app.config['RECOMMENDATION_RANKING_DEPTH']),
+                        exact=exact,
+                        nprobe=nprobe,
+                        filters=filters
+                    )
+                }
+                registry.ranked_lists.set(ranked_key, ranked)
+            result = recommendation_page(
+                recommendation_service, ranked, params, snapshot_id, current_app.config['SECRET_KEY']
+            )
+            if cursor is None:
+                registry.recommendation_cache.set(cache_key, result)
+        
+        with stage('json_serialize'):
+            response = jsonify(result)
+        response.headers['X-Cache'] = cache_status
+        return response
+
+    except Exception as e:
+        logger.error(f"Error in playlist recommendations endpoint: {str(e)}")
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@spotify_bp.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations():
+    """Recommendations for many playlists, streamed back as NDJSON as each playlist is scored."""
+    try:
+        payload = request.get_json(silent=True) or {}
+        limit = payload.get('limit', 10)
+        entries = payload.get('playlists')
         
-        if not playlist_id:
+        if not isinstance(entries, list) or not entries:
             return jsonify({
-                "error": "playlist_id parameter is required"
+                "error": "playlists must be a non-empty list"
             }), 400
             
-        if limit < 1 or limit > 50:
+        if len(entries) > MAX_BATCH_PLAYLISTS:
+            return jsonify({
+                "error": f"At most {MAX_BATCH_PLAYLISTS} playlists can be processed per request."
+            }), 400
+            
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1 or limit > 50:
             return jsonify({
                 "error": "Invalid limit parameter. Must be between 1 and 50."
             }), 400
             
-        if recommendation_service is None:
+        try:
+            fields = parse_fields(payload.get('fields'))
+            playlists = [BatchRecommender.parse_playlist(entry) for entry in entries]
+        except ValueError as e:
             return jsonify({
-                "error": "Recommendation service not initialized. Please try again later."
-            }), 503
+                "error": str(e)
+            }), 400
+            
+        registry = get_registry()
+        if not registry.ready:
+            return _not_ready_response()
+            
+        recommender = BatchRecommender(
+            registry.recommendation_service, user_spotify_service(registry, session.get(SESSION_KEY))
+        )
+        
+        def lines():
+            for result in recommender.recommend(playlists, limit, fields):
+                yield current_app.json.dumps(result) + '\n'
+                
+        return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error in batch recommendations endpoint: {str(e)}")
+        return jsonify({
+            "error": str(e)
+        }), 500
 
-        # Get playlist tracks
-        playlist_data = spotify_service.get_playlist_tracks(playlist_id)
+@spotify_bp.route('/tracks/batch', methods=['POST'])
+def get_tracks_batch():
+    try:
+        payload = request.get_json(silent=True) or {}
+        track_ids = payload.get('track_ids')
         
-        # Get recommendations based on playlist tracks
-        recommendations = recommendation_service.get_playlist_recommendations(
-            playlist_data['tracks'],
-            limit
-        )
+        if not isinstance(track_ids, list) or not track_ids:
+            return jsonify({
+                "error": "track_ids must be a non-empty list"
+            }), 400
+            
+        if not all(isinstance(track_id, str) and track_id for track_id in track_ids):
+            return jsonify({
+                "error": "track_ids must be non-empty strings"
+            }), 400
+            
+        if len(track_ids) > MAX_BATCH_TRACK_IDS:
+            return jsonify({
+                "error": f"At most {MAX_BATCH_TRACK_IDS} track_ids can be looked up per request."
+            }), 400
+            
+        registry = get_registry()
+        if not registry.ready:
+            return _not_ready_response()
+            
+        result = registry.data_service.get_tracks_by_ids(track_ids)
+        if 'error' in result:
+            return jsonify(result), 500
+            
+        return jsonify({
+            "tracks": result['tracks'],
+            "missing": result['missing'],
+            "total": len(result['tracks'])
+        })
+
+    except Exception as e:
+        logger.error(f"Error in tracks batch endpoint: {str(e)}")
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@spotify_bp.route('/catalog/tracks', methods=['POST', 'DELETE'])
+def change_catalog_tracks():
+    """Upsert (POST {"tracks": [...]}) or delete (DELETE {"track_ids": [...]}) catalog tracks."""
+    try:
+        error = catalog_admin_error()
+        if error:
+            return error
+            
+        payload = request.get_json(silent=True) or {}
+        field = 'tracks' if request.method == 'POST' else 'track_ids'
+        entries = payload.get(field)
         
+        if not isinstance(entries, list) or not entries:
+            return jsonify({
+                "error": f"{field} must be a non-empty list"
+            }), 400
+            
+        if len(entries) > MAX_CATALOG_CHANGES:
+            return jsonify({
+                "error": f"At most {MAX_CATALOG_CHANGES} tracks can be changed per request."
+            }), 400
+            
+        if request.method == 'POST' and not all(isinstance(track, dict) for track in entries):
+            return jsonify({
+                "error": "tracks must be objects with a track_id"
+            }), 400
+            
+        registry = get_registry()
+        if not registry.ready:
+            return _not_ready_response()
+            
+        try:
+            if request.method == 'POST':
+                result = registry.apply_catalog_changes(upserts=entries)
+            else:
+                result = registry.apply_catalog_changes(delete_ids=entries)
+        except ValueError as e:
+            return jsonify({
+                "error": str(e)
+            }), 400
+            
         return jsonify({
-            "playlist_name": playlist_data['playlist_name'],
-            "playlist_description": playlist_data['playlist_description'],
-            "recommendations": recommendations,
-            "total": len(recommendations)
+            **result,
+            "total_rows": registry.data_service.live_rows
         })
 
     except Exception as e:
-        logger.error(f"Error in playlist recommendations endpoint: {str(e)}")
+        logger.error(f"Error in catalog tracks endpoint: {str(e)}")
+        return jsonify({
+            "error": str(e)
+        }), 500
+
+@spotify_bp.route('/data/summary')
+def get_data_summary():
+    try:
+        registry = get_registry()
+        if not registry.ready:
+            return _not_ready_response()
+            
+        summary = registry.data_service.get_data_summary()
+        if 'error' in summary:
+            return jsonify(summary), 500
+        return jsonify(summary)
+
+    except Exception as e:
+        logger.error(f"Error in data summary endpoint: {str(e)}")
         return jsonify({
             "error": str(e)
         }), 500
@@ -83,7 +405,10 @@ def get_playlist_recommendations():
 @spotify_bp.route('/top-songs')
 def get_top_songs():
     try:
-        top_songs = spotify_service.get_top_songs()
+        registry = get_registry()
+        if registry.spotify_service is None:
+            return _not_ready_response()
+        top_songs = user_spotify_service(registry, session.get(SESSION_KEY)).get_top_songs()
         return jsonify({
             "top_songs": top_songs,
             "total": len(top_songs)
@@ -98,7 +423,10 @@ def get_top_songs():
 @spotify_bp.route('/top-playlists')
 def get_top_playlists():
     try:
-        top_playlists = spotify_service.get_top_playlists()
+        registry = get_registry()
+        if registry.spotify_service is None:
+            return _not_ready_response()
+        top_playlists = user_spotify_service(registry, session.get(SESSION_KEY)).get_top_playlists()
         return jsonify({
             "top_playlists": top_playlists,
             "total": len(top_playlists)
@@ -110,10 +438,27 @@ def get_top_playlists():
             "error": str(e)
         }), 500
 
+@spotify_bp.route('/login')
+def login():
+    registry = get_registry()
+    if registry.spotify_clients is None:
+        return _not_ready_response()
+    session_id = registry.spotify_clients.new_session_id()
+    session[SESSION_KEY] = session_id
+    return redirect(registry.spotify_clients.authorize_url(session_id))
+
 @spotify_bp.route('/callback')
 def callback():
     try:
-        spotify_service.handle_callback(request.args.get('code'))
+        registry = get_registry()
+        session_id = session.get(SESSION_KEY)
+        if session_id is None:
+            # Not started from /login: authorize the shared client
+            registry.spotify_service.handle_callback(request.args.get('code'))
+        elif request.args.get('state') != session_id:
+            return "Authentication failed: state does not match this session", 400
+        else:
+            registry.spotify_clients.handle_callback(session_id, request.args.get('code'))
         return "Authentication successful! You can close this window."
     except Exception as e:
         logger.error(f"Error in callback: {str(e)}")
@@ -0,0 +1,171 @@
+import json
+import logging
+import math
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.random_projection import SparseRandomProjection
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over the catalog track vectors.
+
+    Tracks are clustered with spherical k-means into nlist lists. A query only
+    scans the rows of the nprobe lists whose centroids are closest to it, so
+    nprobe trades recall for latency; the caller re-scores those candidates
+    exactly. TF-IDF vectors are reduced with a sparse random projection first,
+    and in hybrid mode the text and audio parts are weighted so that the inner
+    product in the index space approximates the blended similarity.
+    """
+
+    DATA_FILE = 'ann_ivf.npz'
+    PROJECTION_FILE = 'ann_projection.joblib'
+    META_FILE = 'ann_meta.json'
+
+    def __init__(self, centroids, list_offsets, list_rows, projection=None, text_weight=1.0,
+                 fingerprint=None, version=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.projection = projection
+        self.text_weight = text_weight
+        self.fingerprint = fingerprint
+        self.version = version or time.strftime('%Y%m%dT%H%M%S')
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @staticmethod
+    def _embed(projection, text_weight, text_rows=None, audio_rows=None):
+        """Map text and/or audio vectors into the dense index space."""
+        parts = []
+        if text_rows is not None:
+            parts.append(math.sqrt(text_weight) * projection.transform(text_rows).astype(np.float32))
+        if audio_rows is not None:
+            parts.append(math.sqrt(1 - text_weight if text_rows is not None else 1.0) * np.asarray(audio_rows))
+        return np.hstack(parts) if len(parts) > 1 else parts[0]
+
+    def embed_query(self, text_query=None, audio_query=None):
+        """Embed a playlist centroid into the index space."""
+        text_rows = None if text_query is None else np.asarray(text_query).reshape(1, -1)
+        audio_rows = None if audio_query is None else np.asarray(audio_query).reshape(1, -1)
+        return self._embed(self.projection, self.text_weight, text_rows, audio_rows)[0]
+
+    @classmethod
+    def build(cls, text_matrix=None, audio_matrix=None, text_weight=1.0, nlist=None, n_iter=10,
+              dimensions=128, chunk_size=65536, seed=0, fingerprint=None):
+        """Cluster the catalog vectors into nlist inverted lists."""
+        start = time.perf_counter()
+        matrix = text_matrix if text_matrix is not None else audio_matrix
+        n_rows = matrix.shape[0]
+        nlist = max(1, min(nlist or int(4 * math.sqrt(n_rows)), n_rows))
+        rng = np.random.default_rng(seed)
+
+        projection = None
+        if text_matrix is not None:
+            projection = SparseRandomProjection(n_components=dimensions, dense_output=True, random_state=seed)
+            projection.fit(text_matrix[:1])
+
+        def embed_rows(rows):
+            return _normalize_rows(cls._embed(
+                projection, text_weight,
+                None if text_matrix is None else text_matrix[rows],
+                None if audio_matrix is None else audio_matrix[rows],
+            ))
+
+        # Spherical k-means on a sample of the catalog
+        sample_rows = np.sort(rng.choice(n_rows, size=min(n_rows, nlist * 64), replace=False))
+        sample = embed_rows(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(n_iter):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            sums[empty] = sample[rng.choice(len(sample), size=int(empty.sum()))]
+            centroids = _normalize_rows(sums)
+
+        # Assign every catalog row to its closest list, chunk by chunk
+        assignments = np.empty(n_rows, dtype=np.int32)
+        for chunk_start in range(0, n_rows, chunk_size):
+            rows = np.arange(chunk_start, min(chunk_start + chunk_size, n_rows))
+            assignments[rows] = np.argmax(embed_rows(rows) @ centroids.T, axis=1)
+
+        list_rows = np.argsort(assignments, kind='stable').astype(np.int64)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=nlist), out=list_offsets[1:])
+        logger.info(
+            f"Built IVF index with {nlist} lists over {n_rows} tracks in {time.perf_counter() - start:.2f}s"
+        )
+        return cls(centroids.astype(np.float32), list_offsets, list_rows, projection, text_weight, fingerprint)
+
+    @classmethod
+    def load(cls, index_dir, fingerprint=None, text_weight=None):
+        """
+        Load a prebuilt IVF index from disk.
+        Returns None if it is missing, stale or was built for a different text weight.
+        """
+        index_dir = Path(index_dir)
+        meta_path = index_dir / cls.META_FILE
+        if not meta_path.exists():
+            logger.info(f"No ANN index found at {index_dir}")
+            return None
+
+        try:
+            meta = json.loads(meta_path.read_text())
+            if fingerprint is not None and meta.get('fingerprint') != fingerprint:
+                logger.warning(f"ANN index at {index_dir} does not match the loaded catalog, ignoring it")
+                return None
+            if text_weight is not None and not math.isclose(meta['text_weight'], text_weight):
+                logger.warning(f"ANN index at {index_dir} was built with a different text weight, ignoring it")
+                return None
+
+            data = np.load(index_dir / cls.DATA_FILE)
+            projection = None
+            if meta.get('has_projection'):
+                projection = joblib.load(index_dir / cls.PROJECTION_FILE)
+            logger.info(f"Loaded ANN index version {meta.get('version')} from {index_dir}")
+            return cls(data['centroids'], data['list_offsets'], data['list_rows'], projection,
+                       meta['text_weight'], meta.get('fingerprint'), meta.get('version'))
+        except Exception as e:
+            logger.error(f"Error loading ANN index: {str(e)}")
+            return None
+
+    def save(self, index_dir):
+        """Persist the centroids, inverted lists and projection to index_dir."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        (index_dir / self.META_FILE).unlink(missing_ok=True)
+        np.savez(index_dir / self.DATA_FILE, centroids=self.centroids,
+                 list_offsets=self.list_offsets, list_rows=self.list_rows)
+        if self.projection is not None:
+            joblib.dump(self.projection, index_dir / self.PROJECTION_FILE)
+        (index_dir / self.META_FILE).write_text(json.dumps({
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'nlist': self.nlist,
+            'text_weight': self.text_weight,
+            'has_projection': self.projection is not None,
+        }, indent=2))
+        logger.info(f"Saved ANN index version {self.version} to {index_dir}")
+
+    def candidates(self, query, nprobe):
+        """Sorted catalog rows in the nprobe lists closest to the embedded query."""
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        probes = np.argpartition(centroid_scores, -nprobe)[-nprobe:]
+        rows = [self.list_rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in probes]
+        return np.sort(np.concatenate(rows))
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+
+import httpx
+
+from app.config.settings import Config
+from app.services.metrics import count_spotify_call, stage
+from app.services.recommendation_params import parse_playlist_id
+from app.services.spotify_service import (
+    AUDIO_FEATURES_BATCH_SIZE, PLAYLIST_PAGE_SIZE, add_audio_features, format_top_songs, playlist_tracks,
+    rank_top_playlists
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSpotifyService:
+    """
+    Non-blocking counterpart of SpotifyService for the ASGI entry point.
+
+    Requests go through one pooled, keep-alive httpx.AsyncClient, so a single
+    worker can have many playlists in flight. Authentication, the audio
+    features cache and the catalog are shared with the wrapped SpotifyService;
+    their blocking calls run on worker threads. Calls go through the same
+    SpotifyCallScheduler, so both clients share one rate limit.
+    """
+
+    def __init__(self, spotify_service, max_connections=None, client=None):
+        self.spotify_service = spotify_service
+        max_connections = max_connections or Config.ASYNC_MAX_CONNECTIONS
+        self.client = client or httpx.AsyncClient(
+            base_url=spotify_service.spotify.prefix,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(spotify_service.spotify.requests_timeout or 5),
+            transport=httpx.AsyncHTTPTransport(retries=3),
+        )
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def _request(self, path, params):
+        headers = await asyncio.to_thread(self.spotify_service.auth_headers)
+        response = await self.client.get(path, params=params, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def _get(self, method, path, params=None):
+        """
+        GET a Web API path through the scheduler, which retries rate-limited and
+        failed responses. method names the call after its spotipy counterpart.
+        """
+        count_spotify_call(method)
+        key = (id(self.spotify_service.spotify), path, tuple(sorted((params or {}).items())))
+        return await self.spotify_service.scheduler.acall(key, lambda: self._request(path, params))
+
+    async def _get_audio_features_batch(self, track_ids):
+        """Get audio features for a batch of tracks."""
+        try:
+            logger.info(f"Getting audio features for {len(track_ids)} tracks")
+            with stage('spotify_audio_features_batch'):
+                results = await self._get('audio_features', 'audio-features', {'ids': ','.join(track_ids)})
+            return await asyncio.to_thread(
+                self.spotify_service._store_audio_features, track_ids, results['audio_features']
+            )
+        except Exception as e:
+            logger.error(f"Error getting audio features: {str(e)}")
+            return {}
+
+    async def _get_audio_features(self, track_ids):
+        with stage('audio_features'):
+            audio_features, missing = await asyncio.to_thread(
+                self.spotify_service._get_known_audio_features, track_ids
+            )
+            batch_results = await asyncio.gather(*[
+                self._get_audio_features_batch(missing[i:i + AUDIO_FEATURES_BATCH_SIZE])
+                for i in range(0, len(missing), AUDIO_FEATURES_BATCH_SIZE)
+            ])
+        for batch_features in batch_results:
+            audio_features.update(batch_features)
+        return audio_features
+
+    async def _fetch_playlist_pages(self, playlist_id, first_page):
+        """All playlist items; the pages after the first are requested concurrently."""
+        limit = first_page.get('limit') or PLAYLIST_PAGE_SIZE
+        offsets = range(len(first_page['items']), first_page['total'], limit)
+        pages = await asyncio.gather(*[
+            self._get('playlist_tracks', f"playlists/{playlist_id}/tracks", {'offset': offset, 'limit': limit})
+            for offset in offsets
+        ])
+        return [item for page in [first_page, *pages] for item in page['items']]
+
+    async def get_playlist_snapshot(self, playlist_id):
+        """Playlist metadata without any tracks; snapshot_id changes whenever the tracks do."""
+        try:
+            playlist_id = parse_playlist_id(playlist_id)
+            with stage('spotify_snapshot'):
+                playlist = await self._get(
+                    'playlist', f"playlists/{playlist_id}", {'fields': 'snapshot_id,name,description'}
+                )
+            return {
+                'snapshot_id': playlist['snapshot_id'],
+                'playlist_name': playlist['name'],
+                'playlist_description': playlist['description']
+            }
+        except Exception as e:
+            logger.error(f"Error getting playlist snapshot: {str(e)}")
+            raise
+
+    async def get_playlist_tracks(self, playlist_id):
+        """Get all tracks of a playlist together with their audio features."""
+        try:
+            playlist_id = parse_playlist_id(playlist_id)
+            # Get playlist details; the response embeds the first page of tracks
+            with stage('spotify_pagination'):
+                playlist = await self._get('playlist', f"playlists/{playlist_id}")
+                items = await self._fetch_playlist_pages(playlist_id, playlist['tracks'])
+            tracks, track_ids = playlist_tracks(items)
+            audio_features = await self._get_audio_features(track_ids)
+            add_audio_features(tracks, audio_features)
+
+            return {
+                'playlist_name': playlist['name'],
+                'playlist_description': playlist['description'],
+                'total_tracks': len(tracks),
+                'tracks': tracks
+            }
+
+        except Exception as e:
+            logger.error(f"Error getting playlist tracks: {str(e)}")
+            raise
+
+    async def get_top_songs(self, limit=5):
+        try:
+            results = await self._get('current_user_top_tracks', 'me/top/tracks', {'limit': limit})
+            return format_top_songs(results)
+        except Exception as e:
+            logger.error(f"Error getting top songs: {str(e)}")
+            raise
+
+    async def get_top_playlists(self, limit=5):
+        try:
+            if self.spotify_service.listening_history is not None:
+                # Ranked from the local store, which the blocking client keeps in sync
+                return await asyncio.to_thread(self.spotify_service.get_top_playlists, limit)
+            recently_played, results = await asyncio.gather(
+                self._get('current_user_recently_played', 'me/player/recently-played', {'limit': 50}),
+                self._get('current_user_playlists', 'me/playlists', {'limit': 50}),
+            )
+            return rank_top_playlists(recently_played, results, limit)
+        except Exception as e:
+            logger.error(f"Error getting top playlists: {str(e)}")
+            raise
@@ -0,0 +1,163 @@
+import copy
+import json
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+
+from app.services.feature_index import catalog_fingerprint
+from app.services.scoring import append_rows, playlist_centroid
+
+logger = logging.getLogger(__name__)
+
+# Catalog/track columns used by the numeric engine and their default weights
+AUDIO_FEATURES = {
+    'danceability': 1.0,
+    'energy': 1.0,
+    'loudness': 0.5,
+    'speechiness': 0.5,
+    'acousticness': 1.0,
+    'instrumentalness': 0.5,
+    'liveness': 0.25,
+    'valence': 1.0,
+    'tempo': 0.75,
+    'popularity': 0.5,
+    'duration_ms': 0.25,
+    'key': 0.1,
+    'mode': 0.25,
+}
+
+
+def parse_feature_weights(spec):
+    """Parse a 'feature:weight,feature:weight' string into a weights dict."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, _, value = item.partition(':')
+        name = name.strip()
+        if name not in AUDIO_FEATURES:
+            raise ValueError(f"Unknown audio feature in weights: {name}")
+        weights[name] = float(value)
+    return weights
+
+
+class AudioFeatureIndex:
+    """Standardised, weighted and L2-normalised float32 matrix of catalog audio features."""
+
+    MATRIX_FILE = 'audio_matrix.npy'
+    META_FILE = 'audio_meta.json'
+
+    def __init__(self, catalog_matrix, features, means, stds, weights, fingerprint=None, version=None):
+        self.catalog_matrix = catalog_matrix
+        self.features = list(features)
+        self.means = np.asarray(means, dtype=np.float32)
+        self.stds = np.asarray(stds, dtype=np.float32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.fingerprint = fingerprint
+        self.version = version or time.strftime('%Y%m%dT%H%M%S')
+
+    @staticmethod
+    def _resolve_weights(features, weights):
+        overrides = weights or {}
+        return np.array([overrides.get(name, AUDIO_FEATURES[name]) for name in features], dtype=np.float32)
+
+    @classmethod
+    def build(cls, spotify_data, weights=None):
+        """Standardise the catalog audio-feature columns into a dense float32 matrix."""
+        start = time.perf_counter()
+        features = [name for name in AUDIO_FEATURES if name in spotify_data.columns]
+        if not features:
+            raise ValueError("Catalog has no audio-feature columns")
+
+        raw = spotify_data[features].to_numpy(dtype=np.float32, na_value=np.nan)
+        means = np.nanmean(raw, axis=0)
+        stds = np.nanstd(raw, axis=0)
+        stds[~(stds > 0)] = 1.0
+
+        index = cls(None, features, means, stds, cls._resolve_weights(features, weights),
+                    fingerprint=catalog_fingerprint(spotify_data))
+        index.catalog_matrix = index._vectorize(raw)
+        logger.info(
+            f"Built audio feature index for {len(spotify_data)} tracks "
+            f"({len(features)} features) in {time.perf_counter() - start:.2f}s"
+        )
+        return index
+
+    @classmethod
+    def load(cls, index_dir, spotify_data=None, weights=None):
+        """
+        Load a prebuilt audio feature index from disk.
+        Returns None if it is missing, stale or was built with different weights.
+        """
+        index_dir = Path(index_dir)
+        meta_path = index_dir / cls.META_FILE
+        if not meta_path.exists():
+            logger.info(f"No audio feature index found at {index_dir}")
+            return None
+
+        try:
+            meta = json.loads(meta_path.read_text())
+            if spotify_data is not None and meta.get('fingerprint') != catalog_fingerprint(spotify_data):
+                logger.warning(f"Audio feature index at {index_dir} does not match the loaded catalog, ignoring it")
+                return None
+            if not np.allclose(meta['weights'], cls._resolve_weights(meta['features'], weights)):
+                logger.warning(f"Audio feature index at {index_dir} was built with different weights, ignoring it")
+                return None
+
+            catalog_matrix = np.load(index_dir / cls.MATRIX_FILE, mmap_mode='r')
+            logger.info(f"Loaded audio feature index version {meta.get('version')} from {index_dir}")
+            return cls(catalog_matrix, meta['features'], meta['means'], meta['stds'], meta['weights'],
+                       meta.get('fingerprint'), meta.get('version'))
+        except Exception as e:
+            logger.error(f"Error loading audio feature index: {str(e)}")
+            return None
+
+    def save(self, index_dir):
+        """Persist the catalog matrix and the scaling parameters to index_dir."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        (index_dir / self.META_FILE).unlink(missing_ok=True)
+        np.save(index_dir / self.MATRIX_FILE, self.catalog_matrix)
+        (index_dir / self.META_FILE).write_text(json.dumps({
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'features': self.features,
+            'means': self.means.tolist(),
+            'stds': self.stds.tolist(),
+            'weights': self.weights.tolist(),
+        }, indent=2))
+        logger.info(f"Saved audio feature index version {self.version} to {index_dir}")
+
+    def _vectorize(self, raw):
+        """Standardise, weight and L2-normalise raw feature rows; missing values map to the mean."""
+        matrix = (raw - self.means) / self.stds
+        matrix = np.nan_to_num(matrix, nan=0.0, copy=False)
+        matrix *= self.weights
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix /= norms
+        return matrix.astype(np.float32, copy=False)
+
+    def with_rows(self, rows):
+        """Copy of the index with catalog rows appended, scaled with the catalog's original parameters."""
+        index = copy.copy(self)
+        raw = rows.reindex(columns=self.features).to_numpy(dtype=np.float32, na_value=np.nan)
+        index.catalog_matrix = append_rows(self.catalog_matrix, self._vectorize(raw))
+        return index
+
+    def transform(self, playlist_tracks):
+        """Vectorize playlist tracks into the catalog feature space."""
+        raw = np.array(
+            [[track.get(name, np.nan) for name in self.features] for track in playlist_tracks],
+            dtype=np.float32,
+        ).reshape(len(playlist_tracks), len(self.features))
+        return self._vectorize(raw)
+
+    def centroid(self, playlist_tracks):
+        """Mean audio-feature vector of the playlist tracks."""
+        return playlist_centroid(self.transform, playlist_tracks).astype(np.float32)
+
+    def score(self, playlist_tracks):
+        """Average cosine similarity of every catalog track to the playlist tracks."""
+        # Mean of dot products equals the dot product with the mean playlist vector
+        return self.catalog_matrix @ self.centroid(playlist_tracks)
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from app.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class AudioFeaturesCache:
+    """
+    Audio features keyed by track id, in memory plus an on-disk SQLite store.
+
+    The SQLite file (WAL mode) is shared by every worker on the host. Both
+    layers are size-bounded with least-recently-used eviction and entries
+    expire after ttl seconds. Track audio features never change, so the TTL
+    only bounds how long a bad or partial API response can stick around.
+
+    The disk row count is tracked in memory from writes, so it is only counted
+    in SQLite once writes may have pushed it past max_entries. Eviction then
+    trims it to a low-water mark, leaving headroom before the next count.
+    Other workers' writes are seen at that count.
+    """
+
+    # Share of max_entries evicted at once when the disk store is over its limit
+    EVICTION_HEADROOM = 0.1
+
+    def __init__(self, path=None, max_entries=1000000, ttl=None, memory_entries=50000):
+        self.path = Path(path) if path else None
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.memory = LRUCache(memory_entries, ttl)
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._disk_rows = 0
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connection() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS audio_features ("
+                    "track_id TEXT PRIMARY KEY, features TEXT NOT NULL, "
+                    "fetched_at REAL NOT NULL, last_access REAL NOT NULL)"
+                )
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS audio_features_last_access ON audio_features (last_access)"
+                )
+                (self._disk_rows,) = connection.execute("SELECT COUNT(*) FROM audio_features").fetchone()
+
+    def _connection(self):
+        """One SQLite connection per thread, reopened in forked worker processes."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get_many(self, track_ids):
+        """Cached features for track_ids, as (found dict, missing list)."""
+        found, missing = self.memory.get_many(track_ids)
+        if not missing or self.path is None:
+            return found, missing
+
+        now = time.time()
+        rows = {}
+        connection = self._connection()
+        for start in range(0, len(missing), 500):
+            batch = missing[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            for track_id, features, fetched_at in connection.execute(
+                f"SELECT track_id, features, fetched_at FROM audio_features WHERE track_id IN ({placeholders})",
+                batch,
+            ):
+                rows[track_id] = (features, fetched_at)
+
+        disk_found = {
+            track_id: json.loads(features)
+            for track_id, (features, fetched_at) in rows.items()
+            if self.ttl is None or now - fetched_at <= self.ttl
+        }
+        if disk_found:
+            with self._write_lock, connection:
+                connection.executemany(
+                    "UPDATE audio_features SET last_access = ? WHERE track_id = ?",
+                    [(now, track_id) for track_id in disk_found],
+                )
+            self.memory.set_many(disk_found)
+
+        self.disk_hits += len(disk_found)
+        self.disk_misses += len(missing) - len(disk_found)
+        found.update(disk_found)
+        return found, [track_id for track_id in missing if track_id not in disk_found]
+
+    def set_many(self, features_by_id):
+        """Store features in both layers, evicting the least recently used disk entries."""
+        if not features_by_id:
+            return
+        self.memory.set_many(features_by_id)
+        if self.path is None:
+            return
+
+        now = time.time()
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO audio_features (track_id, features, fetched_at, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                [(track_id, json.dumps(features), now, now) for track_id, features in features_by_id.items()],
+            )
+            # Replaced rows are counted too, which at worst brings the next count forward
+            self._disk_rows += len(features_by_id)
+            if self._disk_rows > self.max_entries:
+                self._evict(connection)
+
+    def _evict(self, connection):
+        """Trim the disk store to its low-water mark, least recently used first."""
+        (count,) = connection.execute("SELECT COUNT(*) FROM audio_features").fetchone()
+        low_water = self.max_entries - int(self.max_entries * self.EVICTION_HEADROOM)
+        if count > low_water:
+            connection.execute(
+                "DELETE FROM audio_features WHERE track_id IN ("
+                "SELECT track_id FROM audio_features ORDER BY last_access LIMIT ?)",
+                (count - low_water,),
+            )
+        self._disk_rows = min(count, low_water)
+
+    def stats(self):
+        """Hit/miss counters for both layers."""
+        memory = self.memory.stats()
+        hits = memory['hits'] + self.disk_hits
+        lookups = memory['hits'] + memory['misses']
+        return {
+            'memory': memory,
+            'disk_hits': self.disk_hits,
+            'disk_misses': self.disk_misses,
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_rate': hits / lookups if lookups else None,
+        }
@@ -0,0 +1,106 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.config.settings import Config
+from app.services.recommendation_params import parse_playlist_id
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRecommender:
+    """
+    Recommendations for many playlists in one job.
+
+    Playlists given by id are fetched concurrently; playlists given as track
+    lists are used as they are. As playlists become available they are
+    grouped into micro-batches of batch_size, each scored with one stacked
+    matrix multiply, and results are yielded as soon as their batch is done.
+    """
+
+    def __init__(self, recommendation_service, spotify_service=None, batch_size=None, fetch_workers=None):
+        self.recommendation_service = recommendation_service
+        self.spotify_service = spotify_service
+        self.batch_size = batch_size or Config.BATCH_SCORING_SIZE
+        self.fetch_workers = fetch_workers or Config.BATCH_FETCH_WORKERS
+
+    @staticmethod
+    def parse_playlist(value):
+        """Normalise a batch entry: a playlist id, {"playlist_id": ...} or {"playlist_id": ..., "tracks": [...]}."""
+        if isinstance(value, str):
+            value = {'playlist_id': value}
+        if not isinstance(value, dict) or not value.get('playlist_id'):
+            raise ValueError("Each playlist must be an id or an object with a playlist_id")
+        if value.get('tracks') is not None and not isinstance(value['tracks'], list):
+            raise ValueError(f"tracks of playlist {value['playlist_id']} must be a list")
+        if value.get('tracks') is None:
+            # Only playlists fetched from Spotify need an id the Web API accepts
+            value = {**value, 'playlist_id': parse_playlist_id(value['playlist_id'])}
+        return value
+
+    def _score(self, playlists, limit, fields=None):
+        """Score one micro-batch of fetched playlists and yield a result per playlist."""
+        scorable = []
+        for playlist in playlists:
+            if playlist['tracks']:
+                scorable.append(playlist)
+            else:
+                yield {"playlist_id": playlist['playlist_id'], "error": "Playlist has no tracks"}
+        if not scorable:
+            return
+
+        try:
+            batch_recommendations = self.recommendation_service.get_batch_recommendations(
+                [playlist['tracks'] for playlist in scorable], limit, fields
+            )
+        except Exception as e:
+            if len(scorable) == 1:
+                yield {"playlist_id": scorable[0]['playlist_id'], "error": str(e)}
+                return
+            # Score the batch one playlist at a time so only the failing ones report an error
+            logger.warning(f"Error scoring a batch of {len(scorable)} playlists, scoring them one by one: {str(e)}")
+            for playlist in scorable:
+                yield from self._score([playlist], limit, fields)
+            return
+
+        for playlist, recommendations in zip(scorable, batch_recommendations):
+            yield {
+                "playlist_id": playlist['playlist_id'],
+                "playlist_name": playlist.get('playlist_name'),
+                "playlist_description": playlist.get('playlist_description'),
+                "recommendations": recommendations,
+                "total": len(recommendations)
+            }
+
+    def recommend(self, playlists, limit=10, fields=None):
+        """Yield one result dict per playlist, in completion order; fields limits the recommendation keys."""
+        ready = []
+        executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        try:
+            fetches = {}
+            for playlist in playlists:
+                if playlist.get('tracks') is not None:
+                    ready.append(playlist)
+                else:
+                    future = executor.submit(self.spotify_service.get_playlist_tracks, playlist['playlist_id'])
+                    fetches[future] = playlist['playlist_id']
+
+            # Playlists given as track lists are scored while the others are fetched
+            while len(ready) >= self.batch_size:
+                yield from self._score(ready[:self.batch_size], limit, fields)
+                ready = ready[self.batch_size:]
+
+            for future in as_completed(fetches):
+                try:
+                    playlist_data = future.result()
+                except Exception as e:
+                    yield {"playlist_id": fetches[future], "error": str(e)}
+                    continue
+                ready.append({'playlist_id': fetches[future], **playlist_data})
+                if len(ready) >= self.batch_size:
+                    yield from self._score(ready, limit, fields)
+                    ready = []
+
+            yield from self._score(ready, limit, fields)
+        finally:
+            # A closed stream stops the remaining fetches instead of waiting for them
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,154 @@
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from app.services.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogFilterIndex:
+    """
+    Column indexes over the catalog rows present when it was built, used to
+    compile request filters into a boolean row mask before scoring:
+    - range columns (popularity, tempo) as a stable argsort, so a range is two
+      binary searches and only the rows inside (or outside) it are touched
+    - low-cardinality columns (key, mode) as one bitmap per value
+    - artists as catalog rows grouped by artist, so excluding an artist only
+      touches that artist's rows, and track ids as a hash index
+    Rows appended to the catalog later are filtered directly on their columns.
+    Only the columns present in the catalog are indexed.
+    """
+
+    RANGE_COLUMNS = ('popularity', 'tempo')
+    BITMAP_COLUMNS = ('key', 'mode')
+    # Catalog column each filter reads
+    FILTER_COLUMNS = {
+        'min_popularity': 'popularity',
+        'tempo_range': 'tempo',
+        'key': 'key',
+        'mode': 'mode',
+        'exclude_artists': 'artist_name',
+        'exclude_playlist_tracks': 'track_id',
+    }
+
+    @classmethod
+    def check(cls, filters, columns):
+        """Raise ValueError for a filter on a column the catalog does not have."""
+        for name, _ in filters or ():
+            column = cls.FILTER_COLUMNS[name]
+            if column not in columns:
+                raise ValueError(f"The {name} filter is not available: the catalog has no {column} column")
+
+    def __init__(self, spotify_data):
+        start = time.perf_counter()
+        self.n_rows = len(spotify_data)
+        self.track_index = None
+        if 'track_id' in spotify_data.columns:
+            self.track_index = pd.Index(spotify_data['track_id'].astype(str))
+
+        self.sorted_columns = {}
+        for column in self.RANGE_COLUMNS:
+            if column not in spotify_data.columns:
+                continue
+            values = spotify_data[column].to_numpy(dtype=np.float64)
+            order = np.argsort(values, kind='stable')
+            self.sorted_columns[column] = (values[order], order)
+
+        self.bitmaps = {}
+        for column in self.BITMAP_COLUMNS:
+            if column not in spotify_data.columns:
+                continue
+            values = spotify_data[column].to_numpy()
+            self.bitmaps[column] = {
+                int(value): values == value for value in pd.unique(values) if not pd.isna(value)
+            }
+
+        self.artist_codes = {}
+        if 'artist_name' in spotify_data.columns:
+            codes, artists = pd.factorize(spotify_data['artist_name'])
+            self.artist_rows = np.argsort(codes, kind='stable')
+            self.artist_offsets = np.zeros(len(artists) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(codes[codes >= 0], minlength=len(artists)), out=self.artist_offsets[1:])
+            for code, artist in enumerate(artists):
+                self.artist_codes.setdefault(str(artist).lower(), []).append(code)
+        logger.info(f"Built catalog filter index for {self.n_rows} tracks in {time.perf_counter() - start:.2f}s")
+
+    def _range_mask(self, column, low, high):
+        """Rows with low <= column <= high, from the sorted column."""
+        values, order = self.sorted_columns[column]
+        lo = np.searchsorted(values, low, side='left')
+        hi = np.searchsorted(values, high, side='right')
+        # Touch whichever side of the range has fewer rows
+        if hi - lo <= self.n_rows // 2:
+            mask = np.zeros(self.n_rows, dtype=bool)
+            mask[order[lo:hi]] = True
+        else:
+            mask = np.ones(self.n_rows, dtype=bool)
+            mask[order[:lo]] = False
+            mask[order[hi:]] = False
+        return mask
+
+    def _value_mask(self, column, values):
+        """Rows whose column is one of values, from the per-value bitmaps."""
+        bitmaps = [self.bitmaps[column][value] for value in values if value in self.bitmaps[column]]
+        if not bitmaps:
+            return np.zeros(self.n_rows, dtype=bool)
+        return np.logical_or.reduce(bitmaps) if len(bitmaps) > 1 else bitmaps[0].copy()
+
+    def _index_mask(self, filters, track_ids):
+        mask = np.ones(self.n_rows, dtype=bool)
+        if 'min_popularity' in filters:
+            mask &= self._range_mask('popularity', filters['min_popularity'], np.inf)
+        if 'tempo_range' in filters:
+            mask &= self._range_mask('tempo', *filters['tempo_range'])
+        for column in self.BITMAP_COLUMNS:
+            if column in filters:
+                values = filters[column]
+                mask &= self._value_mask(column, values if isinstance(values, tuple) else (values,))
+        for artist in filters.get('exclude_artists', ()):
+            for code in self.artist_codes.get(artist, ()):
+                mask[self.artist_rows[self.artist_offsets[code]:self.artist_offsets[code + 1]]] = False
+        if track_ids:
+            positions = self.track_index.get_indexer_non_unique(list(track_ids))[0]
+            mask[positions[positions >= 0]] = False
+        return mask
+
+    @staticmethod
+    def _rows_mask(rows, filters, track_ids):
+        """The same filters evaluated directly on the columns of a few catalog rows."""
+        mask = np.ones(len(rows), dtype=bool)
+        if 'min_popularity' in filters:
+            mask &= rows['popularity'].to_numpy(dtype=np.float64) >= filters['min_popularity']
+        if 'tempo_range' in filters:
+            low, high = filters['tempo_range']
+            tempo = rows['tempo'].to_numpy(dtype=np.float64)
+            mask &= (tempo >= low) & (tempo <= high)
+        if 'key' in filters:
+            mask &= rows['key'].isin(filters['key']).to_numpy()
+        if 'mode' in filters:
+            mask &= rows['mode'].to_numpy() == filters['mode']
+        if 'exclude_artists' in filters:
+            mask &= ~rows['artist_name'].astype(str).str.lower().isin(filters['exclude_artists']).to_numpy()
+        if track_ids:
+            mask &= ~rows['track_id'].astype(str).isin(track_ids).to_numpy()
+        return mask
+
+    @stage('candidate_filter')
+    def compile(self, filters, spotify_data, playlist_tracks=()):
+        """
+        Boolean mask over the rows of spotify_data that pass filters (see
+        parse_filters). spotify_data may have rows appended since the index
+        was built.
+        """
+        self.check(filters, spotify_data.columns)
+        filters = dict(filters)
+        track_ids = set()
+        if filters.get('exclude_playlist_tracks'):
+            track_ids = {str(track['id']) for track in playlist_tracks if track.get('id')}
+        mask = self._index_mask(filters, track_ids)
+        if len(spotify_data) > self.n_rows:
+            mask = np.concatenate([mask, self._rows_mask(spotify_data.iloc[self.n_rows:], filters, track_ids)])
+        return mask
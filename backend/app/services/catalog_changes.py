@@ -0,0 +1,87 @@
+import fcntl
+import json
+import logging
+import os
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogChangeLog:
+    """
+    Append-only JSON-lines log of catalog changes made since the catalog files
+    were last written.
+
+    Every process that serves the catalog replays the log from where it last
+    stopped, so a change written by one worker becomes visible in all of them,
+    in the same order. Appends hold an exclusive file lock and readers only
+    consume complete lines. Compaction replaces the file, which readers notice
+    from its new inode.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def signature(self):
+        """(inode, size) of the log, or None if there is none."""
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size
+
+    def append(self, upserts=None, delete_ids=None):
+        """Durably append one change of upserted track records and deleted track ids."""
+        line = json.dumps({'upsert': upserts or [], 'delete': delete_ids or []}, default=str) + '\n'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            with open(self.path, 'a', encoding='utf-8') as log_file:
+                fcntl.flock(log_file, fcntl.LOCK_EX)
+                try:
+                    # Compaction may have replaced the file while we waited for the lock
+                    if os.fstat(log_file.fileno()).st_ino != self.path.stat().st_ino:
+                        continue
+                    log_file.write(line)
+                    log_file.flush()
+                    os.fsync(log_file.fileno())
+                    return
+                finally:
+                    fcntl.flock(log_file, fcntl.LOCK_UN)
+
+    def read(self, inode=None, offset=0):
+        """
+        Changes after offset in the log file with the given inode.
+        Returns (changes, inode, offset) for the next read; a different inode
+        means the log was compacted and is read from its start.
+        """
+        try:
+            with open(self.path, 'rb') as log_file:
+                current_inode = os.fstat(log_file.fileno()).st_ino
+                if current_inode != inode:
+                    offset = 0
+                log_file.seek(offset)
+                data = log_file.read()
+        except FileNotFoundError:
+            return [], None, 0
+
+        # A line without its newline is still being written
+        complete = data[:data.rfind(b'\n') + 1]
+        changes = [json.loads(line) for line in complete.splitlines() if line.strip()]
+        return changes, current_inode, offset + len(complete)
+
+    def compact(self, offset):
+        """
+        Drop the first offset bytes, which are now part of the catalog files,
+        keeping changes appended since. The log is replaced, not truncated, so
+        readers can tell the difference.
+        """
+        temp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(self.path, 'a+b') as log_file:
+            fcntl.flock(log_file, fcntl.LOCK_EX)
+            try:
+                log_file.seek(offset)
+                temp_path.write_bytes(log_file.read())
+                temp_path.replace(self.path)
+            finally:
+                fcntl.flock(log_file, fcntl.LOCK_UN)
+        logger.info(f"Compacted catalog change log at {self.path}")
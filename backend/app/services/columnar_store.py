@@ -0,0 +1,105 @@
+import json
+import logging
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = 'manifest.json'
+# Separator for the category strings blob; never appears in track metadata
+CATEGORY_SEPARATOR = '\x00'
+
+
+def _numeric_dtype(series):
+    """float32 for real-valued columns, the narrowest of int32/int64 for integers."""
+    if pd.api.types.is_integer_dtype(series.dtype):
+        if series.min() >= np.iinfo(np.int32).min and series.max() <= np.iinfo(np.int32).max:
+            return np.int32
+        return np.int64
+    return np.float32
+
+
+def write_columnar(spotify_data, output_dir, source=None):
+    """
+    Write the catalog as one .npy file per column.
+    Numeric columns are stored as float32/int32 and string columns as category
+    codes, in the integer width pandas uses for that many categories, plus a
+    blob of category strings. The directory is written
+    next to its final location and swapped in at the end.
+    """
+    start = time.perf_counter()
+    output_dir = Path(output_dir)
+    staging_dir = output_dir.with_name(output_dir.name + '.tmp')
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    staging_dir.mkdir(parents=True)
+
+    columns = []
+    for position, name in enumerate(spotify_data.columns):
+        series = spotify_data[name]
+        file_stem = f"col{position:03d}"
+        if pd.api.types.is_bool_dtype(series.dtype) or pd.api.types.is_numeric_dtype(series.dtype):
+            dtype = _numeric_dtype(series)
+            np.save(staging_dir / f"{file_stem}.npy", series.to_numpy(dtype=dtype))
+            columns.append({'name': name, 'kind': 'numeric', 'file': file_stem, 'dtype': np.dtype(dtype).name})
+        else:
+            categorical = pd.Categorical(series.astype('string'))
+            categories = [str(value) for value in categorical.categories]
+            # pandas keeps codes of its own width as they are, so the map is not copied on load
+            np.save(staging_dir / f"{file_stem}.npy", categorical.codes)
+            (staging_dir / f"{file_stem}.categories").write_bytes(
+                CATEGORY_SEPARATOR.join(categories).encode('utf-8')
+            )
+            columns.append({'name': name, 'kind': 'categorical', 'file': file_stem,
+                            'categories': len(categories)})
+
+    (staging_dir / MANIFEST_FILE).write_text(json.dumps({
+        'rows': len(spotify_data),
+        'columns': columns,
+        'source': source,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }, indent=2))
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    staging_dir.rename(output_dir)
+    logger.info(
+        f"Wrote columnar catalog with {len(spotify_data)} rows to {output_dir} "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+
+def read_manifest(directory):
+    """Manifest of a columnar catalog, or None if there is none."""
+    manifest_path = Path(directory) / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    return json.loads(manifest_path.read_text())
+
+
+def read_columnar(directory):
+    """
+    Open a columnar catalog as a DataFrame.
+    Numeric columns and the codes of string columns are read-only memory maps,
+    so processes on one host share the same page-cache pages; string columns
+    become pandas Categoricals whose category strings are loaded per process.
+    Codes written by older versions as int32 are copied on load.
+    """
+    directory = Path(directory)
+    manifest = read_manifest(directory)
+    if manifest is None:
+        raise FileNotFoundError(f"No columnar catalog at {directory}")
+
+    data = {}
+    for column in manifest['columns']:
+        values = np.load(directory / f"{column['file']}.npy", mmap_mode='r')
+        if column['kind'] == 'categorical':
+            blob = (directory / f"{column['file']}.categories").read_bytes().decode('utf-8')
+            categories = blob.split(CATEGORY_SEPARATOR) if column['categories'] else []
+            values = pd.Categorical.from_codes(values, categories=pd.Index(categories, dtype=object))
+        data[column['name']] = values
+
+    # copy=False keeps one block per column instead of consolidating (and copying) the maps
+    return pd.DataFrame(data, copy=False)
@@ -1,26 +1,143 @@
+import numpy as np
 import pandas as pd
 import logging
+import threading
 from pathlib import Path
+from app.config.settings import Config
+from app.services.catalog_changes import CatalogChangeLog
+from app.services.columnar_store import read_columnar, read_manifest, write_columnar
+from app.services.feature_index import catalog_fingerprint
+from app.services.metrics import stage
+from app.services.summary_stats import SummaryStats
 
 logger = logging.getLogger(__name__)
 
+
+def _json_records(rows):
+    """DataFrame rows as JSON-serialisable dicts, with missing values as None."""
+    return rows.astype(object).where(rows.notna(), None).to_dict('records')
+
+
+class CatalogSnapshot:
+    """
+    One version of the catalog rows together with its track_id index. Catalog
+    changes build a new snapshot and swap it in with a single assignment, so
+    a reader that takes the current snapshot always sees rows and index that
+    belong together.
+
+    Rows are only ever appended: replaced and deleted tracks stay in place,
+    flagged in deleted, until the catalog is compacted. The index of the rows
+    the catalog was loaded with is built once; tracks appended since are
+    looked up in a small delta index that takes precedence over it.
+    """
+
+    def __init__(self, spotify_data, track_index, track_positions, delta_index=None, delta_positions=None,
+                 deleted=None):
+        self.spotify_data = spotify_data
+        self.track_index = track_index
+        self.track_positions = track_positions
+        self.delta_index = delta_index
+        self.delta_positions = delta_positions
+        self.deleted = deleted
+
+    @property
+    def live_rows(self):
+        deleted = 0 if self.deleted is None else int(self.deleted.sum())
+        return len(self.spotify_data) - deleted
+
+    def positions(self, track_ids):
+        """Row positions of the given track IDs, -1 for unknown or deleted IDs."""
+        track_ids = pd.Index(list(track_ids), dtype=object)
+        indexer = self.track_index.get_indexer(track_ids)
+        positions = np.where(indexer >= 0, self.track_positions[indexer], -1)
+        if self.delta_index is not None:
+            delta = self.delta_index.get_indexer(track_ids)
+            positions = np.where(delta >= 0, self.delta_positions[delta], positions)
+        if self.deleted is not None:
+            positions = np.where((positions >= 0) & self.deleted[np.maximum(positions, 0)], -1, positions)
+        return positions
+
+
 class DataService:
-    def __init__(self):
-        self.data_dir = Path(__file__).parent.parent.parent / 'data' / 'spotify_data'
-        self.spotify_data = None
+    def __init__(self, data_dir=None, columnar_dir=None, catalog_format=None):
+        self.data_dir = Path(data_dir) if data_dir else Config.DATA_DIR
+        if columnar_dir:
+            self.columnar_dir = Path(columnar_dir)
+        else:
+            self.columnar_dir = self.data_dir / 'columnar' if data_dir else Config.COLUMNAR_DIR
+        self.catalog_format = catalog_format or Config.CATALOG_FORMAT
+        self._snapshot = None
+        self.summary_stats = None
+        self.change_log = CatalogChangeLog(self.data_dir / 'catalog_changes.jsonl')
+        # How far this process has replayed the change log, as (inode, offset)
+        self._log_position = (None, 0)
+        self._changes_lock = threading.Lock()
+
+    @property
+    def spotify_data(self):
+        snapshot = self._snapshot
+        return snapshot.spotify_data if snapshot is not None else None
 
+    @property
+    def deleted_rows(self):
+        """Boolean mask of catalog rows that were replaced or deleted, or None if there are none."""
+        snapshot = self._snapshot
+        return snapshot.deleted if snapshot is not None else None
+
+    @property
+    def live_rows(self):
+        snapshot = self._snapshot
+        return snapshot.live_rows if snapshot is not None else 0
+
+    @property
+    def csv_path(self):
+        return self.data_dir / 'spotify_data.csv'
+
+    @property
+    def summary_stats_path(self):
+        return self.data_dir / 'summary_stats.json'
+
+    def _csv_signature(self):
+        """Size and modification time of the CSV file, used to detect a stale columnar copy."""
+        stat = self.csv_path.stat()
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _use_columnar(self):
+        """Whether the columnar copy of the catalog should be loaded instead of the CSV."""
+        if self.catalog_format == 'csv':
+            return False
+
+        manifest = read_manifest(self.columnar_dir)
+        if manifest is None:
+            if self.catalog_format == 'columnar':
+                raise FileNotFoundError(f"Columnar catalog not found at {self.columnar_dir}")
+            return False
+
+        if self.catalog_format == 'auto' and self.csv_path.exists() and manifest.get('source') != self._csv_signature():
+            logger.warning(f"Columnar catalog at {self.columnar_dir} is older than {self.csv_path}, loading the CSV")
+            return False
+        return True
+
+    @stage('catalog_load')
     def load_spotify_data(self):
         """
-        Load and parse the Spotify data CSV file.
+        Load the Spotify data.
+        Memory-maps the columnar copy of the catalog when it is up to date and
+        otherwise parses the CSV file.
         Returns a pandas DataFrame or None if there's an error.
         """
         try:
-            csv_path = self.data_dir / 'spotify_data.csv'
+            if self._use_columnar():
+                self._set_spotify_data(read_columnar(self.columnar_dir))
+                logger.info(f"Memory-mapped columnar Spotify data with {len(self.spotify_data)} rows")
+                return self.spotify_data
+
+            csv_path = self.csv_path
             if not csv_path.exists():
                 logger.error(f"Spotify data file not found at {csv_path}")
                 return None
 
-            self.spotify_data = pd.read_csv(csv_path)
+            self._set_spotify_data(pd.read_csv(csv_path))
             logger.info(f"Successfully loaded Spotify data with {len(self.spotify_data)} rows")
             return self.spotify_data
 
@@ -28,6 +145,238 @@ class DataService:
             logger.error(f"Error loading Spotify data: {str(e)}")
             return None
 
+    def _set_spotify_data(self, spotify_data, load_stats=True):
+        """Install a loaded catalog and build its track_id index."""
+        track_ids = spotify_data['track_id'].astype(str)
+        first_occurrence = ~track_ids.duplicated(keep='first').to_numpy()
+        # Hash index from track_id to the row position of its first occurrence. It has the
+        # lookup keys' object dtype: on a dtype mismatch pandas recasts the whole index per lookup
+        track_index = pd.Index(track_ids.to_numpy(dtype=object)[first_occurrence], dtype=object)
+        # Building the hash table up front keeps it off the first request
+        track_index.get_indexer(track_index[:1])
+        self._snapshot = CatalogSnapshot(spotify_data, track_index, np.flatnonzero(first_occurrence))
+        self._log_position = (None, 0)
+        if load_stats:
+            self._load_summary_stats()
+
+    def _load_summary_stats(self):
+        """Load the persisted summary statistics, computing and saving them if they are stale."""
+        fingerprint = catalog_fingerprint(self.spotify_data)
+        self.summary_stats = SummaryStats.load(self.summary_stats_path, fingerprint)
+        if self.summary_stats is None:
+            self.summary_stats = SummaryStats.from_dataframe(self.spotify_data, fingerprint)
+            self._save_summary_stats()
+
+    def _save_summary_stats(self):
+        try:
+            self.summary_stats.save(self.summary_stats_path)
+        except Exception as e:
+            logger.warning(f"Could not persist summary statistics: {str(e)}")
+
+    def _prepare_rows(self, rows, spotify_data):
+        """New catalog rows in the catalog's columns and dtypes; raises ValueError for invalid rows."""
+        if 'track_id' not in rows.columns or rows['track_id'].isna().any():
+            raise ValueError("Every track needs a track_id")
+        unknown = [name for name in rows.columns if name not in spotify_data.columns]
+        if unknown:
+            raise ValueError(f"Unknown catalog columns: {', '.join(map(str, unknown))}")
+
+        rows = rows.reindex(columns=spotify_data.columns)
+        for name, dtype in spotify_data.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                continue
+            if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                try:
+                    column = pd.to_numeric(rows[name])
+                except (TypeError, ValueError):
+                    raise ValueError(f"Column {name} must be numeric")
+                # Integer columns cannot hold missing values, so those rows stay float
+                if pd.api.types.is_float_dtype(dtype) or not column.isna().any():
+                    column = column.astype(dtype)
+                rows[name] = column
+        return rows
+
+    @staticmethod
+    def _concat_rows(spotify_data, rows):
+        """spotify_data with rows appended, keeping categorical columns categorical."""
+        rows = rows.copy()
+        for name, dtype in spotify_data.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                values = rows[name].dropna().astype(str)
+                new_categories = pd.Index(values.unique()).difference(dtype.categories)
+                if len(new_categories):
+                    spotify_data = spotify_data.assign(**{name: spotify_data[name].cat.add_categories(new_categories)})
+                rows[name] = pd.Categorical(
+                    rows[name].where(rows[name].isna(), rows[name].astype(str)),
+                    categories=spotify_data[name].cat.categories,
+                )
+        return pd.concat([spotify_data, rows], ignore_index=True)
+
+    def _apply_changes(self, upserts=None, delete_ids=(), replace=True):
+        """
+        Build and install the snapshot after appending upserts and deleting delete_ids.
+        With replace, rows of tracks that are upserted again are flagged as deleted;
+        without it appended duplicates stay hidden behind the existing rows.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise RuntimeError("Data not loaded")
+
+        spotify_data = snapshot.spotify_data
+        n_rows = len(spotify_data)
+        if upserts is not None and len(upserts):
+            upserts = self._prepare_rows(upserts, spotify_data)
+        else:
+            upserts = spotify_data.iloc[:0]
+        upsert_ids = upserts['track_id'].astype(str)
+        if replace:
+            upserts = upserts[~upsert_ids.duplicated(keep='last').to_numpy()]
+            upsert_ids = upserts['track_id'].astype(str)
+            indexed = np.ones(len(upserts), dtype=bool)
+            changed_ids = set(upsert_ids).union(map(str, delete_ids))
+        else:
+            indexed = (snapshot.positions(upsert_ids) < 0) & ~upsert_ids.duplicated(keep='first').to_numpy()
+            changed_ids = set(map(str, delete_ids))
+
+        deleted = np.zeros(n_rows, dtype=bool) if snapshot.deleted is None else snapshot.deleted.copy()
+        removed = np.empty(0, dtype=np.int64)
+        if changed_ids:
+            removed = np.flatnonzero(spotify_data['track_id'].astype(str).isin(changed_ids).to_numpy() & ~deleted)
+            deleted[removed] = True
+        removed_rows = spotify_data.take(removed)
+
+        # Delta index: tracks appended since load, minus the ones changed now, plus the new rows
+        delta_ids = np.empty(0, dtype=object)
+        delta_positions = np.empty(0, dtype=np.int64)
+        if snapshot.delta_index is not None:
+            keep = ~snapshot.delta_index.isin(changed_ids)
+            delta_ids = snapshot.delta_index.to_numpy()[keep]
+            delta_positions = snapshot.delta_positions[keep]
+        delta_index = pd.Index(np.concatenate([delta_ids, upsert_ids.to_numpy(dtype=object)[indexed]]), dtype=object)
+        delta_positions = np.concatenate([delta_positions, n_rows + np.flatnonzero(indexed)])
+
+        if len(upserts):
+            spotify_data = self._concat_rows(spotify_data, upserts)
+            deleted = np.concatenate([deleted, np.zeros(len(upserts), dtype=bool)])
+
+        self.summary_stats.remove(removed_rows)
+        self.summary_stats.update(upserts)
+        self._snapshot = CatalogSnapshot(
+            spotify_data, snapshot.track_index, snapshot.track_positions,
+            delta_index if len(delta_index) else None, delta_positions,
+            deleted if deleted.any() else None,
+        )
+        deleted_ids = set(removed_rows['track_id'].astype(str)).difference(upsert_ids)
+        return {"upserted": len(upserts), "deleted": len(deleted_ids)}
+
+    def append_rows(self, rows):
+        """
+        Append tracks to the loaded catalog.
+        The track_id index is extended and the summary statistics are updated
+        incrementally from the new rows only.
+        """
+        with self._changes_lock:
+            self._apply_changes(rows, replace=False)
+        self.summary_stats.fingerprint = catalog_fingerprint(self.spotify_data)
+        self._save_summary_stats()
+        return self.spotify_data
+
+    def log_changes(self, upserts=None, delete_ids=None):
+        """
+        Validate catalog changes and append them to the change log; they take
+        effect in every process that replays the log (see replay_changes).
+        upserts is a list of track dicts, delete_ids a list of track IDs.
+        """
+        if self.spotify_data is None:
+            raise RuntimeError("Data not loaded")
+        records = []
+        if upserts:
+            records = _json_records(self._prepare_rows(pd.DataFrame(upserts), self.spotify_data))
+        self.change_log.append(records, [str(track_id) for track_id in delete_ids or []])
+
+    def has_pending_changes(self):
+        """Whether the change log moved past this process's replay position; a cheap stat call."""
+        signature = self.change_log.signature()
+        return signature is not None and signature != self._log_position
+
+    @stage('catalog_replay')
+    def replay_changes(self):
+        """
+        Apply the change log entries this process has not applied yet.
+        Returns the summed change counts, or None if there was nothing to apply.
+        A compacted log is replayed from its start, which is harmless: upserts
+        and deletes of the same tracks give the same catalog again.
+        """
+        with self._changes_lock:
+            changes, inode, offset = self.change_log.read(*self._log_position)
+            totals = None
+            for change in changes:
+                upserts = pd.DataFrame(change['upsert']) if change['upsert'] else None
+                result = self._apply_changes(upserts, change['delete'])
+                totals = {name: (totals or {}).get(name, 0) + count for name, count in result.items()}
+            self._log_position = (inode, offset)
+            if totals is not None:
+                logger.info(f"Applied {len(changes)} catalog changes: {totals}, {self.live_rows} tracks")
+            return totals
+
+    def log_compacted(self):
+        """Whether the change log was compacted since this process last replayed it."""
+        signature = self.change_log.signature()
+        return self._log_position[0] is not None and signature is not None and signature[0] != self._log_position[0]
+
+    def install(self, other):
+        """Take over the catalog another DataService loaded, e.g. after a compaction."""
+        with self._changes_lock:
+            self.summary_stats = other.summary_stats
+            self._log_position = other._log_position
+            self._snapshot = other._snapshot
+
+    def compact(self, before_log_compaction=None):
+        """
+        Write the catalog with all logged changes applied as the new catalog
+        files and drop those changes from the change log. before_log_compaction
+        is called with the compacted catalog before the log is cut, e.g. to
+        rebuild the indexes that workers will load when they notice the cut.
+        Returns the compacted catalog.
+        """
+        try:
+            self.replay_changes()
+            snapshot = self._snapshot
+            spotify_data = snapshot.spotify_data
+            if snapshot.deleted is not None:
+                spotify_data = spotify_data[~snapshot.deleted]
+            spotify_data = spotify_data.reset_index(drop=True)
+
+            temp_path = self.csv_path.with_name(self.csv_path.name + '.tmp')
+            spotify_data.to_csv(temp_path, index=False)
+            temp_path.replace(self.csv_path)
+            if read_manifest(self.columnar_dir) is not None:
+                write_columnar(spotify_data, self.columnar_dir, source=self._csv_signature())
+
+            offset = self._log_position[1]
+            self._set_spotify_data(spotify_data)
+            if before_log_compaction is not None:
+                before_log_compaction(spotify_data)
+            self.change_log.compact(offset)
+            logger.info(f"Compacted catalog to {len(spotify_data)} rows")
+            return spotify_data
+        except Exception as e:
+            logger.error(f"Error compacting catalog: {str(e)}")
+            raise
+
+    def convert_to_columnar(self):
+        """
+        Convert the CSV catalog into the memory-mappable columnar format.
+        Returns the number of rows written.
+        """
+        try:
+            spotify_data = pd.read_csv(self.csv_path)
+            write_columnar(spotify_data, self.columnar_dir, source=self._csv_signature())
+            return len(spotify_data)
+        except Exception as e:
+            logger.error(f"Error converting Spotify data to columnar format: {str(e)}")
+            raise
+
     def get_data_summary(self):
         """
         Get a summary of the loaded Spotify data.
@@ -36,27 +385,50 @@ class DataService:
             return {"error": "Data not loaded"}
 
         try:
-            return {
-                "total_rows": len(self.spotify_data),
-                "columns": list(self.spotify_data.columns),
-                "summary_stats": self.spotify_data.describe().to_dict()
-            }
+            # Served from statistics maintained at load/append time, not a full-table pass
+            return self.summary_stats.summary()
         except Exception as e:
             logger.error(f"Error getting data summary: {str(e)}")
             return {"error": str(e)}
 
+    @stage('track_lookup')
     def get_track_by_id(self, track_id):
         """
         Get track information by track ID.
         """
-        if self.spotify_data is None:
+        snapshot = self._snapshot
+        if snapshot is None:
             return {"error": "Data not loaded"}
 
         try:
-            track = self.spotify_data[self.spotify_data['track_id'] == track_id]
-            if track.empty:
+            position = snapshot.positions([track_id])[0]
+            if position < 0:
                 return {"error": "Track not found"}
-            return track.iloc[0].to_dict()
+            return snapshot.spotify_data.iloc[position].to_dict()
         except Exception as e:
             logger.error(f"Error getting track by ID: {str(e)}")
+            return {"error": str(e)}
+
+    @stage('track_lookup')
+    def get_tracks_by_ids(self, track_ids):
+        """
+        Get track information for many track IDs with a single row take.
+        Returns the found tracks in request order and the IDs that are not in the catalog.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {"error": "Data not loaded"}
+
+        try:
+            track_ids = list(track_ids)
+            positions = snapshot.positions(track_ids)
+            found = positions >= 0
+            rows = snapshot.spotify_data.take(positions[found])
+            return {
+                # JSON has no NaN, so missing values become None
+                "tracks": _json_records(rows),
+                "missing": [track_id for track_id, hit in zip(track_ids, found) if not hit]
+            }
+        except Exception as e:
+            logger.error(f"Error getting tracks by IDs: {str(e)}")
             return {"error": str(e)} 
\ No newline at end of file
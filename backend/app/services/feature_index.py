@@ -0,0 +1,291 @@
+import copy
+import json
+import logging
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
+from sklearn.preprocessing import normalize
+
+from app.services.metrics import stage
+from app.services.scoring import append_rows, playlist_centroid
+
+logger = logging.getLogger(__name__)
+
+# (token prefix, track/catalog column, default) for numeric features
+NUMERIC_FEATURES = [
+    ('duration', 'duration_ms', 0),
+    ('popularity', 'popularity', 0),
+    ('danceability', 'danceability', 0),
+    ('energy', 'energy', 0),
+    ('key', 'key', 0),
+    ('loudness', 'loudness', 0),
+    ('mode', 'mode', 0),
+    ('speechiness', 'speechiness', 0),
+    ('acousticness', 'acousticness', 0),
+    ('instrumentalness', 'instrumentalness', 0),
+    ('liveness', 'liveness', 0),
+    ('valence', 'valence', 0),
+    ('tempo', 'tempo', 0),
+    ('time_signature', 'time_signature', 4),
+]
+
+
+def track_feature_string(track, include_numeric=True):
+    """Build the feature string for a single playlist track."""
+    # Text features
+    text_features = [
+        track['name'],
+        track['artist'],
+        track.get('album', ''),  # Using get() with default value in case album is missing
+    ]
+
+    if not include_numeric:
+        return ' '.join(text_features)
+
+    # Numeric features normalized to strings
+    numeric_features = [
+        f"{prefix}:{track.get(column, default)}" for prefix, column, default in NUMERIC_FEATURES
+    ]
+
+    return ' '.join(text_features + numeric_features)
+
+
+def catalog_feature_strings(spotify_data, include_numeric=True):
+    """Build feature strings for every catalog row with column-wise string operations."""
+    def column(name, default):
+        if name in spotify_data.columns:
+            return spotify_data[name].astype(str)
+        return pd.Series(str(default), index=spotify_data.index)
+
+    parts = [
+        column('artist_name', ''),
+        column('album_name', ''),
+    ]
+    if include_numeric:
+        parts += [
+            f"{prefix}:" + column(name, default) for prefix, name, default in NUMERIC_FEATURES
+        ]
+    return column('track_name', '').str.cat(parts, sep=' ').tolist()
+
+
+def catalog_fingerprint(spotify_data):
+    """Cheap fingerprint of the catalog rows, used to detect a stale index."""
+    hashes = pd.util.hash_pandas_object(spotify_data['track_id'], index=False)
+    return f"{len(spotify_data)}-{int(hashes.sum()) & 0xFFFFFFFFFFFFFFFF:016x}"
+
+
+class FeatureIndex:
+    """
+    Fitted TF-IDF vectorizer plus the sparse catalog matrix it produced.
+    With include_numeric=False only track name, artist and album are indexed,
+    leaving audio features to AudioFeatureIndex.
+    """
+
+    VECTORIZER_FILE = 'vectorizer.joblib'
+    MATRIX_FILE = 'catalog_matrix.npz'
+    META_FILE = 'meta.json'
+
+    def __init__(self, vectorizer, catalog_matrix, fingerprint=None, version=None, include_numeric=True):
+        self.vectorizer = vectorizer
+        self.catalog_matrix = catalog_matrix.tocsr()
+        self.include_numeric = include_numeric
+        self.fingerprint = fingerprint
+        self.version = version or time.strftime('%Y%m%dT%H%M%S')
+
+    @classmethod
+    def build(cls, spotify_data, include_numeric=True):
+        """Fit the vectorizer on the catalog and transform every catalog row."""
+        start = time.perf_counter()
+        vectorizer = TfidfVectorizer()
+        with stage('tfidf_fit'):
+            catalog_matrix = vectorizer.fit_transform(catalog_feature_strings(spotify_data, include_numeric))
+        logger.info(
+            f"Built feature index for {catalog_matrix.shape[0]} tracks "
+            f"({catalog_matrix.shape[1]} terms) in {time.perf_counter() - start:.2f}s"
+        )
+        return cls(vectorizer, catalog_matrix, fingerprint=catalog_fingerprint(spotify_data),
+                   include_numeric=include_numeric)
+
+    @classmethod
+    def load(cls, index_dir, spotify_data=None, include_numeric=True):
+        """
+        Load a prebuilt index from disk.
+        Returns None if the index is missing or was built from a different catalog or feature set.
+        """
+        index_dir = Path(index_dir)
+        meta_path = index_dir / cls.META_FILE
+        if not meta_path.exists():
+            logger.info(f"No feature index found at {index_dir}")
+            return None
+
+        try:
+            meta = json.loads(meta_path.read_text())
+            if spotify_data is not None and meta.get('fingerprint') != catalog_fingerprint(spotify_data):
+                logger.warning(f"Feature index at {index_dir} does not match the loaded catalog, ignoring it")
+                return None
+            if meta.get('include_numeric', True) != include_numeric:
+                logger.warning(f"Feature index at {index_dir} was built with a different feature set, ignoring it")
+                return None
+
+            vectorizer = joblib.load(index_dir / cls.VECTORIZER_FILE)
+            catalog_matrix = sparse.load_npz(index_dir / cls.MATRIX_FILE)
+            logger.info(f"Loaded feature index version {meta.get('version')} from {index_dir}")
+            return cls(vectorizer, catalog_matrix, meta.get('fingerprint'), meta.get('version'), include_numeric)
+        except Exception as e:
+            logger.error(f"Error loading feature index: {str(e)}")
+            return None
+
+    def save(self, index_dir):
+        """Persist the vectorizer, catalog matrix and metadata to index_dir."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        (index_dir / self.META_FILE).unlink(missing_ok=True)
+        joblib.dump(self.vectorizer, index_dir / self.VECTORIZER_FILE)
+        sparse.save_npz(index_dir / self.MATRIX_FILE, self.catalog_matrix)
+        # Metadata is written last so a partially written index is never picked up
+        (index_dir / self.META_FILE).write_text(json.dumps({
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'include_numeric': self.include_numeric,
+            'rows': self.catalog_matrix.shape[0],
+            'terms': self.catalog_matrix.shape[1],
+        }, indent=2))
+        logger.info(f"Saved feature index version {self.version} to {index_dir}")
+
+    def with_rows(self, rows):
+        """
+        Copy of the index with catalog rows appended, vectorized with the fitted
+        vectorizer. Terms the vectorizer has not seen are ignored until the
+        index is rebuilt.
+        """
+        index = copy.copy(self)
+        index.catalog_matrix = append_rows(
+            self.catalog_matrix, self._vectorize(catalog_feature_strings(rows, self.include_numeric))
+        )
+        return index
+
+    def _vectorize(self, feature_strings):
+        return self.vectorizer.transform(feature_strings)
+
+    def transform(self, playlist_tracks):
+        """Vectorize playlist tracks with the already fitted vectorizer."""
+        with stage('feature_strings'):
+            feature_strings = [track_feature_string(track, self.include_numeric) for track in playlist_tracks]
+        with stage('tfidf_transform'):
+            return self._vectorize(feature_strings)
+
+    def centroid(self, playlist_tracks):
+        """Mean TF-IDF vector of the playlist tracks."""
+        return playlist_centroid(self.transform, playlist_tracks)
+
+
+class HashedFeatureIndex(FeatureIndex):
+    """
+    TF-IDF over hashed terms: feature hashing into a fixed number of columns
+    replaces the fitted vocabulary, and the smoothed IDF weight of every
+    column is computed once from the catalog. Vectorizing a track needs no
+    fitted state besides that IDF array, so new tracks (including words the
+    catalog never had) are vectorized the same way in every worker. The
+    catalog matrix is float32 CSR, about half the size of the TF-IDF one.
+    Up to hash collisions, similarities equal those of FeatureIndex.
+    """
+
+    IDF_FILE = 'hashed_idf.npy'
+    MATRIX_FILE = 'hashed_matrix.npz'
+    META_FILE = 'hashed_meta.json'
+
+    def __init__(self, idf, catalog_matrix, fingerprint=None, version=None, include_numeric=True):
+        super().__init__(
+            _hashing_vectorizer(len(idf)), catalog_matrix.astype(np.float32, copy=False), fingerprint, version,
+            include_numeric,
+        )
+        self.idf = np.asarray(idf, dtype=np.float32)
+
+    @property
+    def n_features(self):
+        return len(self.idf)
+
+    @classmethod
+    def build(cls, spotify_data, include_numeric=True, n_features=2 ** 20):
+        """Hash every catalog row and weight the term counts by IDF computed from the catalog."""
+        start = time.perf_counter()
+        with stage('tfidf_fit'):
+            counts = _hashing_vectorizer(n_features).transform(catalog_feature_strings(spotify_data, include_numeric))
+            # Rows hold each column once, so column occurrences are document frequencies;
+            # the smoothing matches TfidfVectorizer(smooth_idf=True)
+            document_frequency = np.bincount(counts.indices, minlength=n_features)
+            idf = (np.log((1 + counts.shape[0]) / (1 + document_frequency)) + 1).astype(np.float32)
+            catalog_matrix = _tfidf_rows(counts, idf)
+        logger.info(
+            f"Built hashed feature index for {catalog_matrix.shape[0]} tracks "
+            f"({n_features} columns, {catalog_matrix.nnz} non-zeros) in {time.perf_counter() - start:.2f}s"
+        )
+        return cls(idf, catalog_matrix, fingerprint=catalog_fingerprint(spotify_data), include_numeric=include_numeric)
+
+    @classmethod
+    def load(cls, index_dir, spotify_data=None, include_numeric=True, n_features=None):
+        """
+        Load a prebuilt hashed index from disk.
+        Returns None if the index is missing or was built from a different catalog, feature set or dimension.
+        """
+        index_dir = Path(index_dir)
+        meta_path = index_dir / cls.META_FILE
+        if not meta_path.exists():
+            logger.info(f"No hashed feature index found at {index_dir}")
+            return None
+
+        try:
+            meta = json.loads(meta_path.read_text())
+            if spotify_data is not None and meta.get('fingerprint') != catalog_fingerprint(spotify_data):
+                logger.warning(f"Hashed feature index at {index_dir} does not match the loaded catalog, ignoring it")
+                return None
+            if meta.get('include_numeric', True) != include_numeric:
+                logger.warning(f"Hashed feature index at {index_dir} was built with a different feature set, ignoring it")
+                return None
+            if n_features is not None and meta.get('n_features') != n_features:
+                logger.warning(f"Hashed feature index at {index_dir} has a different dimension, ignoring it")
+                return None
+
+            idf = np.load(index_dir / cls.IDF_FILE)
+            catalog_matrix = sparse.load_npz(index_dir / cls.MATRIX_FILE)
+            logger.info(f"Loaded hashed feature index version {meta.get('version')} from {index_dir}")
+            return cls(idf, catalog_matrix, meta.get('fingerprint'), meta.get('version'), include_numeric)
+        except Exception as e:
+            logger.error(f"Error loading hashed feature index: {str(e)}")
+            return None
+
+    def save(self, index_dir):
+        """Persist the IDF weights, catalog matrix and metadata to index_dir."""
+        index_dir = Path(index_dir)
+        index_dir.mkdir(parents=True, exist_ok=True)
+        (index_dir / self.META_FILE).unlink(missing_ok=True)
+        np.save(index_dir / self.IDF_FILE, self.idf)
+        sparse.save_npz(index_dir / self.MATRIX_FILE, self.catalog_matrix)
+        # Metadata is written last so a partially written index is never picked up
+        (index_dir / self.META_FILE).write_text(json.dumps({
+            'version': self.version,
+            'fingerprint': self.fingerprint,
+            'include_numeric': self.include_numeric,
+            'n_features': self.n_features,
+            'rows': self.catalog_matrix.shape[0],
+        }, indent=2))
+        logger.info(f"Saved hashed feature index version {self.version} to {index_dir}")
+
+    def _vectorize(self, feature_strings):
+        return _tfidf_rows(self.vectorizer.transform(feature_strings), self.idf)
+
+
+def _hashing_vectorizer(n_features):
+    """Stateless term counter with TfidfVectorizer's tokenisation."""
+    return HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None, dtype=np.float32)
+
+
+def _tfidf_rows(counts, idf):
+    """L2-normalised TF-IDF rows from hashed term counts, in place."""
+    counts.data *= idf[counts.indices]
+    return normalize(counts, copy=False)
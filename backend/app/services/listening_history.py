@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def played_at_ms(item):
+    """Milliseconds since the epoch of a recently-played item's played_at, the unit of the after cursor."""
+    return int(datetime.fromisoformat(item['played_at'].replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def play_context_playlist(item):
+    """Id of the playlist a recently-played item was played from, or None."""
+    context = item.get('context')
+    if context and context.get('type') == 'playlist':
+        return context['uri'].split(':')[-1]
+    return None
+
+
+def format_playlist(playlist):
+    """Playlist fields returned by /api/top-playlists, without the play count."""
+    return {
+        'name': playlist['name'],
+        'description': playlist['description'],
+        'tracks_total': playlist['tracks']['total'],
+        'external_url': playlist['external_urls']['spotify'],
+        'images': playlist['images'],
+        'owner': playlist['owner']['display_name'],
+    }
+
+
+class ListeningHistoryStore:
+    """
+    Per-user listening history kept in SQLite and shared by every worker on
+    the host.
+
+    Recently-played items are ingested incrementally: the store remembers the
+    played_at of the newest item it has counted (the API's after cursor) and
+    only ever adds plays newer than that to the running per-playlist counters,
+    so overlapping or repeated syncs never count a play twice. The user's
+    playlists are stored with their snapshot_id and position, so top playlists
+    are ranked with one local query.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._memory = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS listening_sync ("
+                "user_id TEXT PRIMARY KEY, after_ms INTEGER, plays_synced_at REAL, playlists_synced_at REAL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS playlist_plays ("
+                "user_id TEXT NOT NULL, playlist_id TEXT NOT NULL, play_count INTEGER NOT NULL, "
+                "last_played_ms INTEGER NOT NULL, PRIMARY KEY (user_id, playlist_id))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS user_playlists ("
+                "user_id TEXT NOT NULL, playlist_id TEXT NOT NULL, snapshot_id TEXT, position INTEGER NOT NULL, "
+                "playlist TEXT NOT NULL, PRIMARY KEY (user_id, playlist_id))"
+            )
+
+    def _connection(self):
+        """
+        One SQLite connection per thread, reopened in forked worker processes.
+        Without a path all threads share one in-memory database.
+        """
+        if self.path is None:
+            if self._memory is None:
+                self._memory = sqlite3.connect(':memory:', check_same_thread=False)
+            return self._memory
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def sync_state(self, user_id):
+        """(after cursor in ms or None, plays synced at, playlists synced at) of a user."""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT after_ms, plays_synced_at, playlists_synced_at FROM listening_sync WHERE user_id = ?",
+                (user_id,),
+            ).fetchone()
+        return row or (None, None, None)
+
+    def record_plays(self, user_id, items):
+        """
+        Count the playlist plays among recently-played items that are newer than
+        the user's cursor and move the cursor to the newest of them. Returns the
+        new cursor. Runs as one write transaction, so concurrent syncs of the
+        same user from several workers count every play once.
+        """
+        with self._lock:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT after_ms FROM listening_sync WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                after = row[0] if row and row[0] is not None else -1
+                plays = {}
+                newest = after
+                for item in items:
+                    played_at = played_at_ms(item)
+                    if played_at <= after:
+                        continue
+                    newest = max(newest, played_at)
+                    playlist_id = play_context_playlist(item)
+                    if playlist_id is not None:
+                        count, last_played = plays.get(playlist_id, (0, 0))
+                        plays[playlist_id] = (count + 1, max(last_played, played_at))
+                connection.executemany(
+                    "INSERT INTO playlist_plays (user_id, playlist_id, play_count, last_played_ms) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (user_id, playlist_id) DO UPDATE SET play_count = play_count + excluded.play_count, "
+                    "last_played_ms = MAX(last_played_ms, excluded.last_played_ms)",
+                    [(user_id, playlist_id, count, last_played) for playlist_id, (count, last_played) in plays.items()],
+                )
+                cursor = newest if newest >= 0 else None
+                connection.execute(
+                    "INSERT INTO listening_sync (user_id, after_ms, plays_synced_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET after_ms = excluded.after_ms, "
+                    "plays_synced_at = excluded.plays_synced_at",
+                    (user_id, cursor, time.time()),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        if plays:
+            logger.info(f"Recorded {sum(count for count, _ in plays.values())} playlist plays for user {user_id}")
+        return cursor
+
+    def playlist_snapshots(self, user_id):
+        """snapshot_id by playlist id of the user's stored playlists."""
+        with self._lock:
+            return dict(self._connection().execute(
+                "SELECT playlist_id, snapshot_id FROM user_playlists WHERE user_id = ?", (user_id,)
+            ))
+
+    def replace_playlists(self, user_id, playlists):
+        """
+        Store the user's complete playlist listing, in order. Playlists whose
+        snapshot_id is unchanged only have their position updated; playlists
+        that are gone are dropped.
+        """
+        snapshots = self.playlist_snapshots(user_id)
+        changed = []
+        moved = []
+        for position, playlist in enumerate(playlists):
+            if snapshots.get(playlist['id'], object()) == playlist.get('snapshot_id'):
+                moved.append((position, user_id, playlist['id']))
+            else:
+                changed.append((
+                    user_id, playlist['id'], playlist.get('snapshot_id'), position, json.dumps(format_playlist(playlist))
+                ))
+        removed = set(snapshots) - {playlist['id'] for playlist in playlists}
+
+        with self._lock, self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO user_playlists (user_id, playlist_id, snapshot_id, position, playlist) "
+                "VALUES (?, ?, ?, ?, ?)",
+                changed,
+            )
+            connection.executemany(
+                "UPDATE user_playlists SET position = ? WHERE user_id = ? AND playlist_id = ?", moved
+            )
+            connection.executemany(
+                "DELETE FROM user_playlists WHERE user_id = ? AND playlist_id = ?",
+                [(user_id, playlist_id) for playlist_id in removed],
+            )
+            connection.execute(
+                "INSERT INTO listening_sync (user_id, playlists_synced_at) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET playlists_synced_at = excluded.playlists_synced_at",
+                (user_id, time.time()),
+            )
+        logger.info(
+            f"Stored {len(playlists)} playlists for user {user_id}: {len(changed)} changed, {len(removed)} removed"
+        )
+
+    def top_playlists(self, user_id, limit):
+        """The user's playlists by play count, ties in playlist listing order."""
+        with self._lock:
+            rows = self._connection().execute(
+                "SELECT p.playlist, COALESCE(c.play_count, 0) AS play_count FROM user_playlists p "
+                "LEFT JOIN playlist_plays c ON c.user_id = p.user_id AND c.playlist_id = p.playlist_id "
+                "WHERE p.user_id = ? ORDER BY play_count DESC, p.position LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [{**json.loads(playlist), 'play_count': play_count} for playlist, play_count in rows]
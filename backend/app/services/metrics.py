@@ -0,0 +1,179 @@
+import bisect
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond lookups to slow Spotify pagination
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PREFIX = 'recommender_'
+
+# Metric families recorded in this process: name -> (type, help)
+FAMILIES = {
+    'stage_duration_seconds': (
+        'histogram', 'Time spent in each stage of serving a request, e.g. Spotify pagination or scoring.'
+    ),
+    'http_request_duration_seconds': ('histogram', 'Time to produce the response of each endpoint.'),
+    'http_requests_total': ('counter', 'Responses by endpoint, method and status code.'),
+    'spotify_calls_total': ('counter', 'Spotify Web API calls by spotipy method name.'),
+}
+
+# Stage timings of the request being served, or None outside of one
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense; callers hold the lock."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Upper bounds are inclusive, so a value equal to a bound counts in that bucket
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and histograms of one process, rendered in the
+    Prometheus text exposition format. Every worker process keeps its own.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def histogram(self, name, **labels):
+        """(count, sum) of a histogram, or None if nothing was observed."""
+        with self._lock:
+            histogram = self._histograms.get((name, tuple(sorted(labels.items()))))
+            return None if histogram is None else (histogram.count, histogram.sum)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render(self, samples=()):
+        """
+        Exposition text of everything recorded here plus samples, an iterable of
+        (name, type, help, labels dict, value) read from elsewhere, e.g. cache stats.
+        """
+        families = {}
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                lines = families.setdefault(name, (*FAMILIES[name], []))[2]
+                cumulative = 0
+                for bound, count in zip((*self.buckets, math.inf), histogram.counts):
+                    cumulative += count
+                    lines.append(_sample(f"{name}_bucket", (*labels, ('le', _format(bound))), cumulative))
+                lines.append(_sample(f"{name}_sum", labels, histogram.sum))
+                lines.append(_sample(f"{name}_count", labels, histogram.count))
+            for (name, labels), value in sorted(self._counters.items()):
+                families.setdefault(name, (*FAMILIES[name], []))[2].append(_sample(name, labels, value))
+        for name, kind, help_text, labels, value in samples:
+            if value is not None:
+                families.setdefault(name, (kind, help_text, []))[2].append(
+                    _sample(name, tuple(sorted(labels.items())), value)
+                )
+
+        output = []
+        for name, (kind, help_text, lines) in families.items():
+            output.append(f"# HELP {PREFIX}{name} {help_text}")
+            output.append(f"# TYPE {PREFIX}{name} {kind}")
+            output.extend(lines)
+        return '\n'.join(output) + '\n'
+
+
+def _format(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _sample(name, labels, value):
+    if not labels:
+        return f"{PREFIX}{name} {_format(value)}"
+    rendered = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+    return f"{PREFIX}{name}{{{rendered}}} {_format(value)}"
+
+
+METRICS = MetricsRegistry()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block (or, as a decorator, a function) as a named stage: the
+    duration goes to the stage histogram and to the timing breakdown of the
+    request being served, if any.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        METRICS.observe('stage_duration_seconds', elapsed, stage=name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def count_spotify_call(method):
+    METRICS.inc('spotify_calls_total', method=method)
+
+
+def start_request_timing():
+    """Collect the stage timings of the current request into the returned list of (name, seconds)."""
+    timings = []
+    _request_timings.set(timings)
+    return timings
+
+
+def stop_request_timing():
+    _request_timings.set(None)
+
+
+def server_timing_header(timings, total=None):
+    """
+    Server-Timing header value for stage timings. Durations of a stage that ran
+    several times in the request are summed, so concurrent calls (e.g. audio
+    feature batches) can add up to more than the wall time.
+    """
+    totals = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.2f}")
+    return ', '.join(entries)
@@ -0,0 +1,107 @@
+import logging
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from app.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class RecommendationCache:
+    """
+    Playlist recommendation results keyed by playlist snapshot.
+
+    A playlist's snapshot_id changes whenever its tracks change, and the
+    recommendation service version changes whenever the catalog or an index is
+    rebuilt, so a hit is always the result a fresh computation would return.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.entries = LRUCache(max_entries, ttl)
+
+    @staticmethod
+    def key(playlist_id, snapshot_id, limit, version, exact=False, nprobe=None, fields=None, filters=None):
+        return (playlist_id, snapshot_id, limit, version, exact, nprobe, fields, filters)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, result):
+        self.entries.set(key, result)
+
+    def invalidate(self):
+        """Drop every cached result, e.g. after the recommendation indexes were rebuilt."""
+        logger.info(f"Invalidating {len(self.entries)} cached playlist recommendations")
+        self.entries.clear()
+
+    def stats(self):
+        return self.entries.stats()
+
+
+# Keeps cursor signatures apart from session cookies signed with the same SECRET_KEY
+CURSOR_SALT = 'recommendation-cursor'
+
+
+def encode_cursor(state, secret_key):
+    """Signed, URL-safe cursor for a page of a ranked recommendation list."""
+    return URLSafeSerializer(secret_key, salt=CURSOR_SALT).dumps(state)
+
+
+def decode_cursor(cursor, secret_key):
+    """
+    State of a cursor made by encode_cursor with the same key. Raises
+    ValueError for anything else, so a cursor cannot be made up to read ranked
+    lists cached for playlists the caller never had access to.
+    """
+    try:
+        state = URLSafeSerializer(secret_key, salt=CURSOR_SALT).loads(cursor)
+    except BadSignature:
+        raise ValueError("Invalid cursor")
+    if not isinstance(state, dict) or not {'args', 'offset', 'snapshot_id', 'version', 'session'} <= set(state):
+        raise ValueError("Invalid cursor")
+    # A validly signed cursor from another key rotation or release is still checked field by field
+    args, offset = state['args'], state['offset']
+    if not isinstance(args, list) or not all(
+        isinstance(arg, list) and len(arg) == 2 and all(isinstance(part, str) for part in arg) for arg in args
+    ):
+        raise ValueError("Invalid cursor")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("Invalid cursor")
+    if not isinstance(state['snapshot_id'], str) or not isinstance(state['version'], str):
+        raise ValueError("Invalid cursor")
+    if state['session'] is not None and not isinstance(state['session'], str):
+        raise ValueError("Invalid cursor")
+    return state
+
+
+class RankedListCache:
+    """
+    Ranked candidate lists (catalog rows and scores, best first) computed once
+    for the first page of a playlist's recommendations, from which later pages
+    are served through cursors at the cost of formatting one page.
+
+    Lists are keyed like RecommendationCache minus the page arguments. Cursors
+    carry the arguments the list was ranked with, so a worker that does not
+    hold the list (or no longer does) can rank it again.
+    """
+
+    def __init__(self, max_entries=256, ttl=None):
+        self.entries = LRUCache(max_entries, ttl)
+
+    @staticmethod
+    def key(playlist_id, snapshot_id, version, exact=False, nprobe=None, filters=None):
+        return (playlist_id, snapshot_id, version, exact, nprobe, filters)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, ranked):
+        self.entries.set(key, ranked)
+
+    def invalidate(self):
+        """Drop every ranked list, e.g. after the recommendation indexes were rebuilt."""
+        logger.info(f"Invalidating {len(self.entries)} ranked recommendation lists")
+        self.entries.clear()
+
+    def stats(self):
+        return self.entries.stats()
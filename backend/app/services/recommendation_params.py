@@ -0,0 +1,128 @@
+# Recommendation request parameters, kept free of the scoring dependencies
+# (pandas, scikit-learn) so routes and CLI commands import them cheaply
+import math
+import re
+
+ENGINES = ('text', 'audio', 'hybrid')
+ANN_MODES = ('exact', 'ivf')
+TEXT_FEATURES = ('tfidf', 'hashed')
+
+# Spotify ids are base62
+SPOTIFY_ID = re.compile(r'[0-9A-Za-z]+')
+PLAYLIST_URI_PREFIX = 'spotify:playlist:'
+PLAYLIST_URL_PREFIXES = ('https://open.spotify.com/playlist/', 'http://open.spotify.com/playlist/')
+
+# Filters that take one value; exclude_artists may be repeated
+SINGLE_VALUE_FILTERS = ('min_popularity', 'tempo_range', 'key', 'mode', 'exclude_playlist_tracks')
+
+REQUIRED_COLUMN = object()
+# (result key, catalog column, default when the catalog has no such column) of each recommendation
+RESULT_FIELDS = [
+    ('name', 'track_name', REQUIRED_COLUMN),
+    ('artist', 'artist_name', REQUIRED_COLUMN),
+    ('album', 'album_name', ''),
+    ('duration_ms', 'duration_ms', REQUIRED_COLUMN),
+    ('popularity', 'popularity', REQUIRED_COLUMN),
+    ('danceability', 'danceability', 0),
+    ('energy', 'energy', 0),
+    ('key', 'key', 0),
+    ('loudness', 'loudness', 0),
+    ('mode', 'mode', 0),
+    ('speechiness', 'speechiness', 0),
+    ('acousticness', 'acousticness', 0),
+    ('instrumentalness', 'instrumentalness', 0),
+    ('liveness', 'liveness', 0),
+    ('valence', 'valence', 0),
+    ('tempo', 'tempo', 0),
+    ('time_signature', 'time_signature', 4),
+]
+RECOMMENDATION_FIELDS = [field for field, column, default in RESULT_FIELDS] + ['similarity_score']
+
+
+def parse_fields(value):
+    """
+    Recommendation keys requested as a comma-separated string or a list, or
+    None for all of them. Raises ValueError for unknown keys.
+    """
+    if value is None:
+        return None
+    fields = value.split(',') if isinstance(value, str) else value
+    if not isinstance(fields, list) or not all(isinstance(field, str) for field in fields):
+        raise ValueError("fields must be a comma-separated string or a list of field names")
+    fields = [field.strip() for field in fields if field.strip()]
+    if not fields:
+        raise ValueError("fields must name at least one field")
+    unknown = [field for field in fields if field not in RECOMMENDATION_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid fields {unknown}. Choose from: {', '.join(RECOMMENDATION_FIELDS)}")
+    return tuple(dict.fromkeys(fields))
+
+
+def parse_playlist_id(value):
+    """
+    Bare id of a playlist given as an id, a spotify:playlist: URI or an
+    open.spotify.com URL, as spotipy normalises them. Raises ValueError for
+    anything that is not a base62 id, so request values never reach Web API
+    paths unchecked.
+    """
+    if not isinstance(value, str):
+        raise ValueError("playlist_id must be a string")
+    value = value.strip()
+    if value.startswith(PLAYLIST_URI_PREFIX):
+        value = value[len(PLAYLIST_URI_PREFIX):]
+    elif value.startswith(PLAYLIST_URL_PREFIXES):
+        value = value.split('/playlist/', 1)[1].split('?', 1)[0]
+    if not SPOTIFY_ID.fullmatch(value):
+        raise ValueError(f"Invalid playlist_id: {value}")
+    return value
+
+
+def _numbers(value, name, cast=float):
+    """The comma-separated finite numbers of a filter value; at least one is required."""
+    try:
+        numbers = [cast(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise ValueError(f"Invalid {name} parameter: {value}")
+    if not numbers or not all(math.isfinite(number) for number in numbers):
+        raise ValueError(f"Invalid {name} parameter: {value}")
+    return numbers
+
+
+def parse_filters(args):
+    """
+    Candidate filters from request arguments (a MultiDict), as a hashable tuple
+    of (filter, value) pairs usable in cache keys, or None without filters.
+    Raises ValueError for invalid values.
+    - min_popularity=40
+    - tempo_range=100-130 (BPM, inclusive)
+    - key=0,7 (pitch classes 0-11) and mode=1 (1 major, 0 minor)
+    - exclude_artists=A&exclude_artists=B (repeated, case-insensitive)
+    - exclude_playlist_tracks=true
+    """
+    for name in SINGLE_VALUE_FILTERS:
+        if len(args.getlist(name)) > 1:
+            raise ValueError(f"The {name} parameter can only be given once")
+    filters = {}
+    if args.get('min_popularity'):
+        filters['min_popularity'] = _numbers(args['min_popularity'], 'min_popularity', int)[0]
+    if args.get('tempo_range'):
+        low, separator, high = args['tempo_range'].partition('-')
+        bounds = _numbers(f"{low},{high}", 'tempo_range')
+        if not separator or len(bounds) != 2 or bounds[0] > bounds[1]:
+            raise ValueError("Invalid tempo_range parameter. Use min-max, e.g. 100-130.")
+        filters['tempo_range'] = tuple(bounds)
+    if args.get('key'):
+        keys = _numbers(args['key'], 'key', int)
+        if not all(0 <= key <= 11 for key in keys):
+            raise ValueError("Invalid key parameter. Keys are pitch classes between 0 and 11.")
+        filters['key'] = tuple(sorted(set(keys)))
+    if args.get('mode'):
+        if args['mode'] not in ('0', '1'):
+            raise ValueError("Invalid mode parameter. Must be 0 (minor) or 1 (major).")
+        filters['mode'] = int(args['mode'])
+    artists = [artist.strip() for artist in args.getlist('exclude_artists') if artist.strip()]
+    if artists:
+        filters['exclude_artists'] = tuple(sorted({artist.lower() for artist in artists}))
+    if args.get('exclude_playlist_tracks', 'false').lower() == 'true':
+        filters['exclude_playlist_tracks'] = True
+    return tuple(sorted(filters.items())) or None
@@ -1,127 +1,453 @@
+import copy
+import threading
 import numpy as np
 import pandas as pd
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from app.config.settings import Config
+from app.services.feature_index import FeatureIndex, HashedFeatureIndex
+from app.services.audio_feature_index import AudioFeatureIndex, parse_feature_weights
+from app.services.ann_index import IVFIndex
+from app.services.candidate_filters import CatalogFilterIndex
+from app.services.metrics import stage
+from app.services.recommendation_params import ANN_MODES, ENGINES, REQUIRED_COLUMN, RESULT_FIELDS, TEXT_FEATURES
+from app.services.scoring import (
+    SegmentedMatrix, chunked_top_k, chunked_top_k_columns, merge_top_k, merge_top_k_columns
+)
+from app.services.sharded_scorer import ShardedScorer
 import logging
 
 logger = logging.getLogger(__name__)
 
+# With the dense audio matrix, filters keeping more than this share of the
+# catalog scan it in slices and mask out the filtered scores, which is cheaper
+# than gathering the surviving rows; sparse rows are always gathered
+FILTER_GATHER_FRACTION = 0.1
+
 class RecommendationService:
-    def __init__(self, spotify_data):
+    def __init__(self, spotify_data, feature_index=None, audio_index=None, engine=None,
+                 text_weight=None, audio_weights=None, chunk_size=None, ann_index=None,
+                 ann_mode=None, nprobe=None, shards=None, text_features=None):
         self.spotify_data = spotify_data
-        self.vectorizer = TfidfVectorizer()
-        
-    def _prepare_track_features(self, track):
-        """Prepare track features for similarity calculation."""
-        # Text features
-        text_features = [
-            track['name'],
-            track['artist'],
-            track.get('album', ''),  # Using get() with default value in case album is missing
-        ]
-        
-        # Numeric features normalized to strings
-        numeric_features = [
-            f"duration:{track['duration_ms']}",
-            f"popularity:{track['popularity']}",
-            f"danceability:{track.get('danceability', 0)}",
-            f"energy:{track.get('energy', 0)}",
-            f"key:{track.get('key', 0)}",
-            f"loudness:{track.get('loudness', 0)}",
-            f"mode:{track.get('mode', 0)}",
-            f"speechiness:{track.get('speechiness', 0)}",
-            f"acousticness:{track.get('acousticness', 0)}",
-            f"instrumentalness:{track.get('instrumentalness', 0)}",
-            f"liveness:{track.get('liveness', 0)}",
-            f"valence:{track.get('valence', 0)}",
-            f"tempo:{track.get('tempo', 0)}",
-            f"time_signature:{track.get('time_signature', 4)}"
-        ]
-        
-        return ' '.join(text_features + numeric_features)
-    
-    def _calculate_similarity(self, playlist_tracks, limit=10):
+        self.engine = engine or Config.RECOMMENDER_ENGINE
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown recommender engine: {self.engine}")
+        self.text_features = text_features or Config.TEXT_FEATURES
+        if self.text_features not in TEXT_FEATURES:
+            raise ValueError(f"Unknown text features: {self.text_features}")
+        self.text_weight = Config.RECOMMENDER_TEXT_WEIGHT if text_weight is None else text_weight
+        self.chunk_size = chunk_size or Config.SCORING_CHUNK_SIZE
+        self.ann_mode = ann_mode or Config.ANN_MODE
+        if self.ann_mode not in ANN_MODES:
+            raise ValueError(f"Unknown ANN mode: {self.ann_mode}")
+        self.nprobe = nprobe or Config.ANN_NPROBE
+        if audio_weights is None:
+            audio_weights = parse_feature_weights(Config.AUDIO_FEATURE_WEIGHTS)
+
+        # Fall back to building the indexes in memory when no prebuilt ones were provided
+        self.feature_index = None
+        self.audio_index = None
+        if self.engine in ('text', 'hybrid'):
+            # Numbers are only tokenised into the text features when there is no audio engine
+            if feature_index is None and self.text_features == 'hashed':
+                feature_index = HashedFeatureIndex.build(
+                    spotify_data, include_numeric=self.engine == 'text', n_features=Config.TEXT_HASH_FEATURES
+                )
+            self.feature_index = feature_index or FeatureIndex.build(
+                spotify_data, include_numeric=self.engine == 'text'
+            )
+        if self.engine in ('audio', 'hybrid'):
+            self.audio_index = audio_index or AudioFeatureIndex.build(spotify_data, audio_weights)
+
+        self.ann_index = None
+        if self.ann_mode == 'ivf':
+            self.ann_index = ann_index or self._build_ann_index()
+
+        self.shards = Config.SCORING_SHARDS if shards is None else shards
+        self.sharded_scorer = None
+        if self.shards > 1:
+            self.sharded_scorer = ShardedScorer.build(
+                self._catalog_matrices(), self._engine_weights(), self.shards, self.chunk_size
+            )
+
+        # Built on the first filtered request, so unfiltered serving never pays for it
+        self._filter_index = None
+        self._filter_index_lock = threading.Lock()
+
+        # Catalog changes applied since the indexes were built: rows beyond
+        # indexed_rows are not in the ANN lists or the shards and are always
+        # scanned, and deleted rows are filtered out of every result
+        self.indexed_rows = len(spotify_data)
+        self.deleted = None
+        self.n_deleted = 0
+        self.generation = 0
+
+    @classmethod
+    def from_index_dir(cls, spotify_data, index_dir, engine=None, **kwargs):
+        """Create the service from prebuilt indexes in index_dir where they are usable."""
+        engine = engine or Config.RECOMMENDER_ENGINE
+        audio_weights = kwargs.get('audio_weights')
+        if audio_weights is None:
+            audio_weights = parse_feature_weights(Config.AUDIO_FEATURE_WEIGHTS)
+        text_features = kwargs.get('text_features') or Config.TEXT_FEATURES
+        feature_index = None
+        audio_index = None
+        ann_index = None
+        if engine in ('text', 'hybrid') and text_features == 'hashed':
+            feature_index = HashedFeatureIndex.load(
+                index_dir, spotify_data, include_numeric=engine == 'text', n_features=Config.TEXT_HASH_FEATURES
+            )
+        elif engine in ('text', 'hybrid'):
+            feature_index = FeatureIndex.load(index_dir, spotify_data, include_numeric=engine == 'text')
+        if engine in ('audio', 'hybrid'):
+            audio_index = AudioFeatureIndex.load(index_dir, spotify_data, audio_weights)
+        if (kwargs.get('ann_mode') or Config.ANN_MODE) == 'ivf' and (feature_index or audio_index):
+            # The ANN lists are only valid for the exact vectors they were built from
+            ann_index = IVFIndex.load(
+                index_dir,
+                cls._ann_fingerprint((feature_index or audio_index).fingerprint, engine, text_features),
+                cls._ann_text_weight(engine, kwargs.get('text_weight')),
+            )
+        return cls(spotify_data, feature_index, audio_index, engine, ann_index=ann_index, **kwargs)
+
+    @property
+    def version(self):
+        """Identifies the catalog, indexes and settings that results are computed from."""
+        parts = [self.engine, (self.feature_index or self.audio_index).fingerprint]
+        if isinstance(self.feature_index, HashedFeatureIndex):
+            parts.append('hashed')
+        if self.engine == 'hybrid':
+            parts.append(self.text_weight)
+        for index in (self.feature_index, self.audio_index, self.ann_index):
+            if index is not None:
+                parts.append(index.version)
+        if self.generation:
+            parts.append(f"g{self.generation}")
+        return ':'.join(str(part) for part in parts)
+
+    @property
+    def delta_rows(self):
+        """Catalog rows held in delta segments of the index matrices."""
+        return max(
+            [matrix.delta_rows for matrix in self._catalog_matrices().values() if isinstance(matrix, SegmentedMatrix)],
+            default=0,
+        )
+
+    def with_catalog(self, spotify_data, deleted=None):
+        """
+        Copy of the service for the catalog after incremental changes: rows
+        appended to spotify_data are vectorized into delta segments of the
+        indexes and rows flagged in deleted are excluded from results. The
+        existing service is left untouched, so readers holding it keep a
+        consistent view.
+        """
+        service = copy.copy(self)
+        appended = spotify_data.iloc[len(self.spotify_data):]
+        if len(appended):
+            if self.feature_index is not None:
+                service.feature_index = self.feature_index.with_rows(appended)
+            if self.audio_index is not None:
+                service.audio_index = self.audio_index.with_rows(appended)
+        service.spotify_data = spotify_data
+        service.deleted = deleted
+        service.n_deleted = int(deleted.sum()) if deleted is not None else 0
+        service.generation = self.generation + 1
+        return service
+
+    def close(self):
+        """Stop the sharded scorer's worker pool and remove its shard files."""
+        if self.sharded_scorer is not None:
+            self.sharded_scorer.close()
+
+    def merge_segments(self):
+        """Copy of the service with the index delta segments folded into their base matrices."""
+        service = copy.copy(self)
+        for name in ('feature_index', 'audio_index'):
+            index = getattr(self, name)
+            if index is not None and isinstance(index.catalog_matrix, SegmentedMatrix):
+                merged = copy.copy(index)
+                merged.catalog_matrix = index.catalog_matrix.merged()
+                setattr(service, name, merged)
+        return service
+
+    @staticmethod
+    def _ann_fingerprint(fingerprint, engine, text_features):
+        """Catalog fingerprint of the ANN index, distinct for each text-feature space it clusters."""
+        if engine != 'audio' and text_features == 'hashed':
+            return f"{fingerprint}:hashed"
+        return fingerprint
+
+    @staticmethod
+    def _ann_text_weight(engine, text_weight=None):
+        """Share of the text part in the ANN index space for the given engine."""
+        if engine == 'text':
+            return 1.0
+        if engine == 'audio':
+            return 0.0
+        return Config.RECOMMENDER_TEXT_WEIGHT if text_weight is None else text_weight
+
+    def _build_ann_index(self):
+        """Build an IVF index over the vectors of the configured engine."""
+        return IVFIndex.build(
+            text_matrix=self.feature_index.catalog_matrix if self.feature_index is not None else None,
+            audio_matrix=self.audio_index.catalog_matrix if self.audio_index is not None else None,
+            text_weight=self._ann_text_weight(self.engine, self.text_weight),
+            nlist=Config.ANN_NLIST or None,
+            dimensions=Config.ANN_DIMENSIONS,
+            chunk_size=self.chunk_size,
+            fingerprint=self._ann_fingerprint(
+                (self.feature_index or self.audio_index).fingerprint, self.engine, self.text_features
+            ),
+        )
+
+    def save_indexes(self, index_dir):
+        """Persist the indexes used by the configured engine."""
+        if self.feature_index is not None:
+            self.feature_index.save(index_dir)
+        if self.audio_index is not None:
+            self.audio_index.save(index_dir)
+        if self.ann_index is not None:
+            self.ann_index.save(index_dir)
+
+    def _catalog_matrices(self):
+        matrices = {}
+        if self.feature_index is not None:
+            matrices['text'] = self.feature_index.catalog_matrix
+        if self.audio_index is not None:
+            matrices['audio'] = self.audio_index.catalog_matrix
+        return matrices
+
+    def _engine_weights(self):
+        """Weight of each engine's similarity in the final score."""
+        if self.engine == 'text':
+            return {'text': 1.0}
+        if self.engine == 'audio':
+            return {'audio': 1.0}
+        return {'text': self.text_weight, 'audio': 1 - self.text_weight}
+
+    @stage('playlist_vectorize')
+    def _playlist_queries(self, playlist_tracks):
+        """Playlist centroid for each active engine."""
+        return {
+            'text': self.feature_index.centroid(playlist_tracks) if self.feature_index is not None else None,
+            'audio': self.audio_index.centroid(playlist_tracks) if self.audio_index is not None else None,
+        }
+
+    def _score_rows(self, queries, rows):
+        """Average similarity of the selected catalog rows (a slice or row array) to the playlist."""
+        if self.engine == 'text':
+            return self.feature_index.catalog_matrix[rows] @ queries['text']
+        if self.engine == 'audio':
+            return self.audio_index.catalog_matrix[rows] @ queries['audio']
+        return (
+            self.text_weight * (self.feature_index.catalog_matrix[rows] @ queries['text'])
+            + (1 - self.text_weight) * (self.audio_index.catalog_matrix[rows] @ queries['audio'])
+        )
+
+    def _ann_candidates(self, queries, nprobe):
+        """Candidate catalog rows from the ANN index, or None to scan the whole catalog."""
+        if self.ann_index is None or nprobe >= self.ann_index.nlist:
+            return None
+        query = self.ann_index.embed_query(queries['text'], queries['audio'])
+        rows = self.ann_index.candidates(query, nprobe)
+        if self.indexed_rows < len(self.spotify_data):
+            rows = np.concatenate([rows, np.arange(self.indexed_rows, len(self.spotify_data))])
+        return rows
+
+    def _exact_top_k(self, queries, k):
+        """
+        Top-k over the whole catalog, per column for stacked queries. Streams
+        over the catalog in chunks, keeping only a running top-k; with a
+        sharded scorer only the rows appended after its shards are scored here.
+        """
+        columns = np.ndim(next(query for query in queries.values() if query is not None)) == 2
+        n_rows = len(self.spotify_data)
+        results = []
+        start = 0
+        if self.sharded_scorer is not None:
+            results.append(self.sharded_scorer.top_k(queries, k))
+            start = self.indexed_rows
+        if start < n_rows:
+            select = chunked_top_k_columns if columns else chunked_top_k
+            indices, scores = select(
+                lambda chunk_start, chunk_stop: self._score_rows(
+                    queries, slice(start + chunk_start, start + chunk_stop)
+                ),
+                n_rows - start,
+                k,
+                self.chunk_size,
+            )
+            results.append((indices + start, scores))
+        if len(results) == 1:
+            return results[0]
+        return merge_top_k_columns(results, k) if columns else merge_top_k(results, k)
+
+    def _live(self, indices, scores, limit):
+        """The first limit results that are not deleted catalog rows."""
+        if self.deleted is not None:
+            keep = ~self.deleted[indices]
+            indices, scores = indices[keep], scores[keep]
+        return indices[:limit], scores[:limit]
+
+    @property
+    def filter_index(self):
+        """Candidate filter index over the rows the other indexes were built from."""
+        if self._filter_index is None:
+            with self._filter_index_lock:
+                if self._filter_index is None:
+                    self._filter_index = CatalogFilterIndex(self.spotify_data.iloc[:self.indexed_rows])
+        return self._filter_index
+
+    def check_filters(self, filters):
+        """Raise ValueError if filters need a column this catalog does not have."""
+        CatalogFilterIndex.check(filters, self.spotify_data.columns)
+
+    def _candidate_mask(self, filters, playlist_tracks):
+        """Mask of the catalog rows that pass filters and are not deleted, or None without filters."""
+        if not filters:
+            return None
+        mask = self.filter_index.compile(filters, self.spotify_data, playlist_tracks)
+        if self.deleted is not None:
+            mask &= ~self.deleted
+        return mask
+
+    def _filtered_top_k(self, queries, mask, limit, exact=False, nprobe=None):
+        """
+        Indices and scores of the limit best catalog rows in mask. Only the
+        surviving rows (of the ANN candidates, unless exact) are scored, so
+        narrow filters make requests cheaper.
+        """
+        rows = None if exact else self._ann_candidates(queries, nprobe or self.nprobe)
+        if rows is not None:
+            rows = rows[mask[rows]]
+        if rows is None or len(rows) < limit:
+            rows = np.flatnonzero(mask)
+            if self.audio_index is not None and len(rows) > len(mask) * FILTER_GATHER_FRACTION:
+                def score_rows(start, stop):
+                    scores = self._score_rows(queries, slice(start, stop))
+                    return np.where(mask[start:stop], scores, -np.inf)
+
+                indices, scores = chunked_top_k(score_rows, len(mask), limit, self.chunk_size)
+                keep = scores > -np.inf
+                return indices[keep], scores[keep]
+
+        positions, scores = chunked_top_k(
+            lambda start, stop: self._score_rows(queries, rows[start:stop]),
+            len(rows),
+            limit,
+            self.chunk_size,
+        )
+        return rows[positions], scores
+
+    @stage('scoring')
+    def _top_k(self, queries, limit, exact=False, nprobe=None, mask=None):
+        """Indices and scores of the limit best catalog rows, of those in mask if given."""
+        if mask is not None:
+            return self._filtered_top_k(queries, mask, limit, exact, nprobe)
+        # Over-fetch by the number of deleted rows so that filtering them still leaves limit results
+        k = limit + self.n_deleted
+        rows = None if exact else self._ann_candidates(queries, nprobe or self.nprobe)
+        if rows is None or len(rows) < k:
+            return self._live(*self._exact_top_k(queries, k), limit)
+
+        # Re-score the ANN candidates exactly
+        positions, scores = chunked_top_k(
+            lambda start, stop: self._score_rows(queries, rows[start:stop]),
+            len(rows),
+            k,
+            self.chunk_size,
+        )
+        return self._live(rows[positions], scores, limit)
+
+    @stage('format_results')
+    def _format_recommendations(self, top_indices, top_scores, fields=None):
+        """
+        Recommendation dicts for the given catalog rows and their similarity scores.
+        Each needed column is gathered for all rows with one take and converted to
+        Python values in bulk; fields limits the result to those keys.
+        """
+        columns = {}
+        for field, column, default in RESULT_FIELDS:
+            if fields is not None and field not in fields:
+                continue
+            if column not in self.spotify_data.columns and default is not REQUIRED_COLUMN:
+                columns[field] = [default] * len(top_indices)
+                continue
+            values = self.spotify_data[column].take(top_indices)
+            # JSON has no NaN, so missing values become None
+            if values.hasnans:
+                values = values.astype(object).where(values.notna(), None)
+            # tolist boxes numpy scalars as Python types so results are JSON serialisable
+            columns[field] = values.tolist()
+        if fields is None or 'similarity_score' in fields:
+            columns['similarity_score'] = np.asarray(top_scores, dtype=np.float64).tolist()
+        names = list(columns)
+        return [dict(zip(names, values)) for values in zip(*columns.values())]
+
+    def _calculate_similarity(self, playlist_tracks, limit=10, exact=False, nprobe=None, fields=None,
+                              filters=None):
         """Calculate similarity between playlist tracks and dataset tracks."""
         try:
-            # Prepare playlist tracks features
-            playlist_features = [self._prepare_track_features(track) for track in playlist_tracks]
-            
-            # Prepare dataset tracks features
-            dataset_features = self.spotify_data.apply(
-                lambda row: self._prepare_track_features({
-                    'name': row['track_name'],
-                    'artist': row['artist_name'],
-                    'album': row.get('album_name', ''),
-                    'duration_ms': row['duration_ms'],
-                    'popularity': row['popularity'],
-                    'danceability': row.get('danceability', 0),
-                    'energy': row.get('energy', 0),
-                    'key': row.get('key', 0),
-                    'loudness': row.get('loudness', 0),
-                    'mode': row.get('mode', 0),
-                    'speechiness': row.get('speechiness', 0),
-                    'acousticness': row.get('acousticness', 0),
-                    'instrumentalness': row.get('instrumentalness', 0),
-                    'liveness': row.get('liveness', 0),
-                    'valence': row.get('valence', 0),
-                    'tempo': row.get('tempo', 0),
-                    'time_signature': row.get('time_signature', 4)
-                }), axis=1
-            ).tolist()
-            
-            # Combine all features for vectorization
-            all_features = playlist_features + dataset_features
-            
-            # Create TF-IDF matrix
-            tfidf_matrix = self.vectorizer.fit_transform(all_features)
-            
-            # Calculate cosine similarity between playlist tracks and dataset tracks
-            playlist_matrix = tfidf_matrix[:len(playlist_features)]
-            dataset_matrix = tfidf_matrix[len(playlist_features):]
-            
-            # Calculate average similarity for each dataset track
-            similarities = cosine_similarity(dataset_matrix, playlist_matrix)
-            avg_similarities = np.mean(similarities, axis=1)
-            
-            # Get top similar tracks
-            top_indices = np.argsort(avg_similarities)[-limit:][::-1]
-            
-            # Format recommendations
-            recommendations = []
-            for idx in top_indices:
-                track = self.spotify_data.iloc[idx]
-                recommendations.append({
-                    'name': track['track_name'],
-                    'artist': track['artist_name'],
-                    'album': track.get('album_name', ''),
-                    'duration_ms': track['duration_ms'],
-                    'popularity': track['popularity'],
-                    'danceability': track.get('danceability', 0),
-                    'energy': track.get('energy', 0),
-                    'key': track.get('key', 0),
-                    'loudness': track.get('loudness', 0),
-                    'mode': track.get('mode', 0),
-                    'speechiness': track.get('speechiness', 0),
-                    'acousticness': track.get('acousticness', 0),
-                    'instrumentalness': track.get('instrumentalness', 0),
-                    'liveness': track.get('liveness', 0),
-                    'valence': track.get('valence', 0),
-                    'tempo': track.get('tempo', 0),
-                    'time_signature': track.get('time_signature', 4),
-                    'similarity_score': float(avg_similarities[idx])
-                })
-            
-            return recommendations
+            top_indices, top_scores = self.rank_playlist(playlist_tracks, limit, exact, nprobe, filters)
+            return self._format_recommendations(top_indices, top_scores, fields)
             
         except Exception as e:
             logger.error(f"Error calculating similarity: {str(e)}")
             raise
+
+    def rank_playlist(self, playlist_tracks, depth, exact=False, nprobe=None, filters=None):
+        """
+        Catalog rows and similarity scores of the depth best recommendations,
+        best first, to be formatted a page at a time with format_page.
+        """
+        mask = self._candidate_mask(filters, playlist_tracks)
+        queries = self._playlist_queries(playlist_tracks)
+        return self._top_k(queries, depth, exact, nprobe, mask)
+
+    def format_page(self, ranking, offset, limit, fields=None):
+        """Recommendations for positions offset..offset+limit-1 of a rank_playlist ranking."""
+        indices, scores = ranking
+        return self._format_recommendations(indices[offset:offset + limit], scores[offset:offset + limit], fields)
     
-    def get_playlist_recommendations(self, playlist_tracks, limit=10):
-        """Get recommendations based on playlist tracks."""
+    def get_playlist_recommendations(self, playlist_tracks, limit=10, exact=False, nprobe=None, fields=None,
+                                     filters=None):
+        """
+        Get recommendations based on playlist tracks.
+        exact forces a full catalog scan; nprobe overrides the ANN recall/latency trade-off;
+        fields (see parse_fields) limits each recommendation to those keys; filters
+        (see parse_filters) restricts the catalog rows that are scored.
+        """
         try:
-            recommendations = self._calculate_similarity(playlist_tracks, limit)
+            recommendations = self._calculate_similarity(playlist_tracks, limit, exact, nprobe, fields, filters)
             return recommendations
         except Exception as e:
             logger.error(f"Error getting playlist recommendations: {str(e)}")
-            raise 
\ No newline at end of file
+            raise 
+
+    def get_batch_recommendations(self, playlists_tracks, limit=10, fields=None):
+        """
+        Recommendations for several playlists at once.
+        The playlist centroids are stacked into one query matrix, so each chunk of
+        the catalog is scored for every playlist in a single matrix multiply.
+        Batches always scan the whole catalog, which they amortise across playlists.
+        """
+        try:
+            queries = [self._playlist_queries(tracks) for tracks in playlists_tracks]
+            if not queries:
+                return []
+            stacked = {
+                name: np.column_stack([query[name] for query in queries]) if queries[0][name] is not None else None
+                for name in ('text', 'audio')
+            }
+            with stage('scoring'):
+                top_indices, top_scores = self._exact_top_k(stacked, limit + self.n_deleted)
+            live = [self._live(top_indices[:, column], top_scores[:, column], limit) for column in range(len(queries))]
+            # The results of every playlist are formatted together, with one take per column
+            recommendations = self._format_recommendations(
+                np.concatenate([indices for indices, scores in live]),
+                np.concatenate([scores for indices, scores in live]),
+                fields,
+            )
+            ends = np.cumsum([len(indices) for indices, scores in live])
+            return [recommendations[end - len(indices):end] for end, (indices, scores) in zip(ends, live)]
+        except Exception as e:
+            logger.error(f"Error getting batch recommendations: {str(e)}")
+            raise
@@ -0,0 +1,164 @@
+import numpy as np
+from scipy import sparse
+
+
+def top_k(scores, k, indices=None):
+    """
+    Select the k highest scores without fully sorting the array.
+    Returns (indices, scores) ordered from best to worst. When indices is given,
+    it maps positions in scores to the row ids that should be returned.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    # Only the k selected scores are sorted
+    order = candidates[np.argsort(scores[candidates])[::-1]]
+    if indices is not None:
+        return np.asarray(indices)[order], scores[order]
+    return order, scores[order]
+
+
+def merge_top_k(results, k):
+    """Merge several (indices, scores) top-k results into a single top-k."""
+    results = [result for result in results if len(result[0])]
+    if not results:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    indices = np.concatenate([result[0] for result in results])
+    scores = np.concatenate([result[1] for result in results])
+    return top_k(scores, k, indices)
+
+
+def chunked_top_k(score_rows, n_rows, k, chunk_size):
+    """
+    Stream over rows [0, n_rows) in fixed-size chunks and keep a running top-k.
+    score_rows(start, stop) must return the scores of rows start..stop-1, so peak
+    memory is bounded by chunk_size + k regardless of the catalog size.
+    """
+    best = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        chunk_indices, chunk_scores = top_k(np.asarray(score_rows(start, stop)), k)
+        best = merge_top_k([best, (chunk_indices + start, chunk_scores)], k)
+    return best
+
+
+def top_k_columns(scores, k):
+    """
+    top_k for every column of a (rows, queries) score matrix at once.
+    Returns (indices, scores), each of shape (k, queries) and ordered best first.
+    """
+    k = min(k, scores.shape[0])
+    if k < scores.shape[0]:
+        candidates = np.argpartition(scores, -k, axis=0)[-k:]
+    else:
+        candidates = np.broadcast_to(np.arange(scores.shape[0])[:, None], scores.shape)
+    candidate_scores = np.take_along_axis(scores, candidates, axis=0)
+    order = np.argsort(-candidate_scores, axis=0, kind='stable')
+    return np.take_along_axis(candidates, order, axis=0), np.take_along_axis(candidate_scores, order, axis=0)
+
+
+def chunked_top_k_columns(score_rows, n_rows, k, chunk_size):
+    """
+    chunked_top_k for several queries scored together: score_rows(start, stop)
+    returns a (stop - start, queries) matrix and a running top-k is kept per column.
+    """
+    best_indices, best_scores = None, None
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        chunk_indices, chunk_scores = top_k_columns(np.asarray(score_rows(start, stop)), k)
+        chunk_indices = chunk_indices + start
+        if best_indices is None:
+            best_indices, best_scores = chunk_indices, chunk_scores
+            continue
+        best_indices, best_scores = merge_top_k_columns(
+            [(best_indices, best_scores), (chunk_indices, chunk_scores)], k
+        )
+    return best_indices, best_scores
+
+
+def merge_top_k_columns(results, k):
+    """Merge several (indices, scores) results of top_k_columns into a single per-column top-k."""
+    indices = np.concatenate([result[0] for result in results])
+    positions, scores = top_k_columns(np.concatenate([result[1] for result in results]), k)
+    return np.take_along_axis(indices, positions, axis=0), scores
+
+
+def playlist_centroid(vectorize, playlist_tracks, batch_size=1000):
+    """
+    Running mean of the L2-normalised playlist vectors, vectorized batch by batch.
+    The dot product of a normalised catalog row with this centroid equals its
+    average cosine similarity to the playlist tracks.
+    """
+    total = None
+    for start in range(0, len(playlist_tracks), batch_size):
+        batch_sum = np.asarray(vectorize(playlist_tracks[start:start + batch_size]).sum(axis=0)).ravel()
+        total = batch_sum if total is None else total + batch_sum
+    if total is None:
+        raise ValueError("Playlist has no tracks")
+    return total / len(playlist_tracks)
+
+
+class SegmentedMatrix:
+    """
+    Catalog matrix made of a base segment and a delta segment of rows appended
+    since, indexed like a single matrix. Appending only copies the (small)
+    delta, so the base, often memory-mapped, is never rewritten; merged()
+    folds the delta into a new base.
+    """
+
+    def __init__(self, base, delta):
+        self.base = base
+        self.delta = delta
+
+    @property
+    def shape(self):
+        return self.base.shape[0] + self.delta.shape[0], self.base.shape[1]
+
+    @property
+    def delta_rows(self):
+        return self.delta.shape[0]
+
+    def _stack(self, parts):
+        if sparse.issparse(self.base):
+            return sparse.vstack(parts, format='csr')
+        return np.concatenate(parts)
+
+    def __getitem__(self, rows):
+        """Rows for a contiguous slice or an array of row indices."""
+        n_base = self.base.shape[0]
+        if isinstance(rows, slice):
+            start, stop, _ = rows.indices(self.shape[0])
+            if stop <= n_base:
+                return self.base[start:stop]
+            if start >= n_base:
+                return self.delta[start - n_base:stop - n_base]
+            return self._stack([self.base[start:n_base], self.delta[:stop - n_base]])
+
+        rows = np.asarray(rows)
+        in_base = rows < n_base
+        if in_base.all():
+            return self.base[rows]
+        if not in_base.any():
+            return self.delta[rows - n_base]
+        stacked = self._stack([self.base[rows[in_base]], self.delta[rows[~in_base] - n_base]])
+        # Put the rows of both segments back into the requested order
+        order = np.concatenate([np.flatnonzero(in_base), np.flatnonzero(~in_base)])
+        return stacked[np.argsort(order)]
+
+    def append(self, rows):
+        return SegmentedMatrix(self.base, self._stack([self.delta, rows]))
+
+    def merged(self):
+        return self._stack([self.base, self.delta])
+
+
+def append_rows(matrix, rows):
+    """matrix with rows appended in a delta segment."""
+    if isinstance(matrix, SegmentedMatrix):
+        return matrix.append(rows)
+    return SegmentedMatrix(matrix, rows)
@@ -0,0 +1,324 @@
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+from app.services.audio_features_cache import AudioFeaturesCache
+from app.services.listening_history import ListeningHistoryStore
+from app.services.recommendation_cache import RankedListCache, RecommendationCache
+from app.services.spotify_scheduler import RetryBudget, SpotifyCallScheduler
+
+# The catalog, scoring and Spotify client modules (pandas, scikit-learn, spotipy)
+# are imported when the services are built, so creating the app stays cheap
+
+logger = logging.getLogger(__name__)
+
+EXTENSION_KEY = 'service_registry'
+
+
+class ServiceRegistry:
+    """
+    Application-scoped owner of the catalog and the services built on it.
+    The catalog is loaded once per application; under a preloading server
+    (gunicorn --preload) that happens in the master before workers fork.
+    With SERVICE_WARMUP=background or lazy it is loaded on a warm-up thread
+    instead, while the app already answers health checks and reports 503
+    for the routes that need the catalog.
+    """
+
+    NOT_LOADED = 'not_loaded'
+    LOADING = 'loading'
+    READY = 'ready'
+    FAILED = 'failed'
+    # Seconds a replaced recommendation service's sharded scorer stays open for
+    # requests that were already using it
+    RETIRE_GRACE = 30.0
+
+    def __init__(self, config):
+        self.config = config
+        self.state = self.NOT_LOADED
+        self.error = None
+        self.load_seconds = None
+        self.data_service = None
+        self.recommendation_service = None
+        self.spotify_service = None
+        self.spotify_clients = None
+        # One rate limit for every Spotify call this process makes
+        self.spotify_scheduler = SpotifyCallScheduler(
+            config['SPOTIFY_RATE_LIMIT'], config['SPOTIFY_RATE_BURST'], config['SPOTIFY_MAX_RETRIES'],
+            RetryBudget(config['SPOTIFY_RETRY_BUDGET'])
+        )
+        self.recommendation_cache = RecommendationCache(
+            config['RECOMMENDATION_CACHE_MAX_ENTRIES'],
+            config['RECOMMENDATION_CACHE_TTL'],
+        )
+        self.ranked_lists = RankedListCache(
+            config['RECOMMENDATION_RANKED_LISTS_MAX_ENTRIES'],
+            config['RECOMMENDATION_CURSOR_TTL'],
+        )
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._loader_pid = None
+        self._catalog_lock = threading.Lock()
+        self._maintenance = threading.Lock()
+
+    @property
+    def ready(self):
+        return self.state == self.READY
+
+    def _claim_load(self):
+        """
+        Mark the services as loading by this process. False if they are loaded
+        or already loading here; a load inherited from a parent process that
+        forked mid-load has no thread left and is claimed again.
+        """
+        with self._lock:
+            if self.state == self.READY:
+                return False
+            if self.state == self.LOADING and self._loader_pid == os.getpid():
+                return False
+            self.state = self.LOADING
+            self.error = None
+            self._loader_pid = os.getpid()
+            self._loaded = threading.Event()
+            return True
+
+    def load(self):
+        """Load the catalog and build the services, once. Waits for a warm-up already running."""
+        if self._claim_load():
+            self._load()
+        else:
+            self._loaded.wait()
+        return self
+
+    def start_warmup(self):
+        """
+        Load the services on a background thread and return at once. Does
+        nothing if they are loaded, loading in this process or failed to load.
+        """
+        if self.state == self.FAILED or not self._claim_load():
+            return self
+        threading.Thread(target=self._load, name='service-warmup', daemon=True).start()
+        return self
+
+    def _load(self):
+        from app.services.data_service import DataService
+        from app.services.spotify_client_pool import SpotifyClientPool, SpotifyTokenStore
+        from app.services.spotify_service import SpotifyService
+
+        start = time.perf_counter()
+        try:
+            data_service = DataService(self.config['DATA_DIR'], self.config['COLUMNAR_DIR'])
+            if self.spotify_service is None:
+                self.spotify_service = SpotifyService(
+                    audio_features_cache=self._build_audio_features_cache(),
+                    catalog=data_service,
+                    scheduler=self.spotify_scheduler,
+                    listening_history=ListeningHistoryStore(self.config['LISTENING_HISTORY_PATH'] or None)
+                )
+            if self.spotify_clients is None:
+                self.spotify_clients = SpotifyClientPool(
+                    audio_features_cache=self.spotify_service.audio_features_cache,
+                    catalog=data_service,
+                    token_store=SpotifyTokenStore(self.config['SPOTIFY_TOKEN_STORE_PATH'] or None),
+                    scheduler=self.spotify_scheduler,
+                    listening_history=self.spotify_service.listening_history,
+                )
+
+            self.recommendation_service = self._load_catalog(data_service)
+            self.data_service = data_service
+            self.load_seconds = time.perf_counter() - start
+            self.state = self.READY
+            logger.info(f"Services ready with {data_service.live_rows} catalog rows in {self.load_seconds:.2f}s")
+        except Exception as e:
+            self.error = str(e)
+            self.state = self.FAILED
+            logger.error(f"Error loading services: {str(e)}")
+        finally:
+            self._loaded.set()
+
+    def _load_catalog(self, data_service):
+        """Load the catalog files plus logged changes and return the recommendation service for them."""
+        from app.services.recommendation_service import RecommendationService
+        spotify_data = data_service.load_spotify_data()
+        if spotify_data is None:
+            raise RuntimeError("Failed to load Spotify data")
+        recommendation_service = RecommendationService.from_index_dir(spotify_data, self.config['FEATURE_INDEX_DIR'])
+        if data_service.replay_changes() is not None:
+            recommendation_service = recommendation_service.with_catalog(
+                data_service.spotify_data, data_service.deleted_rows
+            )
+        return recommendation_service
+
+    def apply_catalog_changes(self, upserts=None, delete_ids=None):
+        """
+        Upsert and delete catalog tracks. The change is logged for every
+        worker and applied here before returning, so it is visible to this
+        worker's next request. Returns the applied change counts.
+        """
+        self.data_service.log_changes(upserts, delete_ids)
+        return self.refresh_catalog() or {"upserted": 0, "deleted": 0}
+
+    def refresh_catalog(self):
+        """
+        Apply catalog changes logged by any worker since the last refresh.
+        Cheap when there are none. Returns the applied change counts or None.
+        """
+        if not self.ready or not self.data_service.has_pending_changes():
+            return None
+        if self.data_service.log_compacted():
+            # The catalog files were rewritten: load them again off the request path
+            self._run_in_background(self._reload_catalog)
+            return None
+
+        with self._catalog_lock:
+            totals = self.data_service.replay_changes()
+            if totals is not None:
+                self.set_recommendation_service(self.recommendation_service.with_catalog(
+                    self.data_service.spotify_data, self.data_service.deleted_rows
+                ))
+        if self.recommendation_service.delta_rows >= self.config['CATALOG_DELTA_MERGE_ROWS']:
+            self._run_in_background(self._merge_segments)
+        return totals
+
+    def _run_in_background(self, task):
+        # One catalog maintenance task at a time; the thread is started on
+        # demand so it also works in workers forked after loading
+        if not self._maintenance.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                task()
+            except Exception as e:
+                logger.error(f"Error maintaining catalog: {str(e)}")
+            finally:
+                self._maintenance.release()
+
+        threading.Thread(target=run, name='catalog-maintenance', daemon=True).start()
+
+    def _merge_segments(self):
+        recommendation_service = self.recommendation_service
+        merged = recommendation_service.merge_segments()
+        with self._catalog_lock:
+            # Results do not change, so cached ones stay valid
+            if self.recommendation_service is recommendation_service:
+                self.recommendation_service = merged
+                self._retire(recommendation_service, merged)
+                logger.info("Merged catalog index segments")
+
+    def _reload_catalog(self):
+        from app.services.data_service import DataService
+        data_service = DataService(self.config['DATA_DIR'], self.config['COLUMNAR_DIR'])
+        recommendation_service = self._load_catalog(data_service)
+        with self._catalog_lock:
+            self.data_service.install(data_service)
+            self.set_recommendation_service(recommendation_service)
+        logger.info(f"Reloaded compacted catalog with {data_service.live_rows} rows")
+
+    def set_recommendation_service(self, recommendation_service):
+        """Swap in a service built from rebuilt indexes and drop results cached for the old one."""
+        previous = self.recommendation_service
+        self.recommendation_service = recommendation_service
+        self.recommendation_cache.invalidate()
+        self.ranked_lists.invalidate()
+        self._retire(previous, recommendation_service)
+
+    def _retire(self, previous, current):
+        # Services derived by with_catalog or merge_segments share their sharded
+        # scorer; one built from reloaded files has its own. The old one's worker
+        # processes and shard files are released once requests that picked up
+        # the old service before the swap have had RETIRE_GRACE seconds to finish
+        if previous is not None and previous.sharded_scorer is not current.sharded_scorer:
+            timer = threading.Timer(self.RETIRE_GRACE, previous.close)
+            timer.daemon = True
+            timer.start()
+
+    def _build_audio_features_cache(self):
+        return AudioFeaturesCache(
+            self.config['AUDIO_FEATURES_CACHE_PATH'] or None,
+            max_entries=self.config['AUDIO_FEATURES_CACHE_MAX_ENTRIES'],
+            ttl=self.config['AUDIO_FEATURES_CACHE_TTL'],
+            memory_entries=self.config['AUDIO_FEATURES_CACHE_MEMORY_ENTRIES'],
+        )
+
+    def status(self):
+        """Loading state of the registry, for readiness reporting."""
+        status = {'state': self.state}
+        if self.error:
+            status['error'] = self.error
+        if self.load_seconds is not None:
+            status['load_seconds'] = round(self.load_seconds, 3)
+        if self.data_service is not None and self.data_service.spotify_data is not None:
+            status['catalog_rows'] = self.data_service.live_rows
+        if self.recommendation_service is not None:
+            status['index_version'] = self.recommendation_service.version
+        return status
+
+    def metric_samples(self):
+        """Service gauges and counters for the metrics endpoint, as (name, type, help, labels, value)."""
+        samples = [
+            ('ready', 'gauge', 'Whether the catalog and services are loaded.', {}, int(self.ready)),
+        ]
+        if self.data_service is not None and self.data_service.spotify_data is not None:
+            samples.append(('catalog_rows', 'gauge', 'Live tracks in the catalog.', {}, self.data_service.live_rows))
+        if self.recommendation_service is not None:
+            samples.append((
+                'catalog_delta_rows', 'gauge', 'Catalog rows in index delta segments awaiting a merge.',
+                {}, self.recommendation_service.delta_rows
+            ))
+
+        for name, value in self.spotify_scheduler.stats().items():
+            if name in ('in_flight', 'retry_budget'):
+                samples.append((
+                    f"spotify_scheduler_{name}", 'gauge', f"Spotify call scheduler {name.replace('_', ' ')}.",
+                    {}, value
+                ))
+            else:
+                samples.append((
+                    f"spotify_scheduler_{name}_total", 'counter',
+                    f"Spotify call scheduler {name.replace('_', ' ')} since start.", {}, value
+                ))
+
+        caches = {'recommendations': self.recommendation_cache.stats(), 'ranked_lists': self.ranked_lists.stats()}
+        audio_features_cache = getattr(self.spotify_service, 'audio_features_cache', None)
+        if audio_features_cache is not None:
+            audio_stats = audio_features_cache.stats()
+            caches['audio_features'] = audio_stats
+            caches['audio_features_memory'] = audio_stats['memory']
+            caches['audio_features_disk'] = {
+                'hits': audio_stats['disk_hits'], 'misses': audio_stats['disk_misses']
+            }
+        for cache, stats in caches.items():
+            labels = {'cache': cache}
+            samples.append(('cache_hits_total', 'counter', 'Cache lookups that found an entry.', labels, stats['hits']))
+            samples.append(('cache_misses_total', 'counter', 'Cache lookups that found nothing.', labels, stats['misses']))
+            lookups = stats['hits'] + stats['misses']
+            samples.append((
+                'cache_hit_ratio', 'gauge', 'Share of cache lookups that found an entry.',
+                labels, stats['hits'] / lookups if lookups else None
+            ))
+            if 'entries' in stats:
+                samples.append(('cache_entries', 'gauge', 'Entries held by an in-memory cache.', labels, stats['entries']))
+                samples.append(('cache_evictions_total', 'counter', 'Entries evicted to stay within the size bound.',
+                                labels, stats['evictions']))
+        return samples
+
+    def init_app(self, app):
+        app.extensions[EXTENSION_KEY] = self
+        if self.config.get('SERVICE_WARMUP', 'eager') in ('background', 'lazy'):
+            # Starts the warm-up on the first request of a lazy app, and again in
+            # workers forked from a master whose warm-up thread did not come along
+            app.before_request(self._warm_up_before_request)
+        return self
+
+    def _warm_up_before_request(self):
+        if not self.ready:
+            self.start_warmup()
+
+
+def get_registry():
+    """Service registry of the current application."""
+    return current_app.extensions[EXTENSION_KEY]
@@ -0,0 +1,188 @@
+import atexit
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+from app.services.scoring import chunked_top_k, chunked_top_k_columns, merge_top_k, merge_top_k_columns
+
+logger = logging.getLogger(__name__)
+
+# RAM-backed, so shard files are plain shared memory where it exists
+SHARED_MEMORY_DIR = '/dev/shm'
+
+# Shards a worker process has already mapped, by (shard_dir, shard)
+_worker_shards = {}
+
+
+def _shard_path(shard_dir, shard, name):
+    return Path(shard_dir) / f"shard{shard:03d}_{name}.npy"
+
+
+def _load_shard(shard_dir, shard):
+    """Memory-map one shard's matrices inside a worker process, once per process."""
+    key = (shard_dir, shard)
+    if key not in _worker_shards:
+        matrices = {}
+        if _shard_path(shard_dir, shard, 'audio').exists():
+            matrices['audio'] = np.load(_shard_path(shard_dir, shard, 'audio'), mmap_mode='r')
+        if _shard_path(shard_dir, shard, 'text_indptr').exists():
+            indptr = np.load(_shard_path(shard_dir, shard, 'text_indptr'), mmap_mode='r')
+            matrices['text'] = sparse.csr_matrix((
+                np.load(_shard_path(shard_dir, shard, 'text_data'), mmap_mode='r'),
+                np.load(_shard_path(shard_dir, shard, 'text_indices'), mmap_mode='r'),
+                indptr,
+            ), shape=tuple(np.load(_shard_path(shard_dir, shard, 'text_shape'))), copy=False)
+        _worker_shards[key] = matrices
+    return _worker_shards[key]
+
+
+def _warm_shard(shard_dir, shard):
+    _load_shard(shard_dir, shard)
+    return os.getpid()
+
+
+def _score_shard(shard_dir, shard, offset, queries, weights, k, chunk_size):
+    """Top-k rows of one shard, as global catalog row indices."""
+    matrices = _load_shard(shard_dir, shard)
+    n_rows = next(iter(matrices.values())).shape[0]
+
+    def score_rows(start, stop):
+        scores = 0
+        for name, weight in weights.items():
+            scores = scores + weight * (matrices[name][start:stop] @ queries[name])
+        return scores
+
+    if np.ndim(next(iter(queries.values()))) == 2:
+        indices, scores = chunked_top_k_columns(score_rows, n_rows, k, chunk_size)
+    else:
+        indices, scores = chunked_top_k(score_rows, n_rows, k, chunk_size)
+    return indices + offset, scores
+
+
+class ShardedScorer:
+    """
+    Scores the catalog across several processes.
+
+    The engine's catalog matrices are split into row shards written as .npy
+    files (under /dev/shm where available) that every worker memory-maps, so
+    all processes share one copy of the catalog. Each request scores every
+    shard in parallel on a pool of warm worker processes and merges the
+    per-shard top-k results. The pool is started lazily in each process that
+    scores, so the scorer can be built before a preloading server forks.
+    """
+
+    def __init__(self, shard_dir, shard_offsets, weights, chunk_size, workers=None, owner=True):
+        self.shard_dir = str(shard_dir)
+        self.shard_offsets = shard_offsets
+        self.weights = weights
+        self.chunk_size = chunk_size
+        self.workers = workers or len(shard_offsets) - 1
+        self._owner_pid = os.getpid() if owner else None
+        self._executor = None
+        self._executor_pid = None
+        # Request threads scoring at once on a fresh worker start a single pool
+        self._pool_lock = threading.Lock()
+        # Scoring calls in flight; close waits for them and later calls raise
+        self._in_use = threading.Condition()
+        self._active = 0
+        self.closed = False
+        atexit.register(self.close, 10)
+
+    @property
+    def n_shards(self):
+        return len(self.shard_offsets) - 1
+
+    @classmethod
+    def build(cls, matrices, weights, n_shards, chunk_size, workers=None, directory=None):
+        """Write matrices ({'text': csr, 'audio': ndarray}) as n_shards row shards and return a scorer."""
+        if directory is None and os.path.isdir(SHARED_MEMORY_DIR):
+            directory = SHARED_MEMORY_DIR
+        shard_dir = tempfile.mkdtemp(prefix='catalog-shards-', dir=directory)
+        n_rows = next(iter(matrices.values())).shape[0]
+        # Every shard holds at least one row; an empty one has no top-k to merge
+        n_shards = max(1, min(n_shards, n_rows))
+        offsets = np.linspace(0, n_rows, n_shards + 1).astype(np.int64).tolist()
+
+        for shard in range(n_shards):
+            start, stop = offsets[shard], offsets[shard + 1]
+            for name, matrix in matrices.items():
+                if name == 'text':
+                    rows = matrix[start:stop]
+                    np.save(_shard_path(shard_dir, shard, 'text_data'), rows.data)
+                    np.save(_shard_path(shard_dir, shard, 'text_indices'), rows.indices)
+                    np.save(_shard_path(shard_dir, shard, 'text_indptr'), rows.indptr)
+                    np.save(_shard_path(shard_dir, shard, 'text_shape'), np.asarray(rows.shape))
+                else:
+                    np.save(_shard_path(shard_dir, shard, name), np.ascontiguousarray(matrix[start:stop]))
+        logger.info(f"Wrote {n_shards} catalog shards of ~{n_rows // n_shards} rows to {shard_dir}")
+        return cls(shard_dir, offsets, weights, chunk_size, workers)
+
+    def _pool(self):
+        """Worker pool of the current process, started and warmed on first use."""
+        executor = self._executor
+        if executor is not None and self._executor_pid == os.getpid():
+            return executor
+        with self._pool_lock:
+            if self.closed:
+                raise RuntimeError("Sharded scorer is closed")
+            if self._executor is None or self._executor_pid != os.getpid():
+                executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+                # Map every shard up front so the first request does not pay for it
+                list(executor.map(_warm_shard, [self.shard_dir] * self.n_shards, range(self.n_shards)))
+                self._executor = executor
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def warm_up(self):
+        self._pool()
+        return self
+
+    def top_k(self, queries, k):
+        """
+        Top-k catalog rows for a query vector per engine, or per column for
+        stacked (dimensions, playlists) queries, merged across shards.
+        """
+        queries = {name: queries[name] for name in self.weights}
+        with self._in_use:
+            if self.closed:
+                raise RuntimeError("Sharded scorer is closed")
+            self._active += 1
+        try:
+            futures = [
+                self._pool().submit(
+                    _score_shard, self.shard_dir, shard, self.shard_offsets[shard], queries, self.weights, k,
+                    self.chunk_size
+                )
+                for shard in range(self.n_shards)
+            ]
+            results = [future.result() for future in futures]
+        finally:
+            with self._in_use:
+                self._active -= 1
+                self._in_use.notify_all()
+        if np.ndim(next(iter(queries.values()))) == 1:
+            return merge_top_k(results, k)
+        return merge_top_k_columns(results, k)
+
+    def close(self, timeout=None):
+        """Wait for scoring calls in flight (up to timeout seconds), then stop the pool and remove the shards."""
+        with self._in_use:
+            self.closed = True
+            self._in_use.wait_for(lambda: self._active == 0, timeout)
+        with self._pool_lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+        if self._owner_pid == os.getpid():
+            shutil.rmtree(self.shard_dir, ignore_errors=True)
+            self._owner_pid = None
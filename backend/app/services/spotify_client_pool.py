@@ -0,0 +1,238 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import spotipy
+from spotipy.cache_handler import CacheHandler, MemoryCacheHandler
+from spotipy.oauth2 import SpotifyOAuth
+
+from app.config.settings import Config
+from app.services.cache import LRUCache
+from app.services.spotify_scheduler import SpotifyCallScheduler
+from app.services.spotify_service import SpotifyService, build_http_session
+
+logger = logging.getLogger(__name__)
+
+# Tokens this close to expiry are refreshed before use rather than in the background
+MIN_TOKEN_LIFETIME = 60
+
+
+class SpotifyTokenStore:
+    """
+    OAuth tokens by session id, persisted in SQLite so every worker on the
+    host can serve a session that logged in through another one.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._tokens = {}
+        self._local = threading.local()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._connection() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS spotify_tokens ("
+                    "session_id TEXT PRIMARY KEY, token_info TEXT NOT NULL, updated_at REAL NOT NULL)"
+                )
+
+    def _connection(self):
+        """One SQLite connection per thread, reopened in forked worker processes."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, session_id):
+        if self.path is None:
+            return self._tokens.get(session_id)
+        row = self._connection().execute(
+            "SELECT token_info FROM spotify_tokens WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, token_info):
+        if self.path is None:
+            self._tokens[session_id] = token_info
+            return
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO spotify_tokens (session_id, token_info, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(token_info), time.time()),
+            )
+
+    def delete(self, session_id):
+        if self.path is None:
+            self._tokens.pop(session_id, None)
+            return
+        with self._connection() as connection:
+            connection.execute("DELETE FROM spotify_tokens WHERE session_id = ?", (session_id,))
+
+
+class UserTokenManager(CacheHandler):
+    """
+    Auth manager for one session's spotipy client.
+
+    The current token is kept in memory and returned without locking while it
+    has more than refresh_margin seconds left. Inside the margin it is
+    refreshed once in the background while callers keep using the still-valid
+    token; only an (almost) expired token makes callers wait, and then only
+    callers of the same session, on that session's own lock.
+    """
+
+    def __init__(self, session_id, oauth, store, refresher, refresh_margin=300, clock=time.time):
+        self.session_id = session_id
+        self.oauth = oauth
+        self.store = store
+        self.refresher = refresher
+        self.refresh_margin = refresh_margin
+        self.token_info = None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._background_refresh = threading.Lock()
+
+    # spotipy CacheHandler interface, used by SpotifyOAuth when it obtains a token
+    def get_cached_token(self):
+        return self.token_info
+
+    def save_token_to_cache(self, token_info):
+        self.token_info = token_info
+        self.store.save(self.session_id, token_info)
+
+    def get_access_token(self, as_dict=False):
+        """Current access token; the auth manager interface spotipy.Spotify calls per request."""
+        token_info = self.token_info
+        if token_info is None:
+            raise spotipy.SpotifyOauthError("Session is not authorized with Spotify")
+        remaining = token_info['expires_at'] - self._clock()
+        if remaining <= MIN_TOKEN_LIFETIME:
+            token_info = self.refresh(if_older_than=token_info)
+        elif remaining <= self.refresh_margin:
+            self._refresh_in_background(token_info)
+        return token_info if as_dict else token_info['access_token']
+
+    def refresh(self, if_older_than=None):
+        """Refresh the token unless another caller already replaced if_older_than."""
+        with self._lock:
+            if if_older_than is None or self.token_info is if_older_than:
+                logger.info(f"Refreshing Spotify token for session {self.session_id[:8]}")
+                self.oauth.refresh_access_token(self.token_info['refresh_token'])
+            return self.token_info
+
+    def _refresh_in_background(self, token_info):
+        # At most one background refresh per session; callers never wait for it
+        if not self._background_refresh.acquire(blocking=False):
+            return
+
+        def refresh():
+            try:
+                self.refresh(if_older_than=token_info)
+            except Exception as e:
+                logger.error(f"Error refreshing Spotify token: {str(e)}")
+            finally:
+                self._background_refresh.release()
+
+        self.refresher.submit(refresh)
+
+
+class SpotifyClientPool:
+    """
+    Per-session Spotify clients sharing one pooled HTTP session.
+
+    Each logged-in session gets its own SpotifyService with an isolated token
+    (UserTokenManager), so users never share credentials and one user's token
+    refresh never blocks another user's requests. Clients are kept in a
+    bounded LRU; evicted sessions are rebuilt from the token store.
+    """
+
+    def __init__(self, audio_features_cache=None, catalog=None, token_store=None, max_clients=None,
+                 refresh_margin=None, http_session=None, client_id=None, client_secret=None,
+                 redirect_uri=None, scope=None, scheduler=None, listening_history=None):
+        self.audio_features_cache = audio_features_cache
+        self.listening_history = listening_history
+        self.scheduler = scheduler or SpotifyCallScheduler()
+        self.catalog = catalog
+        self.token_store = token_store or SpotifyTokenStore()
+        self.refresh_margin = Config.SPOTIFY_TOKEN_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.client_id = client_id or Config.SPOTIFY_CLIENT_ID
+        self.client_secret = client_secret or Config.SPOTIFY_CLIENT_SECRET
+        self.redirect_uri = redirect_uri or Config.SPOTIFY_REDIRECT_URI
+        self.scope = scope or Config.SPOTIFY_SCOPES
+        self.http_session = http_session or build_http_session(Config.SPOTIFY_HTTP_POOL_SIZE)
+        self.clients = LRUCache(max_clients or Config.SPOTIFY_MAX_USER_CLIENTS)
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='spotify-token-refresh')
+        self._lock = threading.Lock()
+
+    def _oauth(self, cache_handler, state=None):
+        return SpotifyOAuth(
+            client_id=self.client_id,
+            client_secret=self.client_secret,
+            redirect_uri=self.redirect_uri,
+            scope=self.scope,
+            state=state,
+            cache_handler=cache_handler,
+            requests_session=self.http_session,
+            open_browser=False,
+        )
+
+    def _token_manager(self, session_id):
+        manager = UserTokenManager(session_id, None, self.token_store, self._refresher, self.refresh_margin)
+        manager.oauth = self._oauth(manager)
+        return manager
+
+    def _service(self, token_manager):
+        spotify = spotipy.Spotify(auth_manager=token_manager, requests_session=self.http_session)
+        return SpotifyService(spotify, audio_features_cache=self.audio_features_cache, catalog=self.catalog,
+                              scheduler=self.scheduler, listening_history=self.listening_history)
+
+    @staticmethod
+    def new_session_id():
+        return secrets.token_urlsafe(24)
+
+    def authorize_url(self, session_id):
+        """Spotify login URL; session_id comes back as the OAuth state."""
+        return self._oauth(MemoryCacheHandler(), state=session_id).get_authorize_url()
+
+    def handle_callback(self, session_id, code):
+        """Exchange an authorization code for the session's token and return its client."""
+        try:
+            token_manager = self._token_manager(session_id)
+            token_manager.oauth.get_access_token(code, as_dict=False, check_cache=False)
+            service = self._service(token_manager)
+            self.clients.set(session_id, service)
+            return service
+        except Exception as e:
+            logger.error(f"Error handling callback: {str(e)}")
+            raise
+
+    def get(self, session_id):
+        """SpotifyService for a logged-in session, or None if the session has no token."""
+        if not session_id:
+            return None
+        service = self.clients.get(session_id)
+        if service is not None:
+            return service
+        # The token store is read outside the lock so a cold lookup never blocks other sessions
+        token_info = self.token_store.get(session_id)
+        if token_info is None:
+            return None
+        with self._lock:
+            service = self.clients.get(session_id)
+            if service is None:
+                token_manager = self._token_manager(session_id)
+                token_manager.token_info = token_info
+                service = self._service(token_manager)
+                self.clients.set(session_id, service)
+            return service
+
+    def logout(self, session_id):
+        self.clients.pop(session_id)
+        self.token_store.delete(session_id)
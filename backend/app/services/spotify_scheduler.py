@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+from app.config.settings import Config
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Rate limiter allowing `rate` calls per second with bursts of up to `burst`
+    calls, implemented as a generic cell rate algorithm: reserve() books the
+    next free slot and returns how long the caller must wait for it.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.monotonic):
+        self.interval = 1.0 / rate
+        self.tolerance = (max(burst, 1) - 1) * self.interval
+        self.paused_until = 0.0
+        self._clock = clock
+        self._tat = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = self._clock()
+            tat = max(self._tat, now)
+            self._tat = tat + self.interval
+            return max(0.0, tat - now - self.tolerance)
+
+    def pause(self, seconds):
+        """Hold every call for seconds (e.g. a Retry-After), then resume without a burst."""
+        with self._lock:
+            until = self._clock() + seconds
+            self.paused_until = max(self.paused_until, until)
+            self._tat = max(self._tat, until + self.tolerance)
+
+    def pause_remaining(self):
+        return max(0.0, self.paused_until - self._clock())
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of calls, so an error storm cannot multiply the
+    load on the API. Every call deposits `ratio` tokens and every retry
+    withdraws one; `min_retries` tokens are available from the start.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max(max_tokens, min_retries)
+        self.tokens = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def _http_error(error):
+    """(status, headers) of an HTTP error from spotipy or httpx, or (None, {}) for anything else."""
+    status = getattr(error, 'http_status', None)
+    if status is not None:
+        return status, getattr(error, 'headers', None) or {}
+    response = getattr(error, 'response', None)
+    if response is not None and hasattr(response, 'status_code'):
+        return response.status_code, response.headers
+    return None, {}
+
+
+class SpotifyCallScheduler:
+    """
+    Single gate for Spotify API calls from one process.
+
+    Calls wait for a token bucket slot sized to the app's quota. A 429 pauses
+    the whole bucket for its Retry-After, and 429/5xx responses are retried
+    with jittered exponential backoff while the retry budget allows. Identical
+    calls already in flight are coalesced into one request. Counters are
+    available from stats().
+    """
+
+    def __init__(self, rate=None, burst=None, max_retries=None, retry_budget=None, base_delay=0.5,
+                 max_delay=30.0, clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(rate or Config.SPOTIFY_RATE_LIMIT, burst or Config.SPOTIFY_RATE_BURST, clock)
+        self.max_retries = Config.SPOTIFY_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_budget = retry_budget or RetryBudget(Config.SPOTIFY_RETRY_BUDGET)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._async_in_flight = {}
+        self.counters = {
+            'calls': 0,
+            'requests': 0,
+            'coalesced': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'budget_exhausted': 0,
+            'failures': 0,
+            'wait_seconds': 0.0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['in_flight'] = len(self._in_flight) + len(self._async_in_flight)
+        stats['retry_budget'] = round(self.retry_budget.tokens, 2)
+        return stats
+
+    def _slot_delay(self):
+        """Seconds to wait before the next request may be sent."""
+        return max(self.bucket.reserve(), self.bucket.pause_remaining())
+
+    def _retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, or None if it must not be retried."""
+        status, headers = _http_error(error)
+        if status not in RETRY_STATUSES:
+            return None
+        if attempt >= self.max_retries or not self.retry_budget.withdraw():
+            self._count('budget_exhausted')
+            return None
+        self._count('retries')
+        if status == 429:
+            self._count('rate_limited')
+            try:
+                retry_after = float(headers.get('Retry-After', self.base_delay))
+            except ValueError:
+                retry_after = self.base_delay
+            logger.warning(f"Spotify rate limit hit, pausing calls for {retry_after:.1f}s")
+            # The pause holds every caller; jitter spreads out the retries that follow it
+            self.bucket.pause(retry_after)
+            return random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def _call_with_retries(self, fn):
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            delay = self._slot_delay()
+            while delay > 0:
+                self._count('wait_seconds', delay)
+                self._sleep(delay)
+                delay = self.bucket.pause_remaining()
+            self._count('requests')
+            try:
+                return fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._count('failures')
+                    raise
+                attempt += 1
+                self._sleep(delay)
+
+    def call(self, key, fn):
+        """Run fn through the scheduler; concurrent calls with the same key share one request."""
+        self._count('calls')
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = self._call_with_retries(fn)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    async def _acall_with_retries(self, fn):
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            delay = self._slot_delay()
+            while delay > 0:
+                self._count('wait_seconds', delay)
+                await asyncio.sleep(delay)
+                delay = self.bucket.pause_remaining()
+            self._count('requests')
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    self._count('failures')
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def acall(self, key, fn):
+        """Async variant of call(); fn returns a new awaitable for every attempt."""
+        self._count('calls')
+        future = self._async_in_flight.get(key)
+        if future is not None:
+            self._count('coalesced')
+            return await asyncio.shield(future)
+
+        future = self._async_in_flight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await self._acall_with_retries(fn)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._async_in_flight[key]
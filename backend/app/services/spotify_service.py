@@ -1,33 +1,244 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import time
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
+from urllib3.util.retry import Retry
 from app.config.settings import Config
+from app.services.metrics import count_spotify_call, stage
+from app.services.spotify_scheduler import SpotifyCallScheduler
 import logging
 
 logger = logging.getLogger(__name__)
 
+PLAYLIST_PAGE_SIZE = 100  # Maximum allowed by Spotify API
+AUDIO_FEATURES_BATCH_SIZE = 100
+USER_PLAYLISTS_PAGE_SIZE = 50
+RECENTLY_PLAYED_PAGE_SIZE = 50
+AUDIO_FEATURE_FIELDS = [
+    'danceability', 'energy', 'key', 'loudness', 'mode', 'speechiness', 'acousticness',
+    'instrumentalness', 'liveness', 'valence', 'tempo', 'time_signature'
+]
+
+def build_http_session(pool_size):
+    """
+    HTTP session for spotipy with a connection pool large enough for concurrent
+    fetches. Only connection errors are retried here; 429 and 5xx responses are
+    retried by the SpotifyCallScheduler, which coordinates them across callers.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=3,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=0,
+        backoff_factor=0.3,
+        status_forcelist=(),
+        respect_retry_after_header=False,
+    )
+    adapter = requests.adapters.HTTPAdapter(max_retries=retry, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _call_key(value):
+    """Hashable form of spotipy call arguments, for coalescing identical calls."""
+    if isinstance(value, dict):
+        return tuple(sorted((name, _call_key(item)) for name, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_call_key(item) for item in value)
+    return value
+
+def playlist_tracks(items):
+    """Track dicts for playlist items, skipping removed tracks, plus the ids to fetch features for."""
+    tracks = []
+    track_ids = []
+    for item in items:
+        track = item['track']
+        if track:  # Check if track exists (not None)
+            if track['id']:
+                track_ids.append(track['id'])
+            tracks.append({
+                'id': track['id'],
+                'name': track['name'],
+                'artist': track['artists'][0]['name'],
+                'album': track['album']['name'],
+                'duration_ms': track['duration_ms'],
+                'popularity': track['popularity'],
+                'preview_url': track['preview_url'],
+                'external_url': track['external_urls']['spotify'],
+                'added_at': item['added_at'],
+                'uri': track['uri']
+            })
+    return tracks, track_ids
+
+def add_audio_features(tracks, audio_features):
+    """Add audio features to track data in place."""
+    for track in tracks:
+        features = audio_features.get(track['id'], {})
+        if features:
+            track.update({name: features[name] for name in AUDIO_FEATURE_FIELDS})
+
+def format_top_songs(results):
+    top_songs = []
+    for track in results['items']:
+        top_songs.append({
+            'name': track['name'],
+            'artist': track['artists'][0]['name'],
+            'album': track['album']['name'],
+            'duration_ms': track['duration_ms'],
+            'popularity': track['popularity'],
+            'preview_url': track['preview_url'],
+            'external_url': track['external_urls']['spotify']
+        })
+    return top_songs
+
+def rank_top_playlists(recently_played, results, limit):
+    """The user's playlists ordered by how often they appear in recently played tracks."""
+    playlist_play_counts = {}
+
+    # Count playlist plays
+    for item in recently_played['items']:
+        if 'context' in item and item['context'] and item['context']['type'] == 'playlist':
+            playlist_id = item['context']['uri'].split(':')[-1]
+            playlist_play_counts[playlist_id] = playlist_play_counts.get(playlist_id, 0) + 1
+
+    # Create playlist data with play counts
+    playlist_data = []
+    for playlist in results['items']:
+        playlist_id = playlist['id']
+        play_count = playlist_play_counts.get(playlist_id, 0)
+        playlist_data.append({
+            'playlist': playlist,
+            'play_count': play_count
+        })
+
+    # Sort by play count
+    playlist_data.sort(key=lambda x: x['play_count'], reverse=True)
+
+    # Format top playlists
+    top_playlists = []
+    for item in playlist_data[:limit]:
+        playlist = item['playlist']
+        top_playlists.append({
+            'name': playlist['name'],
+            'description': playlist['description'],
+            'tracks_total': playlist['tracks']['total'],
+            'external_url': playlist['external_urls']['spotify'],
+            'images': playlist['images'],
+            'owner': playlist['owner']['display_name'],
+            'play_count': item['play_count']
+        })
+    return top_playlists
+
 class SpotifyService:
-    def __init__(self):
-        self.spotify = spotipy.Spotify(auth_manager=SpotifyOAuth(
-            client_id=Config.SPOTIFY_CLIENT_ID,
-            client_secret=Config.SPOTIFY_CLIENT_SECRET,
-            redirect_uri=Config.SPOTIFY_REDIRECT_URI,
-            scope=Config.SPOTIFY_SCOPES
-        ))
+    def __init__(self, spotify=None, fetch_workers=None, concurrent_fetch=None,
+                 audio_features_cache=None, catalog=None, scheduler=None, listening_history=None):
+        # Shared by every client of the app so they draw on one rate limit
+        self.scheduler = scheduler or SpotifyCallScheduler()
+        self.audio_features_cache = audio_features_cache
+        # ListeningHistoryStore that /api/top-playlists is answered from, if any
+        self.listening_history = listening_history
+        self._user_id = None
+        # DataService whose catalog already holds audio features for many tracks
+        self.catalog = catalog
+        self.fetch_workers = fetch_workers or Config.SPOTIFY_FETCH_WORKERS
+        self.concurrent_fetch = Config.SPOTIFY_CONCURRENT_FETCH if concurrent_fetch is None else concurrent_fetch
+        self.spotify = spotify or spotipy.Spotify(
+            auth_manager=SpotifyOAuth(
+                client_id=Config.SPOTIFY_CLIENT_ID,
+                client_secret=Config.SPOTIFY_CLIENT_SECRET,
+                redirect_uri=Config.SPOTIFY_REDIRECT_URI,
+                scope=Config.SPOTIFY_SCOPES
+            ),
+            requests_session=build_http_session(self.fetch_workers)
+        )
 
     def _get_audio_features_batch(self, track_ids):
         """Get audio features for a batch of tracks."""
         try:
             logger.info(f"Getting audio features for {len(track_ids)} tracks")
-            audio_features = self.spotify.audio_features(track_ids)
-            logger.info(f"Retrieved audio features: {len([f for f in audio_features if f])} features found")
-            return {track_id: features for track_id, features in zip(track_ids, audio_features) if features}
+            with stage('spotify_audio_features_batch'):
+                audio_features = self._call('audio_features', track_ids)
+            return self._store_audio_features(track_ids, audio_features)
         except Exception as e:
             logger.error(f"Error getting audio features: {str(e)}")
             return {}
 
+    def _call(self, method, *args, **kwargs):
+        """Call a spotipy method through the rate-limiting scheduler."""
+        count_spotify_call(method)
+        key = (id(self.spotify), method, _call_key(args), _call_key(kwargs))
+        return self.scheduler.call(key, lambda: getattr(self.spotify, method)(*args, **kwargs))
+
+    def _store_audio_features(self, track_ids, audio_features):
+        """Features by id from an audio-features response, saved to the cache."""
+        logger.info(f"Retrieved audio features: {len([f for f in audio_features if f])} features found")
+        features_by_id = {
+            track_id: features for track_id, features in zip(track_ids, audio_features) if features
+        }
+        if self.audio_features_cache is not None:
+            self.audio_features_cache.set_many(features_by_id)
+        return features_by_id
+
+    def _get_catalog_audio_features(self, track_ids):
+        """Audio features of tracks that already exist in the local catalog."""
+        if self.catalog is None or self.catalog.spotify_data is None:
+            return {}
+        result = self.catalog.get_tracks_by_ids(track_ids)
+        if 'error' in result:
+            return {}
+        features_by_id = {}
+        for track in result['tracks']:
+            features = {name: track.get(name) for name in AUDIO_FEATURE_FIELDS}
+            if all(value is not None for value in features.values()):
+                features_by_id[track['track_id']] = features
+        return features_by_id
+
+    @stage('audio_features_lookup')
+    def _get_known_audio_features(self, track_ids):
+        """
+        Audio features available without an API call, as (features by id, ids
+        still missing). The local catalog comes first, so its values (including
+        catalog updates) win over cached API responses; the cache only serves
+        tracks the catalog does not have.
+        """
+        audio_features = self._get_catalog_audio_features(list(dict.fromkeys(track_ids)))
+        missing = [track_id for track_id in dict.fromkeys(track_ids) if track_id not in audio_features]
+        if missing and self.audio_features_cache is not None:
+            cached_features, missing = self.audio_features_cache.get_many(missing)
+            audio_features.update(cached_features)
+        if missing:
+            logger.info(f"{len(missing)} of {len(track_ids)} tracks need audio features from the API")
+        return audio_features, missing
+
+    @stage('audio_features')
+    def _get_audio_features(self, track_ids, concurrent):
+        """
+        Get audio features for track_ids, checking the cache and the local catalog
+        first so that only unknown tracks are requested from the API.
+        """
+        audio_features, missing = self._get_known_audio_features(track_ids)
+
+        # Get the remaining audio features in batches of 100
+        batches = [
+            missing[i:i + AUDIO_FEATURES_BATCH_SIZE]
+            for i in range(0, len(missing), AUDIO_FEATURES_BATCH_SIZE)
+        ]
+        if concurrent:
+            batch_results = self._executor_map(self._get_audio_features_batch, batches)
+        else:
+            batch_results = [self._get_audio_features_batch(batch_ids) for batch_ids in batches]
+        for batch_features in batch_results:
+            audio_features.update(batch_features)
+        return audio_features
+
     def get_recommendations(self, limit=10):
         try:
-            results = self.spotify.recommendations(
+            results = self._call(
+                'recommendations',
                 seed_tracks=['0c6xIDDpzE81m2q797ordA'],
                 seed_artists=['4NHQUGzhtTLFvgF5SZesLK'],
                 seed_genres=['classical', 'country'],
@@ -53,70 +264,76 @@ class SpotifyService:
 
     def get_top_songs(self, limit=5):
         try:
-            results = self.spotify.current_user_top_tracks(limit=limit)
-            
-            top_songs = []
-            for track in results['items']:
-                top_songs.append({
-                    'name': track['name'],
-                    'artist': track['artists'][0]['name'],
-                    'album': track['album']['name'],
-                    'duration_ms': track['duration_ms'],
-                    'popularity': track['popularity'],
-                    'preview_url': track['preview_url'],
-                    'external_url': track['external_urls']['spotify']
-                })
-
-            return top_songs
+            results = self._call('current_user_top_tracks', limit=limit)
+            return format_top_songs(results)
         except Exception as e:
             logger.error(f"Error getting top songs: {str(e)}")
             raise
 
     def get_top_playlists(self, limit=5):
         try:
+            if self.listening_history is not None:
+                self.sync_listening_history()
+                return self.listening_history.top_playlists(self.user_id(), limit)
+
             # Get recently played tracks
-            recently_played = self.spotify.current_user_recently_played(limit=50)
-            playlist_play_counts = {}
+            recently_played = self._call('current_user_recently_played', limit=50)
+            # Get all playlists
+            results = self._call('current_user_playlists', limit=50)
+            return rank_top_playlists(recently_played, results, limit)
+        except Exception as e:
+            logger.error(f"Error getting top playlists: {str(e)}")
+            raise
 
-            # Count playlist plays
-            for item in recently_played['items']:
-                if 'context' in item and item['context'] and item['context']['type'] == 'playlist':
-                    playlist_id = item['context']['uri'].split(':')[-1]
-                    playlist_play_counts[playlist_id] = playlist_play_counts.get(playlist_id, 0) + 1
+    def user_id(self):
+        """Spotify id of the user this client acts for, fetched once."""
+        if self._user_id is None:
+            self._user_id = self._call('current_user')['id']
+        return self._user_id
 
-            # Get all playlists
-            results = self.spotify.current_user_playlists(limit=50)
-            
-            # Create playlist data with play counts
-            playlist_data = []
-            for playlist in results['items']:
-                playlist_id = playlist['id']
-                play_count = playlist_play_counts.get(playlist_id, 0)
-                playlist_data.append({
-                    'playlist': playlist,
-                    'play_count': play_count
-                })
+    def _fetch_user_playlists(self):
+        """Every playlist of the user, in listing order; pages after the first are fetched concurrently."""
+        limit = USER_PLAYLISTS_PAGE_SIZE
+        first_page = self._call('current_user_playlists', limit=limit)
+        offsets = range(len(first_page['items']), first_page['total'], limit)
+        pages = [first_page, *self._executor_map(
+            lambda offset: self._call('current_user_playlists', limit=limit, offset=offset), offsets
+        )]
+        return [playlist for page in pages for playlist in page['items'] if playlist]
 
-            # Sort by play count
-            playlist_data.sort(key=lambda x: x['play_count'], reverse=True)
-
-            # Format top playlists
-            top_playlists = []
-            for item in playlist_data[:limit]:
-                playlist = item['playlist']
-                top_playlists.append({
-                    'name': playlist['name'],
-                    'description': playlist['description'],
-                    'tracks_total': playlist['tracks']['total'],
-                    'external_url': playlist['external_urls']['spotify'],
-                    'images': playlist['images'],
-                    'owner': playlist['owner']['display_name'],
-                    'play_count': item['play_count']
-                })
+    def _fetch_recently_played(self, after):
+        """
+        Recently-played items after the cursor (ms), following the after cursor
+        across pages. Without a cursor this is the latest page, all the API keeps.
+        """
+        items = []
+        while True:
+            results = self._call('current_user_recently_played', limit=RECENTLY_PLAYED_PAGE_SIZE, after=after)
+            items.extend(results['items'])
+            cursor = (results.get('cursors') or {}).get('after')
+            if after is None or not results['items'] or not results.get('next') or cursor is None:
+                return items
+            after = int(cursor)
 
-            return top_playlists
+    @stage('listening_history_sync')
+    def sync_listening_history(self, force=False):
+        """
+        Bring the user's listening history store up to date: new recently-played
+        items since the stored cursor, at most every LISTENING_HISTORY_SYNC_INTERVAL
+        seconds, and the full playlist listing every LISTENING_HISTORY_PLAYLISTS_TTL
+        seconds. Within those intervals top playlists are ranked without API calls.
+        """
+        try:
+            user_id = self.user_id()
+            after, plays_synced_at, playlists_synced_at = self.listening_history.sync_state(user_id)
+            now = time.time()
+            if force or plays_synced_at is None or now - plays_synced_at >= Config.LISTENING_HISTORY_SYNC_INTERVAL:
+                self.listening_history.record_plays(user_id, self._fetch_recently_played(after))
+            if (force or playlists_synced_at is None
+                    or now - playlists_synced_at >= Config.LISTENING_HISTORY_PLAYLISTS_TTL):
+                self.listening_history.replace_playlists(user_id, self._fetch_user_playlists())
         except Exception as e:
-            logger.error(f"Error getting top playlists: {str(e)}")
+            logger.error(f"Error syncing listening history: {str(e)}")
             raise
 
     def handle_callback(self, code):
@@ -126,72 +343,71 @@ class SpotifyService:
             logger.error(f"Error handling callback: {str(e)}")
             raise
 
-    def get_playlist_tracks(self, playlist_id):
-        try:
-            # Get playlist details
-            playlist = self.spotify.playlist(playlist_id)
-            
-            # Get all tracks from the playlist
-            tracks = []
-            track_ids = []
-            offset = 0
-            limit = 100  # Maximum allowed by Spotify API
-            
-            while True:
-                results = self.spotify.playlist_tracks(
+    def _fetch_playlist_pages(self, playlist_id, first_page, concurrent):
+        """Fetch every page of playlist items, returning them in playlist order."""
+        pages = [first_page]
+        limit = PLAYLIST_PAGE_SIZE
+        if concurrent:
+            # The first page tells us how many pages remain, so request them all at once
+            offsets = range(len(first_page['items']), first_page['total'], limit)
+            pages.extend(self._executor_map(
+                lambda offset: self._call('playlist_tracks', playlist_id, offset=offset, limit=limit),
+                offsets,
+            ))
+        else:
+            results = first_page
+            while results['next']:
+                results = self._call(
+                    'playlist_tracks',
                     playlist_id,
-                    offset=offset,
+                    offset=results['offset'] + len(results['items']),
                     limit=limit
                 )
-                
-                for item in results['items']:
-                    track = item['track']
-                    if track:  # Check if track exists (not None)
-                        track_ids.append(track['id'])
-                        tracks.append({
-                            'id': track['id'],
-                            'name': track['name'],
-                            'artist': track['artists'][0]['name'],
-                            'album': track['album']['name'],
-                            'duration_ms': track['duration_ms'],
-                            'popularity': track['popularity'],
-                            'preview_url': track['preview_url'],
-                            'external_url': track['external_urls']['spotify'],
-                            'added_at': item['added_at'],
-                            'uri': track['uri']
-                        })
-                
-                # Check if there are more tracks to fetch
-                if len(results['items']) < limit:
-                    break
-                    
-                offset += limit
-
-            # Get audio features for all tracks in batches of 100
-            audio_features = {}
-            for i in range(0, len(track_ids), 100):
-                batch_ids = track_ids[i:i + 100]
-                batch_features = self._get_audio_features_batch(batch_ids)
-                audio_features.update(batch_features)
-
-            # Add audio features to track data
-            for track in tracks:
-                features = audio_features.get(track['id'], {})
-                if features:
-                    track.update({
-                        'danceability': features['danceability'],
-                        'energy': features['energy'],
-                        'key': features['key'],
-                        'loudness': features['loudness'],
-                        'mode': features['mode'],
-                        'speechiness': features['speechiness'],
-                        'acousticness': features['acousticness'],
-                        'instrumentalness': features['instrumentalness'],
-                        'liveness': features['liveness'],
-                        'valence': features['valence'],
-                        'tempo': features['tempo'],
-                        'time_signature': features['time_signature']
-                    })
+                pages.append(results)
+        return [item for page in pages for item in page['items']]
+
+    def _executor_map(self, fn, iterable):
+        """Map fn over iterable on a bounded thread pool, preserving order."""
+        # Each call runs in a copy of the caller's context so its stage timings reach the request
+        calls = [(contextvars.copy_context(), item) for item in iterable]
+        with ThreadPoolExecutor(max_workers=self.fetch_workers) as executor:
+            return list(executor.map(lambda call: call[0].run(fn, call[1]), calls))
+
+    def auth_headers(self):
+        """Authorization headers for the current token, refreshing it if needed."""
+        return self.spotify._auth_headers()
+
+    def get_playlist_snapshot(self, playlist_id):
+        """Playlist metadata without any tracks; snapshot_id changes whenever the tracks do."""
+        try:
+            with stage('spotify_snapshot'):
+                playlist = self._call('playlist', playlist_id, fields='snapshot_id,name,description')
+            return {
+                'snapshot_id': playlist['snapshot_id'],
+                'playlist_name': playlist['name'],
+                'playlist_description': playlist['description']
+            }
+        except Exception as e:
+            logger.error(f"Error getting playlist snapshot: {str(e)}")
+            raise
+
+    def get_playlist_tracks(self, playlist_id, concurrent=None):
+        """
+        Get all tracks of a playlist together with their audio features.
+        In concurrent mode the remaining pages and the audio-feature batches are
+        fetched on a bounded thread pool once the first page reports the total.
+        """
+        if concurrent is None:
+            concurrent = self.concurrent_fetch
+        try:
+            # Get playlist details; the response embeds the first page of tracks
+            with stage('spotify_pagination'):
+                playlist = self._call('playlist', playlist_id)
+                items = self._fetch_playlist_pages(playlist_id, playlist['tracks'], concurrent)
+            
+            tracks, track_ids = playlist_tracks(items)
+            audio_features = self._get_audio_features(track_ids, concurrent)
+            add_audio_features(tracks, audio_features)
             
             return {
                 'playlist_name': playlist['name'],
@@ -202,4 +418,4 @@ class SpotifyService:
             
         except Exception as e:
             logger.error(f"Error getting playlist tracks: {str(e)}")
-            raise 
\ No newline at end of file
+            raise
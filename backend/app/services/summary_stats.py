@@ -0,0 +1,234 @@
+import json
+import logging
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class QuantileSketch:
+    """
+    Mergeable KLL-style quantile sketch.
+    Items at level i stand for 2**i original values; a level that outgrows its
+    capacity is sorted and every other item is promoted, so memory stays
+    around a few times k regardless of how many values were added.
+    """
+
+    def __init__(self, k=200, levels=None, seed=0):
+        self.k = k
+        self.levels = [np.asarray(level, dtype=np.float64) for level in (levels or [[]])]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if values.size:
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Keep the odd item out at this level so no weight is lost
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self._rng.integers(0, 2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def quantiles(self, qs):
+        """Approximate values at the given quantiles, or None for an empty sketch."""
+        items = np.concatenate(self.levels)
+        if not items.size:
+            return [None for _ in qs]
+        weights = np.concatenate([np.full(len(level), 2 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(items)
+        items, cumulative = items[order], np.cumsum(weights[order])
+        targets = np.asarray(qs) * cumulative[-1]
+        positions = np.minimum(np.searchsorted(cumulative, targets, side='left'), len(items) - 1)
+        return items[positions].tolist()
+
+    def to_dict(self):
+        return {'k': self.k, 'levels': [level.tolist() for level in self.levels]}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['k'], data['levels'])
+
+
+class ColumnStats:
+    """Streaming count/mean/variance/min/max plus a quantile sketch for one column."""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None, sketch=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+        self.sketch = sketch or QuantileSketch()
+
+    def update(self, values):
+        """Fold a batch of values in with the parallel (Chan et al.) variance update."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+
+        batch_count = values.size
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        total = self.count + batch_count
+        delta = batch_mean - self.mean
+        self.mean += delta * batch_count / total
+        self.m2 += batch_m2 + delta ** 2 * self.count * batch_count / total
+        self.count = total
+
+        batch_min, batch_max = float(values.min()), float(values.max())
+        self.minimum = batch_min if self.minimum is None else min(self.minimum, batch_min)
+        self.maximum = batch_max if self.maximum is None else max(self.maximum, batch_max)
+        self.sketch.update(values)
+
+    def remove(self, values):
+        """
+        Take a batch of values back out by inverting the parallel update.
+        Count, mean and variance stay exact; min, max and the quantile sketch
+        cannot forget values and keep covering them until recomputed.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return
+
+        batch_count = values.size
+        total = self.count - batch_count
+        if total <= 0:
+            self.count, self.mean, self.m2 = 0, 0.0, 0.0
+            return
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        mean = (self.count * self.mean - batch_count * batch_mean) / total
+        delta = batch_mean - mean
+        self.m2 = max(0.0, self.m2 - batch_m2 - delta ** 2 * total * batch_count / self.count)
+        self.mean = mean
+        self.count = total
+
+    def describe(self):
+        """Statistics in the shape of DataFrame.describe() for one column."""
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None
+        q25, q50, q75 = self.sketch.quantiles([0.25, 0.5, 0.75])
+        return {
+            'count': float(self.count),
+            'mean': self.mean if self.count else None,
+            'std': std,
+            'min': self.minimum,
+            '25%': q25,
+            '50%': q50,
+            '75%': q75,
+            'max': self.maximum,
+        }
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'm2': self.m2,
+            'min': self.minimum,
+            'max': self.maximum,
+            'sketch': self.sketch.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['mean'], data['m2'], data['min'], data['max'],
+                   QuantileSketch.from_dict(data['sketch']))
+
+
+class SummaryStats:
+    """Catalog summary statistics that are computed once and updated as rows are appended or deleted."""
+
+    def __init__(self, total_rows=0, columns=None, column_stats=None, fingerprint=None):
+        self.total_rows = total_rows
+        self.columns = list(columns) if columns is not None else []
+        self.column_stats = column_stats or {}
+        self.fingerprint = fingerprint
+        self._summary = None
+
+    @classmethod
+    def from_dataframe(cls, spotify_data, fingerprint=None):
+        stats = cls(columns=spotify_data.columns, fingerprint=fingerprint)
+        stats.update(spotify_data)
+        return stats
+
+    def update(self, rows):
+        """Fold appended catalog rows into the statistics."""
+        for name in rows.columns:
+            if name not in self.columns:
+                self.columns.append(name)
+            series = rows[name]
+            if pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                self.column_stats.setdefault(name, ColumnStats()).update(series.to_numpy(dtype=np.float64))
+        self.total_rows += len(rows)
+        self._summary = None
+
+    def remove(self, rows):
+        """Take deleted catalog rows back out of the statistics."""
+        for name, column in self.column_stats.items():
+            if name in rows.columns:
+                column.remove(rows[name].to_numpy(dtype=np.float64))
+        self.total_rows -= len(rows)
+        self._summary = None
+
+    def summary(self):
+        """The get_data_summary payload, rebuilt only after the statistics change."""
+        if self._summary is None:
+            self._summary = {
+                "total_rows": self.total_rows,
+                "columns": list(self.columns),
+                "summary_stats": {
+                    name: column.describe() for name, column in self.column_stats.items()
+                }
+            }
+        return self._summary
+
+    def save(self, path):
+        path = Path(path)
+        temp_path = path.with_name(path.name + '.tmp')
+        temp_path.write_text(json.dumps({
+            'total_rows': self.total_rows,
+            'columns': self.columns,
+            'fingerprint': self.fingerprint,
+            'column_stats': {name: column.to_dict() for name, column in self.column_stats.items()},
+        }))
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        """Load persisted statistics; returns None if missing or computed for a different catalog."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text())
+            if fingerprint is not None and data.get('fingerprint') != fingerprint:
+                logger.info(f"Summary statistics at {path} are stale, recomputing them")
+                return None
+            column_stats = {
+                name: ColumnStats.from_dict(column) for name, column in data['column_stats'].items()
+            }
+            return cls(data['total_rows'], data['columns'], column_stats, data.get('fingerprint'))
+        except Exception as e:
+            logger.error(f"Error loading summary statistics: {str(e)}")
+            return None
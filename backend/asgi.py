@@ -0,0 +1,10 @@
+import logging
+from app import create_app
+from app.asgi import create_asgi_app
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+
+# Serve with e.g. `SECRET_KEY=... WEB_CONCURRENCY=4 uvicorn asgi:app`; every worker
+# must sign sessions with the same SECRET_KEY
+app = create_asgi_app(create_app())
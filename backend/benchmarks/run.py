@@ -0,0 +1,339 @@
+import gc
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import click
+import numpy as np
+
+from benchmarks.synthetic import StubSpotifyService, synthetic_playlists, write_catalog
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATA_DIR = Path(tempfile.gettempdir()) / 'spotify-benchmarks'
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Run in a fresh interpreter by cold_start: times importing the app, creating it
+# and answering /healthz, then waiting for the background warm-up to finish
+COLD_START_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+status = flask_app.test_client().get('/healthz').status_code
+serving = time.perf_counter()
+registry = flask_app.extensions['service_registry'].load()
+json.dump({
+    'import_s': imported - start,
+    'serving_s': serving - start,
+    'ready_s': time.perf_counter() - start,
+    'healthz_status': status,
+    'error': registry.error,
+}, sys.stdout)
+'''
+
+# Metrics compared against a baseline, and whether higher values are better
+COMPARED_METRICS = {
+    'p50_ms': False,
+    'p95_ms': False,
+    'ops_per_s': True,
+    'peak_rss_mb': False,
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def latency_stats(samples):
+    """Percentiles and throughput of per-call durations in seconds."""
+    samples = np.asarray(samples, dtype=np.float64)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000
+    return {
+        'count': int(samples.size),
+        'mean_ms': round(float(samples.mean()) * 1000, 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(samples.max()) * 1000, 3),
+        'ops_per_s': round(samples.size / float(samples.sum()), 3) if samples.sum() > 0 else None,
+    }
+
+
+def measure(fn, iterations, warmup=0):
+    """Call fn(i) warmup + iterations times and return the stats of the timed calls."""
+    for i in range(warmup):
+        fn(i)
+    samples = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    stats = latency_stats(samples)
+    stats['peak_rss_mb'] = peak_rss_mb()
+    return stats
+
+
+def catalog_dir(data_dir, rows, seed):
+    """Directory holding the synthetic catalog of the given size, generated on first use."""
+    directory = Path(data_dir) / f"catalog-{rows}-{seed}"
+    csv_path = directory / 'spotify_data.csv'
+    if not csv_path.exists():
+        directory.mkdir(parents=True, exist_ok=True)
+        temp_path = directory / 'spotify_data.csv.tmp'
+        write_catalog(temp_path, rows, seed)
+        temp_path.replace(csv_path)
+    return directory
+
+
+def cold_start(directory, columnar_dir, index_dir, options):
+    """
+    Time a worker starting from a fresh interpreter with SERVICE_WARMUP=background,
+    as during a rolling deploy: until the app is imported, until it answers
+    /healthz and until the catalog and indexes are loaded.
+    """
+    env = {
+        **os.environ,
+        'SERVICE_WARMUP': 'background',
+        'RECOMMENDER_ENGINE': options['engine'],
+        'ANN_MODE': options['ann_mode'],
+        'SPOTIFY_DATA_DIR': str(directory),
+        'COLUMNAR_DIR': str(columnar_dir),
+        'FEATURE_INDEX_DIR': str(index_dir),
+        'AUDIO_FEATURES_CACHE_PATH': '',
+        'SPOTIFY_TOKEN_STORE_PATH': '',
+        'LISTENING_HISTORY_PATH': '',
+    }
+    env.setdefault('SPOTIFY_CLIENT_ID', 'benchmark')
+    env.setdefault('SPOTIFY_CLIENT_SECRET', 'benchmark')
+    result = subprocess.run(
+        [sys.executable, '-c', COLD_START_SCRIPT], cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Cold start failed: {result.stderr}")
+    timings = json.loads(result.stdout)
+    if timings['healthz_status'] != 200 or timings['error']:
+        raise RuntimeError(f"Cold start did not become ready: {timings}")
+    return timings
+
+
+def run_catalog(rows, options):
+    """
+    Benchmark one catalog size and return its results.
+    The engine settings are read from the environment when the app is
+    imported, so this is meant to run in a fresh process per catalog.
+    """
+    os.environ['RECOMMENDER_ENGINE'] = options['engine']
+    os.environ['ANN_MODE'] = options['ann_mode']
+    # The Spotify clients are built but never called: requests go to StubSpotifyService
+    os.environ.setdefault('SPOTIFY_CLIENT_ID', 'benchmark')
+    os.environ.setdefault('SPOTIFY_CLIENT_SECRET', 'benchmark')
+    from app import create_app
+    from app.config.settings import Config
+    from app.services.data_service import DataService
+    from app.services.recommendation_service import RecommendationService
+    from app.services.service_registry import get_registry
+
+    directory = catalog_dir(options['data_dir'], rows, options['seed'])
+    index_dir = directory / f"index-{options['engine']}-{options['ann_mode']}"
+    benchmarks = {}
+
+    DataService(directory, catalog_format='csv').load_spotify_data()  # persists the summary statistics
+    benchmarks['load_csv'] = measure(
+        lambda i: DataService(directory, catalog_format='csv').load_spotify_data(), options['load_repeats']
+    )
+    columnar_dir = directory / 'columnar'
+    if not DataService(directory, columnar_dir)._use_columnar():
+        DataService(directory, columnar_dir).convert_to_columnar()
+    benchmarks['load_columnar'] = measure(
+        lambda i: DataService(directory, columnar_dir, catalog_format='columnar').load_spotify_data(),
+        options['load_repeats']
+    )
+
+    spotify_data = DataService(directory, columnar_dir).load_spotify_data()
+    services = []
+    benchmarks['index_build'] = measure(
+        lambda i: services.append(RecommendationService(spotify_data, shards=0)), 1
+    )
+    services[0].save_indexes(index_dir)
+    playlists = synthetic_playlists(spotify_data, options['playlists'], options['playlist_size'], options['seed'])
+    del services, spotify_data
+    gc.collect()
+
+    class BenchmarkConfig(Config):
+        TESTING = True
+        DATA_DIR = directory
+        COLUMNAR_DIR = columnar_dir
+        FEATURE_INDEX_DIR = index_dir
+        AUDIO_FEATURES_CACHE_PATH = ''
+        SPOTIFY_TOKEN_STORE_PATH = ''
+        LISTENING_HISTORY_PATH = ''
+
+    cold_starts = [cold_start(directory, columnar_dir, index_dir, options) for _ in range(options['load_repeats'])]
+    for name in ('import', 'serving', 'ready'):
+        benchmarks[f"cold_start_{name}"] = latency_stats([timings[f"{name}_s"] for timings in cold_starts])
+
+    apps = []
+    benchmarks['startup'] = measure(lambda i: apps.append(create_app(BenchmarkConfig)), 1)
+    app = apps[0]
+
+    with app.app_context():
+        registry = get_registry()
+        if not registry.ready:
+            raise RuntimeError(f"Services failed to load: {registry.error}")
+        registry.spotify_service = StubSpotifyService(playlists)
+        data_service = registry.data_service
+        recommendation_service = registry.recommendation_service
+
+        track_ids = data_service.spotify_data['track_id'].astype(str).to_numpy()
+        lookup_ids = track_ids[np.random.default_rng(options['seed']).integers(0, len(track_ids), options['lookups'])]
+        benchmarks['get_track_by_id'] = measure(
+            lambda i: data_service.get_track_by_id(lookup_ids[i]), options['lookups'], warmup=10
+        )
+
+        def recommend(i):
+            tracks = playlists[i % len(playlists)]['tracks']
+            recommendation_service.get_playlist_recommendations(tracks, options['limit'])
+
+        benchmarks['get_playlist_recommendations'] = measure(recommend, options['iterations'], warmup=2)
+
+        client = app.test_client()
+
+        def request(i):
+            response = client.get(
+                f"/api/recommendations/playlist?playlist_id=playlist{i % len(playlists)}&limit={options['limit']}"
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"Endpoint returned {response.status_code}: {response.get_data(as_text=True)}")
+
+        benchmarks['recommendations_endpoint'] = measure(request, options['iterations'], warmup=2)
+
+    return {
+        'rows': rows,
+        'engine': options['engine'],
+        'ann_mode': options['ann_mode'],
+        'benchmarks': benchmarks,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_suite(sizes, options, isolate=True):
+    """Results for every catalog size, each measured in its own process unless isolate is False."""
+    results = []
+    for rows in sizes:
+        logger.info(f"Benchmarking a catalog of {rows} rows")
+        if not isolate:
+            results.append(run_catalog(rows, options))
+            continue
+        # A fresh process per size keeps peak RSS and warm caches from leaking between sizes
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            results.append(executor.submit(run_catalog, rows, options).result())
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {name: str(value) for name, value in options.items()},
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Regressions of report against baseline: metrics of the same catalog size,
+    engine and benchmark that got worse by more than tolerance (a fraction).
+    """
+    def keyed(results):
+        return {(result['rows'], result['engine'], result['ann_mode']): result for result in results}
+
+    baseline_results = keyed(baseline['results'])
+    regressions = []
+    for key, result in keyed(report['results']).items():
+        if key not in baseline_results:
+            continue
+        for name, stats in result['benchmarks'].items():
+            previous = baseline_results[key]['benchmarks'].get(name)
+            if previous is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                old, new = previous.get(metric), stats.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append({
+                        'rows': key[0],
+                        'engine': key[1],
+                        'ann_mode': key[2],
+                        'benchmark': name,
+                        'metric': metric,
+                        'baseline': old,
+                        'current': new,
+                        'change': round(change, 3),
+                    })
+    return regressions
+
+
+@click.command()
+@click.option('--rows', 'sizes', type=click.IntRange(100), multiple=True, default=[10000],
+              help='Catalog size to benchmark; repeat for several sizes (10k-10M).')
+@click.option('--engine', type=click.Choice(['text', 'audio', 'hybrid']), default='text')
+@click.option('--ann-mode', type=click.Choice(['exact', 'ivf']), default='exact')
+@click.option('--playlists', type=click.IntRange(1), default=20, help='Synthetic playlists to cycle through.')
+@click.option('--playlist-size', type=click.IntRange(1), default=50, help='Tracks per synthetic playlist.')
+@click.option('--iterations', type=click.IntRange(1), default=50, help='Timed recommendation calls.')
+@click.option('--lookups', type=click.IntRange(1), default=2000, help='Timed get_track_by_id calls.')
+@click.option('--load-repeats', type=click.IntRange(1), default=3, help='Timed catalog loads per format.')
+@click.option('--limit', type=click.IntRange(1, 50), default=10, help='Recommendations per playlist.')
+@click.option('--seed', type=int, default=0)
+@click.option('--data-dir', type=click.Path(file_okay=False), default=str(DEFAULT_DATA_DIR),
+              help='Where generated catalogs are kept and reused between runs.')
+@click.option('--output', type=click.File('w'), default='-', help='File to write the JSON report to.')
+@click.option('--baseline', type=click.File('r'), default=None,
+              help='Earlier report to compare against; regressions make the command fail.')
+@click.option('--tolerance', type=float, default=0.25, show_default=True,
+              help='Allowed relative slowdown before a metric counts as a regression.')
+def main(sizes, engine, ann_mode, playlists, playlist_size, iterations, lookups, load_repeats, limit, seed,
+         data_dir, output, baseline, tolerance):
+    """Benchmark catalog loading, track lookups and recommendations on synthetic catalogs, offline."""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    options = {
+        'engine': engine,
+        'ann_mode': ann_mode,
+        'playlists': playlists,
+        'playlist_size': playlist_size,
+        'iterations': iterations,
+        'lookups': lookups,
+        'load_repeats': load_repeats,
+        'limit': limit,
+        'seed': seed,
+        'data_dir': data_dir,
+    }
+    report = run_suite(sizes, options)
+    if baseline is not None:
+        report['regressions'] = compare(report, json.load(baseline), tolerance)
+    output.write(json.dumps(report, indent=2) + '\n')
+
+    for regression in report.get('regressions', []):
+        click.echo(
+            f"REGRESSION {regression['rows']} rows {regression['benchmark']} {regression['metric']}: "
+            f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})",
+            err=True,
+        )
+    if report.get('regressions'):
+        sys.exit(1)
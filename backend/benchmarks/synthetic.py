@@ -0,0 +1,110 @@
+import itertools
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+GENRES = ['pop', 'rock', 'jazz', 'hip-hop', 'classical', 'electronic', 'folk', 'metal', 'soul', 'latin']
+SYLLABLES = ['la', 'ro', 'mi', 'ka', 'ne', 'so', 'vi', 'tu', 'da', 'ze', 'lo', 'fa', 'ri', 'mo', 'en', 'sha']
+
+
+def vocabulary(size=5000):
+    """Deterministic made-up words for track and artist names."""
+    words = (''.join(parts) for length in (2, 3, 4) for parts in itertools.product(SYLLABLES, repeat=length))
+    return np.array(list(itertools.islice(words, size)), dtype=object)
+
+
+def _names(rng, words, rows, min_words, max_words):
+    """Names of min_words..max_words words drawn with a Zipf-like skew, like real titles."""
+    lengths = rng.integers(min_words, max_words + 1, rows)
+    ranks = np.minimum(rng.zipf(1.3, (rows, max_words)) - 1, len(words) - 1)
+    tokens = words[ranks]
+    names = pd.Series(tokens[:, 0])
+    for position in range(1, max_words):
+        names = names.where(lengths <= position, names + ' ' + tokens[:, position])
+    return names.str.title()
+
+
+def synthetic_catalog(rows, seed=0, offset=0, words=None):
+    """rows synthetic tracks in the spotify_data.csv schema; offset numbers the track ids."""
+    rng = np.random.default_rng(seed)
+    words = vocabulary() if words is None else words
+    n_artists = max(rows // 20, 1)
+    artists = _names(np.random.default_rng(seed + 1), words, n_artists, 1, 3)
+    return pd.DataFrame({
+        'artist_name': artists.to_numpy()[rng.integers(0, n_artists, rows)],
+        'track_name': _names(rng, words, rows, 1, 5).to_numpy(),
+        'track_id': [f"bench{index:010d}" for index in range(offset, offset + rows)],
+        'popularity': rng.integers(0, 100, rows),
+        'year': rng.integers(1960, 2025, rows),
+        'genre': rng.choice(GENRES, rows),
+        'danceability': rng.random(rows).round(3),
+        'energy': rng.random(rows).round(3),
+        'key': rng.integers(0, 12, rows),
+        'loudness': (rng.random(rows) * -40).round(3),
+        'mode': rng.integers(0, 2, rows),
+        'speechiness': rng.beta(1, 8, rows).round(4),
+        'acousticness': rng.random(rows).round(4),
+        'instrumentalness': rng.beta(1, 4, rows).round(4),
+        'liveness': rng.beta(2, 8, rows).round(4),
+        'valence': rng.random(rows).round(3),
+        'tempo': (60 + rng.random(rows) * 140).round(3),
+        'duration_ms': rng.integers(90000, 420000, rows),
+        'time_signature': rng.choice([3, 4, 5], rows, p=[0.1, 0.85, 0.05]),
+    })
+
+
+def write_catalog(path, rows, seed=0, chunk_rows=500000):
+    """Write a synthetic catalog CSV in chunks, so 10M-row catalogs never sit in memory whole."""
+    start = time.perf_counter()
+    words = vocabulary()
+    with open(path, 'w', newline='') as csv_file:
+        for chunk, offset in enumerate(range(0, rows, chunk_rows)):
+            chunk_data = synthetic_catalog(min(chunk_rows, rows - offset), seed + chunk, offset, words)
+            chunk_data.to_csv(csv_file, index=False, header=chunk == 0)
+    logger.info(f"Wrote synthetic catalog of {rows} rows to {path} in {time.perf_counter() - start:.1f}s")
+
+
+def synthetic_playlists(spotify_data, count, size, seed=0):
+    """Playlists of catalog tracks as SpotifyService.get_playlist_tracks returns them."""
+    rng = np.random.default_rng(seed)
+    playlists = []
+    for number in range(count):
+        rows = spotify_data.iloc[rng.choice(len(spotify_data), size, replace=False)]
+        tracks = []
+        for track in rows.to_dict('records'):
+            track.update({'id': track['track_id'], 'name': track['track_name'], 'artist': track['artist_name']})
+            tracks.append(track)
+        playlists.append({
+            'playlist_name': f"Benchmark playlist {number}",
+            'playlist_description': '',
+            'total_tracks': len(tracks),
+            'tracks': tracks,
+        })
+    return playlists
+
+
+class StubSpotifyService:
+    """
+    Offline stand-in for SpotifyService serving synthetic playlists by id
+    ("playlist0", "playlist1", ...). Every snapshot is new, so the
+    recommendation cache never answers a benchmark request.
+    """
+
+    def __init__(self, playlists):
+        self.playlists = playlists
+        self._snapshots = itertools.count()
+
+    def get_playlist_snapshot(self, playlist_id):
+        playlist = self.playlists[int(playlist_id.removeprefix('playlist'))]
+        return {
+            'snapshot_id': f"snapshot{next(self._snapshots)}",
+            'playlist_name': playlist['playlist_name'],
+            'playlist_description': playlist['playlist_description'],
+        }
+
+    def get_playlist_tracks(self, playlist_id):
+        return self.playlists[int(playlist_id.removeprefix('playlist'))]
@@ -0,0 +1,13 @@
+import os
+
+# Load the app (catalog, indexes and services) once in the master process before
+# forking, so workers share those pages copy-on-write instead of each loading them.
+preload_app = True
+bind = '127.0.0.1:5000'
+workers = 4
+wsgi_app = 'run:app'
+
+# Workers forked from a preloading master share the key it generated; otherwise
+# every worker would sign sessions with a different one
+if not preload_app and workers > 1 and not os.getenv('SECRET_KEY'):
+    raise RuntimeError("Set SECRET_KEY when running more than one gunicorn worker without preload_app")
@@ -0,0 +1,68 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+import pytest
+from app.config.settings import Config
+
+
+def make_catalog(rows=200, seed=0):
+    """Build a small synthetic catalog in the spotify_data.csv schema."""
+    rng = np.random.default_rng(seed)
+    artists = [f"Artist {i}" for i in range(max(rows // 10, 1))]
+    return pd.DataFrame({
+        'artist_name': rng.choice(artists, rows),
+        'track_name': [f"Track {i} {rng.choice(['love', 'night', 'dance', 'blue'])}" for i in range(rows)],
+        'track_id': [f"track{i:06d}" for i in range(rows)],
+        'popularity': rng.integers(0, 100, rows),
+        'year': rng.integers(2000, 2024, rows),
+        'genre': rng.choice(['pop', 'rock', 'jazz', 'hip-hop'], rows),
+        'danceability': rng.random(rows).round(3),
+        'energy': rng.random(rows).round(3),
+        'key': rng.integers(0, 12, rows),
+        'loudness': (rng.random(rows) * -30).round(3),
+        'mode': rng.integers(0, 2, rows),
+        'speechiness': rng.random(rows).round(4),
+        'acousticness': rng.random(rows).round(4),
+        'instrumentalness': rng.random(rows).round(4),
+        'liveness': rng.random(rows).round(4),
+        'valence': rng.random(rows).round(3),
+        'tempo': (60 + rng.random(rows) * 120).round(3),
+        'duration_ms': rng.integers(120000, 360000, rows),
+        'time_signature': rng.choice([3, 4, 5], rows),
+    })
+
+
+def catalog_tracks(spotify_data, positions):
+    """Convert catalog rows into playlist track dicts as returned by SpotifyService."""
+    tracks = []
+    for _, row in spotify_data.iloc[positions].iterrows():
+        track = row.to_dict()
+        track.update({'id': row['track_id'], 'name': row['track_name'], 'artist': row['artist_name']})
+        tracks.append(track)
+    return tracks
+
+
+@pytest.fixture
+def spotify_data():
+    return make_catalog()
+
+
+@pytest.fixture
+def app_config(tmp_path, monkeypatch):
+    make_catalog(rows=200).to_csv(tmp_path / 'spotify_data.csv', index=False)
+    monkeypatch.setattr(Config, 'SPOTIFY_CLIENT_ID', 'test-client')
+    monkeypatch.setattr(Config, 'SPOTIFY_CLIENT_SECRET', 'test-secret')
+
+    class TestConfig(Config):
+        TESTING = True
+        DATA_DIR = tmp_path
+        COLUMNAR_DIR = tmp_path / 'columnar'
+        FEATURE_INDEX_DIR = tmp_path / 'index'
+        AUDIO_FEATURES_CACHE_PATH = str(tmp_path / 'audio_features_cache.sqlite3')
+        SPOTIFY_TOKEN_STORE_PATH = str(tmp_path / 'spotify_tokens.sqlite3')
+        LISTENING_HISTORY_PATH = str(tmp_path / 'listening_history.sqlite3')
+
+    return TestConfig
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import spotipy
+
+
+def fake_track(index):
+    track_id = f"fake{index:06d}"
+    return {
+        'id': track_id,
+        'name': f"Fake Track {index}",
+        'artists': [{'name': f"Fake Artist {index % 7}"}],
+        'album': {'name': f"Fake Album {index % 11}"},
+        'duration_ms': 180000 + index,
+        'popularity': index % 100,
+        'preview_url': None,
+        'external_urls': {'spotify': f"https://open.spotify.com/track/{track_id}"},
+        'uri': f"spotify:track:{track_id}",
+    }
+
+
+def fake_audio_features(track_id):
+    index = int(track_id[4:])
+    return {
+        'id': track_id,
+        'danceability': (index % 10) / 10,
+        'energy': (index % 7) / 7,
+        'key': index % 12,
+        'loudness': -float(index % 30),
+        'mode': index % 2,
+        'speechiness': 0.05,
+        'acousticness': 0.2,
+        'instrumentalness': 0.0,
+        'liveness': 0.1,
+        'valence': 0.5,
+        'tempo': 100.0 + index % 40,
+        'time_signature': 4,
+    }
+
+
+class FakeSpotifyServer:
+    """
+    Minimal local stand-in for the Spotify Web API used by the service tests.
+    Serves playlists of `playlist_size` synthetic tracks, records every request
+    path and can add a fixed latency to each response.
+    """
+
+    def __init__(self, playlist_size=250, latency=0.0, user_playlists=0):
+        self.playlist_size = playlist_size
+        self.latency = latency
+        # The user's own playlists ("up0", "up1", ...) and recently played items, oldest first
+        self.user_playlists = user_playlists
+        self.plays = []
+        self.requests = []
+        self.authorizations = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def prefix(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1/"
+
+    def client(self, **kwargs):
+        """spotipy client pointed at this server."""
+        client = spotipy.Spotify(auth='fake-token', **kwargs)
+        client.prefix = self.prefix
+        return client
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def paths(self, *prefixes):
+        return [path for path in self.requests if path.startswith(prefixes)]
+
+    def page_requests(self, playlist_id):
+        return self.paths(f"/v1/playlists/{playlist_id}/tracks", f"/v1/playlists/{playlist_id}/items")
+
+    def playlist_page(self, playlist_id, offset, limit):
+        stop = min(offset + limit, self.playlist_size)
+        return {
+            'items': [
+                {'added_at': '2024-01-01T00:00:00Z', 'track': fake_track(i)} for i in range(offset, stop)
+            ],
+            'offset': offset,
+            'limit': limit,
+            'total': self.playlist_size,
+            'next': f"{self.prefix}playlists/{playlist_id}/tracks?offset={stop}" if stop < self.playlist_size else None,
+        }
+
+    def play(self, playlist_id, played_at_ms):
+        """Add a recently played item from a playlist (or no context if playlist_id is None)."""
+        played_at = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(played_at_ms // 1000))
+        context = {'type': 'playlist', 'uri': f"spotify:playlist:{playlist_id}"} if playlist_id else None
+        self.plays.append({
+            'track': fake_track(len(self.plays)),
+            'played_at': f"{played_at}.{played_at_ms % 1000:03d}Z",
+            'context': context,
+            'played_at_ms': played_at_ms,
+        })
+
+    def recently_played(self, after, limit):
+        if after is None:
+            items = self.plays[-limit:][::-1]
+            has_next = len(self.plays) > limit
+        else:
+            newer = [item for item in self.plays if item['played_at_ms'] > after]
+            items = newer[:limit][::-1]
+            has_next = len(newer) > limit
+        cursor = max((item['played_at_ms'] for item in items), default=None)
+        return {
+            'items': [{key: value for key, value in item.items() if key != 'played_at_ms'} for item in items],
+            'next': f"{self.prefix}me/player/recently-played?after={cursor}" if has_next else None,
+            'cursors': {'after': str(cursor)} if cursor is not None else None,
+            'limit': limit,
+        }
+
+    def user_playlist(self, index):
+        return {
+            'id': f"up{index}",
+            'name': f"User playlist {index}",
+            'description': '',
+            'snapshot_id': f"usnap{index}",
+            'tracks': {'total': index},
+            'external_urls': {'spotify': f"https://open.spotify.com/playlist/up{index}"},
+            'images': [],
+            'owner': {'display_name': 'Fake User'},
+        }
+
+    def respond(self, path, query):
+        """Return (status, headers, body) for a request; subclasses override this to inject errors."""
+        parts = path.strip('/').split('/')
+        if parts[:2] == ['v1', 'playlists'] and len(parts) == 3:
+            playlist_id = parts[2]
+            return 200, {}, {
+                'id': playlist_id,
+                'name': f"Playlist {playlist_id}",
+                'description': 'A fake playlist',
+                'snapshot_id': f"snapshot-{self.playlist_size}",
+                'tracks': self.playlist_page(playlist_id, 0, 100),
+            }
+        # Newer spotipy releases request /items instead of /tracks
+        if parts[:2] == ['v1', 'playlists'] and parts[3:] in (['tracks'], ['items']):
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+            return 200, {}, self.playlist_page(parts[2], offset, limit)
+        if parts == ['v1', 'me']:
+            return 200, {}, {'id': 'fake-user', 'display_name': 'Fake User'}
+        if parts == ['v1', 'me', 'playlists']:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['50'])[0])
+            stop = min(offset + limit, self.user_playlists)
+            return 200, {}, {
+                'items': [self.user_playlist(i) for i in range(offset, stop)],
+                'offset': offset,
+                'limit': limit,
+                'total': self.user_playlists,
+            }
+        if parts == ['v1', 'me', 'player', 'recently-played']:
+            after = int(query['after'][0]) if 'after' in query else None
+            return 200, {}, self.recently_played(after, int(query.get('limit', ['50'])[0]))
+        if parts == ['v1', 'me', 'top', 'tracks']:
+            limit = int(query.get('limit', ['20'])[0])
+            return 200, {}, {'items': [fake_track(i) for i in range(limit)]}
+        if parts[:2] == ['v1', 'audio-features']:
+            ids = query['ids'][0].split(',')
+            return 200, {}, {'audio_features': [fake_audio_features(track_id) for track_id in ids]}
+        return 404, {}, {'error': {'status': 404, 'message': 'Not found'}}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                with server._lock:
+                    server.requests.append(url.path)
+                    server.authorizations.append(self.headers.get('Authorization'))
+                    server._in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server._in_flight)
+                try:
+                    if server.latency:
+                        time.sleep(server.latency)
+                    status, headers, body = server.respond(url.path, parse_qs(url.query))
+                finally:
+                    with server._lock:
+                        server._in_flight -= 1
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
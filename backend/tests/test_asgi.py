@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.asgi import create_asgi_app
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+
+async def _get_all(asgi_app, urls):
+    transport = httpx.ASGITransport(app=asgi_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+        responses = await asyncio.gather(*[client.get(url) for url in urls])
+    await asgi_app.aclose()
+    return responses
+
+
+def test_asgi_serves_concurrent_playlist_requests(app_config):
+    flask_app = create_app(app_config)
+
+    with FakeSpotifyServer(playlist_size=250, latency=0.02) as server, flask_app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+        expected = flask_app.test_client().get('/api/recommendations/playlist?playlist_id=p0&limit=5').get_json()
+
+        urls = [f"/api/recommendations/playlist?playlist_id=p{i}&limit=5" for i in range(20)]
+        responses = asyncio.run(_get_all(create_asgi_app(flask_app), urls))
+
+    assert [response.status_code for response in responses] == [200] * 20
+    assert responses[0].json() == expected
+    assert responses[0].headers['x-cache'] == 'HIT'
+    assert responses[1].headers['x-cache'] == 'MISS'
+    # Requests for different playlists were in flight at the same time
+    assert server.max_in_flight > 8
+
+
+def test_asgi_passes_other_routes_to_flask(app_config):
+    flask_app = create_app(app_config)
+
+    responses = asyncio.run(_get_all(create_asgi_app(flask_app), [
+        '/api/data/summary',
+        '/api/recommendations/playlist',
+    ]))
+
+    assert responses[0].status_code == 200
+    assert responses[0].json()['total_rows'] == 200
+    assert responses[1].status_code == 400
+
+
+def test_asgi_rejects_playlist_ids_that_are_not_spotify_ids(app_config):
+    flask_app = create_app(app_config)
+
+    with FakeSpotifyServer() as server, flask_app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+        responses = asyncio.run(_get_all(create_asgi_app(flask_app), [
+            '/api/recommendations/playlist?playlist_id=../me/player',
+            '/api/recommendations/playlist?playlist_id=abc%2F..%2F..%2Fme',
+            '/api/recommendations/playlist?playlist_id=spotify:playlist:abc&limit=3',
+        ]))
+
+    assert [response.status_code for response in responses] == [400, 400, 200]
+    # Only the valid playlist, given as a URI, reached the Web API
+    assert server.requests and all(path.startswith('/v1/playlists/abc') or not path.startswith('/v1/playlists')
+                                   for path in server.requests)
@@ -0,0 +1,77 @@
+import json
+
+from conftest import catalog_tracks, make_catalog
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.services.batch_recommendations import BatchRecommender
+from app.services.recommendation_service import RecommendationService
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+
+def test_batch_endpoint_streams_ndjson_per_playlist(app_config):
+    app = create_app(app_config)
+    tracks = catalog_tracks(make_catalog(rows=200), [3, 4, 5])
+
+    with FakeSpotifyServer(playlist_size=120) as server, app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+        response = app.test_client().post('/api/recommendations/batch', json={
+            'limit': 3,
+            'playlists': ['abc', {'playlist_id': 'def'}, {'playlist_id': 'mine', 'tracks': tracks},
+                          {'playlist_id': 'empty', 'tracks': []}],
+        })
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    assert response.mimetype == 'application/x-ndjson'
+    results = {line['playlist_id']: line for line in lines}
+    assert set(results) == {'abc', 'def', 'mine', 'empty'}
+    assert results['abc']['playlist_name'] == 'Playlist abc'
+    assert results['mine']['total'] == 3
+    assert results['empty']['error'] == 'Playlist has no tracks'
+    # Playlists given by id were fetched; the track list was used as given
+    assert len(server.paths('/v1/playlists/mine')) == 0
+
+
+def test_one_unscorable_playlist_does_not_fail_its_batch(spotify_data):
+    service = RecommendationService(spotify_data)
+    playlists = [
+        {'playlist_id': 'good', 'tracks': catalog_tracks(spotify_data, [1, 2])},
+        {'playlist_id': 'broken', 'tracks': ['not a track']},
+        {'playlist_id': 'also-good', 'tracks': catalog_tracks(spotify_data, [3])},
+    ]
+
+    results = {result['playlist_id']: result for result in BatchRecommender(service, batch_size=8).recommend(
+        playlists, limit=3
+    )}
+
+    assert set(results) == {'good', 'broken', 'also-good'}
+    assert 'error' in results['broken']
+    assert results['good']['total'] == 3 and results['also-good']['total'] == 3
+
+
+def test_batch_endpoint_validates_payload(app_config):
+    client = create_app(app_config).test_client()
+
+    assert client.post('/api/recommendations/batch', json={'playlists': []}).status_code == 400
+    assert client.post('/api/recommendations/batch', json={'playlists': [{'tracks': []}]}).status_code == 400
+    assert client.post('/api/recommendations/batch', json={'playlists': ['abc'], 'limit': 0}).status_code == 400
+    assert client.post('/api/recommendations/batch', json={'playlists': ['abc'], 'limit': True}).status_code == 400
+    assert client.post('/api/recommendations/batch', json={'playlists': ['../me/player']}).status_code == 400
+
+
+def test_recommend_batch_command_writes_ndjson(app_config, tmp_path):
+    app = create_app(app_config)
+    tracks = catalog_tracks(make_catalog(rows=200), [7, 8])
+    input_path = tmp_path / 'playlists.txt'
+    input_path.write_text(json.dumps({'playlist_id': 'one', 'tracks': tracks}) + '\n\n'
+                          + json.dumps({'playlist_id': 'two', 'tracks': tracks[:1]}) + '\n')
+    output_path = tmp_path / 'recommendations.ndjson'
+
+    result = app.test_cli_runner().invoke(args=[
+        'recommend-batch', '--input', str(input_path), '--output', str(output_path), '--limit', '4'
+    ])
+
+    assert result.exit_code == 0, result.output
+    lines = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [line['playlist_id'] for line in lines] == ['one', 'two']
+    assert all(line['total'] == 4 for line in lines)
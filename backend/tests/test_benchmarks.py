@@ -0,0 +1,56 @@
+import copy
+import pytest
+from benchmarks.run import compare, latency_stats, run_suite
+from benchmarks.synthetic import synthetic_catalog
+from app.config.settings import Config
+
+
+def test_synthetic_catalog_matches_catalog_schema(spotify_data):
+    catalog = synthetic_catalog(1000, seed=1)
+
+    assert set(spotify_data.columns) <= set(catalog.columns)
+    assert catalog['track_id'].is_unique
+    assert catalog['track_name'].str.len().min() > 0
+    assert synthetic_catalog(1000, seed=1).equals(catalog)
+
+
+def test_latency_stats():
+    stats = latency_stats([0.001] * 98 + [0.1, 0.2])
+
+    assert stats['count'] == 100
+    assert stats['p50_ms'] == pytest.approx(1.0)
+    assert stats['max_ms'] == pytest.approx(200.0)
+    assert stats['ops_per_s'] == pytest.approx(100 / 0.398, rel=1e-3)
+
+
+def test_suite_runs_offline_and_flags_regressions(tmp_path, monkeypatch):
+    # In-process the app settings are already imported, so credentials are patched like app_config does
+    for name in ('RECOMMENDER_ENGINE', 'ANN_MODE', 'SPOTIFY_CLIENT_ID', 'SPOTIFY_CLIENT_SECRET'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(Config, 'SPOTIFY_CLIENT_ID', 'test-client')
+    monkeypatch.setattr(Config, 'SPOTIFY_CLIENT_SECRET', 'test-secret')
+    options = {
+        'engine': 'text', 'ann_mode': 'exact', 'playlists': 3, 'playlist_size': 5, 'iterations': 3,
+        'lookups': 20, 'load_repeats': 1, 'limit': 5, 'seed': 0, 'data_dir': str(tmp_path),
+    }
+
+    report = run_suite([500], options, isolate=False)
+
+    benchmarks = report['results'][0]['benchmarks']
+    assert set(benchmarks) == {
+        'load_csv', 'load_columnar', 'index_build', 'cold_start_import', 'cold_start_serving', 'cold_start_ready',
+        'startup', 'get_track_by_id', 'get_playlist_recommendations', 'recommendations_endpoint',
+    }
+    # A worker answers health checks before its catalog finishes loading
+    assert benchmarks['cold_start_serving']['max_ms'] < benchmarks['cold_start_ready']['max_ms']
+    assert benchmarks['get_track_by_id']['count'] == 20
+    assert benchmarks['recommendations_endpoint']['p95_ms'] > 0
+    assert compare(report, report, tolerance=0.1) == []
+
+    slower = copy.deepcopy(report)
+    slower['results'][0]['benchmarks']['get_playlist_recommendations']['p50_ms'] *= 2
+    slower['results'][0]['benchmarks']['get_track_by_id']['ops_per_s'] /= 2
+    regressions = compare(slower, report, tolerance=0.1)
+    assert {(regression['benchmark'], regression['metric']) for regression in regressions} == {
+        ('get_playlist_recommendations', 'p50_ms'), ('get_track_by_id', 'ops_per_s'),
+    }
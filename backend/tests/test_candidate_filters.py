@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from werkzeug.datastructures import MultiDict
+from conftest import catalog_tracks, make_catalog
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.services.recommendation_params import parse_filters
+from app.services.recommendation_service import RecommendationService
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+
+def brute_force(service, playlist, limit, keep):
+    """The limit best unfiltered recommendations of the catalog rows where keep is true."""
+    everything = service.get_playlist_recommendations(playlist, limit=len(service.spotify_data), exact=True)
+    rows = {name: position for position, name in enumerate(service.spotify_data['track_name'])}
+    return [r for r in everything if keep[rows[r['name']]]][:limit]
+
+
+def test_parse_filters():
+    filters = parse_filters(MultiDict([
+        ('min_popularity', '40'), ('tempo_range', '100-130.5'), ('key', '7,0,7'), ('mode', '1'),
+        ('exclude_artists', 'Artist 1'), ('exclude_artists', 'artist 2'), ('exclude_playlist_tracks', 'true'),
+    ]))
+
+    assert dict(filters) == {
+        'min_popularity': 40, 'tempo_range': (100.0, 130.5), 'key': (0, 7), 'mode': 1,
+        'exclude_artists': ('artist 1', 'artist 2'), 'exclude_playlist_tracks': True,
+    }
+    assert parse_filters(MultiDict({'limit': '5'})) is None
+    for args in ({'tempo_range': '130-100'}, {'tempo_range': '120'}, {'key': '12'}, {'mode': 'major'},
+                 {'min_popularity': 'high'}, {'min_popularity': ','}, {'key': ' , '}, {'tempo_range': ',-,'},
+                 {'tempo_range': 'nan-120'}, {'tempo_range': '100-inf'}):
+        with pytest.raises(ValueError):
+            parse_filters(MultiDict(args))
+    for name, value in (('min_popularity', '40'), ('mode', '1'), ('tempo_range', '90-100')):
+        with pytest.raises(ValueError, match='only be given once'):
+            parse_filters(MultiDict([(name, value), (name, value)]))
+
+
+@pytest.mark.parametrize('engine', ['text', 'audio', 'hybrid'])
+@pytest.mark.parametrize('args', [
+    # Wide and narrow filters take the masked-scan and the gather paths
+    {'min_popularity': '30', 'exclude_artists': 'Artist 3'},
+    {'min_popularity': '60', 'tempo_range': '90-120', 'key': '0,2,4,5', 'exclude_playlist_tracks': 'true'},
+])
+def test_filtered_recommendations_match_brute_force(engine, args):
+    spotify_data = make_catalog(rows=1000, seed=5)
+    playlist = catalog_tracks(spotify_data, [1, 2, 3])
+    keep = spotify_data['popularity'].to_numpy() >= int(args['min_popularity'])
+    if 'exclude_artists' in args:
+        keep &= spotify_data['artist_name'].to_numpy() != args['exclude_artists']
+    if 'tempo_range' in args:
+        keep &= spotify_data['tempo'].between(90, 120).to_numpy() & spotify_data['key'].isin([0, 2, 4, 5]).to_numpy()
+        keep[[1, 2, 3]] = False
+
+    filters = parse_filters(MultiDict(args))
+    service = RecommendationService(spotify_data, engine=engine, chunk_size=128)
+    filtered = service.get_playlist_recommendations(playlist, limit=10, filters=filters)
+
+    expected = brute_force(service, playlist, 10, keep)
+    assert [r['similarity_score'] for r in filtered] == pytest.approx([r['similarity_score'] for r in expected])
+
+    # ANN candidates are filtered the same way
+    service = RecommendationService(spotify_data, engine=engine, ann_mode='ivf', nprobe=4)
+    rows = {name: position for position, name in enumerate(spotify_data['track_name'])}
+    approximate = service.get_playlist_recommendations(playlist, limit=10, filters=filters)
+    assert len(approximate) == 10 and all(keep[rows[r['name']]] for r in approximate)
+
+
+def test_filters_cover_catalog_changes(spotify_data):
+    service = RecommendationService(spotify_data, engine='audio')
+    playlist = catalog_tracks(spotify_data, [8])
+    added = spotify_data.iloc[[8]].assign(track_id='copy-of-8', track_name='Copy of 8', popularity=99)
+    deleted = np.zeros(len(spotify_data) + 1, dtype=bool)
+    deleted[8] = True
+    updated = service.with_catalog(pd.concat([spotify_data, added], ignore_index=True), deleted)
+
+    filters = parse_filters(MultiDict({'min_popularity': '90'}))
+    top = updated.get_playlist_recommendations(playlist, limit=3, filters=filters)
+
+    # The appended row passes the filter and the deleted original is never returned
+    assert top[0]['name'] == 'Copy of 8'
+    assert all(r['popularity'] >= 90 for r in top)
+    filters = parse_filters(MultiDict({'exclude_artists': spotify_data.iloc[8]['artist_name'].upper()}))
+    assert 'Copy of 8' not in [r['name'] for r in updated.get_playlist_recommendations(playlist, 5, filters=filters)]
+
+
+def test_playlist_recommendation_filters_endpoint(app_config):
+    app = create_app(app_config)
+    client = app.test_client()
+
+    with FakeSpotifyServer(playlist_size=30) as server, app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+
+        filtered = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5&min_popularity=80&mode=0')
+        invalid = client.get('/api/recommendations/playlist?playlist_id=abc&tempo_range=fast')
+        no_probes = client.get('/api/recommendations/playlist?playlist_id=abc&nprobe=0')
+
+    assert filtered.status_code == 200
+    recommendations = filtered.get_json()['recommendations']
+    assert recommendations and all(r['popularity'] >= 80 and r['mode'] == 0 for r in recommendations)
+    assert invalid.status_code == 400
+    assert no_probes.status_code == 400
+
+
+def test_catalog_without_filter_columns(app_config):
+    # A catalog without tempo and key still serves unfiltered and other filtered requests
+    make_catalog(rows=200).drop(columns=['tempo', 'key']).to_csv(app_config.DATA_DIR / 'spotify_data.csv', index=False)
+    app = create_app(app_config)
+    client = app.test_client()
+
+    with FakeSpotifyServer(playlist_size=30) as server, app.app_context():
+        registry = get_registry()
+        assert registry.ready and registry.recommendation_service._filter_index is None
+        registry.spotify_service = SpotifyService(server.client())
+
+        unfiltered = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5')
+        popular = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5&min_popularity=50')
+        by_tempo = client.get('/api/recommendations/playlist?playlist_id=abc&tempo_range=100-120')
+
+    assert unfiltered.status_code == 200
+    assert popular.status_code == 200
+    assert all(r['popularity'] >= 50 for r in popular.get_json()['recommendations'])
+    assert by_tempo.status_code == 400
+    assert 'tempo' in by_tempo.get_json()['error']
@@ -0,0 +1,218 @@
+import os
+import time
+import numpy as np
+import pytest
+from scipy import sparse
+from conftest import catalog_tracks, make_catalog
+from app import create_app
+from app.services.data_service import DataService
+from app.services.recommendation_service import RecommendationService
+from app.services.scoring import SegmentedMatrix
+from app.services.service_registry import ServiceRegistry, get_registry
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    make_catalog(rows=200).to_csv(tmp_path / 'spotify_data.csv', index=False)
+    return tmp_path
+
+
+def new_track(track_id, **values):
+    track = make_catalog(rows=1, seed=7).iloc[0].to_dict()
+    track.update(track_id=track_id, **values)
+    return {name: value.item() if hasattr(value, 'item') else value for name, value in track.items()}
+
+
+@pytest.mark.parametrize('matrix', [
+    np.arange(40, dtype=np.float32).reshape(10, 4),
+    sparse.random(10, 4, density=0.5, format='csr', random_state=0),
+])
+def test_segmented_matrix_indexes_like_one_matrix(matrix):
+    segmented = SegmentedMatrix(matrix[:6], matrix[6:8]).append(matrix[8:])
+
+    def dense(value):
+        return value.toarray() if sparse.issparse(value) else value
+
+    assert segmented.shape == matrix.shape
+    for rows in [slice(0, 4), slice(7, 10), slice(3, 9), np.array([9, 1, 7, 0]), np.array([2, 3])]:
+        np.testing.assert_array_equal(dense(segmented[rows]), dense(matrix[rows]))
+    np.testing.assert_array_equal(dense(segmented.merged()), dense(matrix))
+
+
+def test_upserts_and_deletes_update_lookups_and_stats(data_dir):
+    data_service = DataService(data_dir, catalog_format='csv')
+    spotify_data = data_service.load_spotify_data()
+
+    data_service.log_changes(
+        upserts=[new_track('track000003', track_name='Replaced', energy=0.5), new_track('brand-new')],
+        delete_ids=['track000010', 'unknown'],
+    )
+    assert data_service.replay_changes() == {'upserted': 2, 'deleted': 1}
+
+    assert data_service.get_track_by_id('track000003')['track_name'] == 'Replaced'
+    assert data_service.get_track_by_id('brand-new')['track_id'] == 'brand-new'
+    assert data_service.get_track_by_id('track000010') == {"error": "Track not found"}
+    assert data_service.live_rows == 200
+
+    # Replacing a track that was itself appended keeps one live copy
+    data_service.log_changes(upserts=[new_track('brand-new', track_name='Again')])
+    data_service.replay_changes()
+    assert data_service.get_tracks_by_ids(['brand-new'])['tracks'][0]['track_name'] == 'Again'
+    assert data_service.live_rows == 200
+    assert data_service.replay_changes() is None
+
+    live = data_service.spotify_data[~data_service.deleted_rows]
+    summary = data_service.get_data_summary()
+    assert summary['total_rows'] == len(live)
+    assert summary['summary_stats']['energy']['count'] == len(live)
+    assert summary['summary_stats']['energy']['mean'] == pytest.approx(live['energy'].mean())
+    assert summary['summary_stats']['energy']['std'] == pytest.approx(live['energy'].std())
+    assert len(spotify_data) == 200
+
+
+def test_changes_reach_other_processes_through_the_log(data_dir):
+    writer = DataService(data_dir, catalog_format='csv')
+    reader = DataService(data_dir, catalog_format='csv')
+    writer.load_spotify_data()
+    reader.load_spotify_data()
+    assert not reader.has_pending_changes()
+
+    writer.log_changes(delete_ids=['track000001'])
+    assert reader.has_pending_changes()
+    reader.replay_changes()
+    assert reader.get_track_by_id('track000001') == {"error": "Track not found"}
+    assert not reader.has_pending_changes()
+
+    with pytest.raises(ValueError):
+        writer.log_changes(upserts=[{'track_name': 'No id'}])
+    with pytest.raises(ValueError):
+        writer.log_changes(upserts=[new_track('bad', energy='loud')])
+
+
+def test_compaction_rewrites_catalog_and_keeps_later_changes(data_dir):
+    data_service = DataService(data_dir, catalog_format='csv')
+    data_service.load_spotify_data()
+    data_service.log_changes(upserts=[new_track('brand-new')], delete_ids=['track000001'])
+
+    compacted = data_service.compact(
+        before_log_compaction=lambda spotify_data: data_service.log_changes(delete_ids=['track000002'])
+    )
+    assert len(compacted) == 200
+    assert data_service.has_pending_changes()
+
+    reloaded = DataService(data_dir, catalog_format='csv')
+    assert len(reloaded.load_spotify_data()) == 200
+    assert reloaded.get_track_by_id('brand-new')['track_id'] == 'brand-new'
+    reloaded.replay_changes()
+    assert reloaded.get_track_by_id('track000002') == {"error": "Track not found"}
+
+
+@pytest.mark.parametrize('engine', ['text', 'audio', 'hybrid'])
+def test_recommendations_follow_catalog_changes(data_dir, engine):
+    data_service = DataService(data_dir, catalog_format='csv')
+    spotify_data = data_service.load_spotify_data()
+    service = RecommendationService(spotify_data, engine=engine, chunk_size=64)
+    playlist = catalog_tracks(spotify_data, [20])
+
+    # An identical copy of the playlist track under a new id ties with it for the top spot
+    copy = {**spotify_data.iloc[20].to_dict(), 'track_id': 'copy-of-20'}
+    data_service.log_changes(upserts=[new_track(**copy)], delete_ids=['track000020'])
+    data_service.replay_changes()
+    updated = service.with_catalog(data_service.spotify_data, data_service.deleted_rows)
+
+    assert updated.version != service.version
+    assert updated.delta_rows == 1
+    top = updated.get_playlist_recommendations(playlist, limit=5)
+    assert top[0]['name'] == spotify_data.iloc[20]['track_name']
+    assert top[0]['similarity_score'] == pytest.approx(1.0, abs=1e-5)
+    assert len(top) == 5 and len({(track['name'], track['artist']) for track in top}) == 5
+    # The original service still answers from the catalog it was built for
+    assert len(service.get_playlist_recommendations(playlist, limit=5)) == 5
+
+    merged = updated.merge_segments()
+    assert merged.delta_rows == 0
+    assert merged.get_playlist_recommendations(playlist, limit=5) == top
+    assert updated.get_batch_recommendations([playlist], limit=5) == [top]
+
+
+def test_replaced_sharded_scorers_are_closed(app_config, monkeypatch):
+    monkeypatch.setattr(ServiceRegistry, 'RETIRE_GRACE', 0.2)
+    app = create_app(app_config)
+
+    with app.app_context():
+        registry = get_registry()
+        spotify_data = registry.data_service.spotify_data
+        first = RecommendationService(spotify_data, engine='audio', shards=2, chunk_size=64)
+        registry.set_recommendation_service(first)
+        # Incremental and merged copies keep scoring on the same shards
+        updated = first.with_catalog(spotify_data, registry.data_service.deleted_rows)
+        registry.set_recommendation_service(updated)
+        registry._merge_segments()
+        playlist = catalog_tracks(spotify_data, [5])
+        expected = first.get_playlist_recommendations(playlist, limit=5, exact=True)
+
+        # A service rebuilt from reloaded files releases the old shards after the grace period,
+        # and requests still holding the old service can finish in the meantime
+        reloaded = RecommendationService(spotify_data, engine='audio', shards=2, chunk_size=64)
+        registry.set_recommendation_service(reloaded)
+        assert first.get_playlist_recommendations(playlist, limit=5, exact=True) == expected
+        deadline = time.monotonic() + 10
+        while os.path.exists(first.sharded_scorer.shard_dir) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(first.sharded_scorer.shard_dir)
+        assert os.path.isdir(reloaded.sharded_scorer.shard_dir)
+        # A closed scorer refuses to score instead of starting a pool on removed shards
+        with pytest.raises(RuntimeError):
+            first.get_playlist_recommendations(playlist, limit=5, exact=True)
+        reloaded.close()
+
+
+def test_ann_search_scans_rows_added_after_the_index(tmp_path):
+    make_catalog(rows=2000, seed=3).to_csv(tmp_path / 'spotify_data.csv', index=False)
+    data_service = DataService(tmp_path, catalog_format='csv')
+    service = RecommendationService(data_service.load_spotify_data(), engine='audio', ann_mode='ivf', nprobe=1)
+
+    far_track = new_track('new-track', energy=0.01, danceability=0.99, valence=0.02, tempo=199.0)
+    data_service.log_changes(upserts=[far_track])
+    data_service.replay_changes()
+    updated = service.with_catalog(data_service.spotify_data, data_service.deleted_rows)
+
+    playlist = [{**far_track, 'name': far_track['track_name'], 'artist': far_track['artist_name']}]
+    assert updated.get_playlist_recommendations(playlist, limit=1)[0]['similarity_score'] == pytest.approx(1.0)
+
+
+def test_catalog_endpoints(app_config):
+    app_config.CATALOG_ADMIN_TOKEN = 'secret'
+    app = create_app(app_config)
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer secret'}
+
+    assert client.post('/api/catalog/tracks', json={'tracks': [new_track('x')]}).status_code == 401
+    assert client.post('/api/catalog/tracks', json={'tracks': []}, headers=headers).status_code == 400
+    assert client.post(
+        '/api/catalog/tracks', json={'tracks': [{'track_id': 'x', 'colour': 'red'}]}, headers=headers
+    ).status_code == 400
+
+    response = client.post('/api/catalog/tracks', json={'tracks': [new_track('x')]}, headers=headers)
+    assert response.get_json() == {'upserted': 1, 'deleted': 0, 'total_rows': 201}
+    response = client.delete('/api/catalog/tracks', json={'track_ids': ['track000001']}, headers=headers)
+    assert response.get_json() == {'upserted': 0, 'deleted': 1, 'total_rows': 200}
+
+    body = client.post('/api/tracks/batch', json={'track_ids': ['x', 'track000001']}).get_json()
+    assert body['missing'] == ['track000001']
+    with app.app_context():
+        assert get_registry().recommendation_service.generation == 2
+
+    # A second application on the same data directory stands in for another worker
+    other = create_app(app_config)
+    with other.app_context():
+        assert get_registry().status()['catalog_rows'] == 200
+        assert get_registry().data_service.get_track_by_id('x')['track_id'] == 'x'
+
+
+def test_catalog_endpoints_are_disabled_without_token(app_config):
+    client = create_app(app_config).test_client()
+
+    response = client.delete('/api/catalog/tracks', json={'track_ids': ['track000001']},
+                             headers={'Authorization': 'Bearer '})
+    assert response.status_code == 403
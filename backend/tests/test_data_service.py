@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from conftest import make_catalog
+from app.services.data_service import DataService
+from app.services.feature_index import catalog_fingerprint
+from app.services.summary_stats import QuantileSketch
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    spotify_data = make_catalog(rows=300)
+    spotify_data.loc[5, 'track_name'] = None
+    spotify_data.to_csv(tmp_path / 'spotify_data.csv', index=False)
+    return tmp_path
+
+
+def test_columnar_catalog_round_trip(data_dir):
+    csv_data = DataService(data_dir, catalog_format='csv').load_spotify_data()
+    DataService(data_dir).convert_to_columnar()
+
+    columnar_data = DataService(data_dir, catalog_format='columnar').load_spotify_data()
+
+    assert list(columnar_data.columns) == list(csv_data.columns)
+    assert columnar_data['energy'].dtype == np.float32
+    assert isinstance(columnar_data['artist_name'].dtype, pd.CategoricalDtype)
+    assert columnar_data['track_name'].isna().sum() == 1
+    assert columnar_data['track_id'].astype(str).tolist() == csv_data['track_id'].tolist()
+    np.testing.assert_allclose(columnar_data['tempo'], csv_data['tempo'], rtol=1e-6)
+    assert catalog_fingerprint(columnar_data) == catalog_fingerprint(csv_data)
+    # Numeric columns are backed by read-only memory maps
+    assert not columnar_data['energy'].to_numpy().flags.writeable
+    # String columns keep their category codes memory-mapped too
+    assert not columnar_data['artist_name'].array.codes.flags.writeable
+
+
+def test_auto_format_ignores_stale_columnar_copy(data_dir):
+    data_service = DataService(data_dir)
+    data_service.convert_to_columnar()
+    assert data_service._use_columnar()
+
+    make_catalog(rows=310).to_csv(data_dir / 'spotify_data.csv', index=False)
+    assert not data_service._use_columnar()
+    assert len(data_service.load_spotify_data()) == 310
+
+
+def test_track_lookups_use_id_index(data_dir):
+    data_service = DataService(data_dir, catalog_format='csv')
+    spotify_data = data_service.load_spotify_data()
+
+    assert data_service.get_track_by_id('track000042')['track_name'] == spotify_data.loc[42, 'track_name']
+    assert data_service.get_track_by_id('unknown') == {"error": "Track not found"}
+
+    result = data_service.get_tracks_by_ids(['track000007', 'unknown', 'track000005'])
+    assert [track['track_id'] for track in result['tracks']] == ['track000007', 'track000005']
+    assert result['missing'] == ['unknown']
+    # Missing values are returned as None rather than NaN
+    assert result['tracks'][1]['track_name'] is None
+
+
+def test_summary_stats_are_persisted_and_updated_incrementally(data_dir):
+    data_service = DataService(data_dir, catalog_format='csv')
+    spotify_data = data_service.load_spotify_data()
+    assert data_service.summary_stats_path.exists()
+
+    extra = make_catalog(rows=50, seed=9)
+    data_service.append_rows(extra)
+    summary = data_service.get_data_summary()
+
+    combined = pd.concat([spotify_data, extra], ignore_index=True)
+    expected = combined.describe()
+    assert summary['total_rows'] == len(combined)
+    for column in ['energy', 'tempo', 'popularity']:
+        stats = summary['summary_stats'][column]
+        assert stats['count'] == expected.loc['count', column]
+        assert stats['mean'] == pytest.approx(expected.loc['mean', column])
+        assert stats['std'] == pytest.approx(expected.loc['std', column])
+        assert stats['max'] == pytest.approx(expected.loc['max', column])
+        assert stats['50%'] == pytest.approx(expected.loc['50%', column], rel=0.1)
+
+    # A fresh service picks up the persisted, updated statistics
+    reloaded = DataService(data_dir, catalog_format='csv')
+    reloaded._set_spotify_data(combined)
+    assert reloaded.get_data_summary()['summary_stats']['energy']['count'] == len(combined)
+
+
+def test_quantile_sketch_stays_small_and_accurate():
+    values = np.random.default_rng(0).normal(size=200000)
+    sketch = QuantileSketch(k=200)
+    for batch in np.array_split(values, 20):
+        sketch.update(batch)
+
+    assert sum(len(level) for level in sketch.levels) < 2000
+    estimates = sketch.quantiles([0.1, 0.5, 0.9])
+    assert estimates == pytest.approx(np.quantile(values, [0.1, 0.5, 0.9]).tolist(), abs=0.05)
@@ -0,0 +1,86 @@
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.config.settings import Config
+from app.services.listening_history import ListeningHistoryStore
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+START_MS = 1700000000000
+
+
+def play(playlist_id, played_at_ms):
+    return {
+        'played_at': f"2023-11-14T22:13:{(played_at_ms - START_MS) // 1000 + 20:02d}.000Z",
+        'context': {'type': 'playlist', 'uri': f"spotify:playlist:{playlist_id}"} if playlist_id else None,
+    }
+
+
+def listed(*ids, snapshot='s1'):
+    return [{
+        'id': playlist_id,
+        'name': playlist_id.upper(),
+        'description': '',
+        'snapshot_id': snapshot,
+        'tracks': {'total': 1},
+        'external_urls': {'spotify': f"https://open.spotify.com/playlist/{playlist_id}"},
+        'images': [],
+        'owner': {'display_name': 'Owner'},
+    } for playlist_id in ids]
+
+
+def test_store_counts_each_play_once_and_ranks_locally(tmp_path):
+    store = ListeningHistoryStore(tmp_path / 'history.sqlite3')
+    store.replace_playlists('user', listed('a', 'b', 'c'))
+    plays = [play('b', START_MS), play('c', START_MS + 1000), play(None, START_MS + 2000)]
+
+    assert store.record_plays('user', plays) == START_MS + 2000
+    # Overlapping pages of an earlier sync are not counted again
+    store.record_plays('user', plays + [play('c', START_MS + 3000)])
+
+    top = store.top_playlists('user', 3)
+    assert [(playlist['name'], playlist['play_count']) for playlist in top] == [('C', 2), ('B', 1), ('A', 0)]
+    assert store.sync_state('user')[0] == START_MS + 3000
+
+    # Another worker's store on the same file sees the same aggregates
+    store.replace_playlists('user', listed('c', 'd', snapshot='s2'))
+    other = ListeningHistoryStore(tmp_path / 'history.sqlite3')
+    assert [playlist['name'] for playlist in other.top_playlists('user', 5)] == ['C', 'D']
+    assert other.playlist_snapshots('user') == {'c': 's2', 'd': 's2'}
+
+
+def test_top_playlists_cover_every_playlist_and_sync_incrementally(app_config, monkeypatch):
+    app = create_app(app_config)
+    client = app.test_client()
+
+    with FakeSpotifyServer(user_playlists=120) as server, app.app_context():
+        registry = get_registry()
+        registry.spotify_service = SpotifyService(
+            server.client(), listening_history=registry.spotify_service.listening_history
+        )
+        for offset, playlist_id in enumerate(['up110', 'up3', 'up110', 'up75', 'up110', 'up3']):
+            server.play(playlist_id, START_MS + offset * 1000)
+        server.play(None, START_MS + 10000)
+
+        top = client.get('/api/top-playlists').get_json()['top_playlists']
+        assert [(playlist['name'], playlist['play_count']) for playlist in top] == [
+            ('User playlist 110', 3), ('User playlist 3', 2), ('User playlist 75', 1),
+            ('User playlist 0', 0), ('User playlist 1', 0),
+        ]
+        # All three playlist pages were requested
+        assert len(server.paths('/v1/me/playlists')) == 3
+
+        # Within the sync interval the answer comes from the store alone
+        requests = len(server.requests)
+        assert client.get('/api/top-playlists').get_json()['top_playlists'] == top
+        assert len(server.requests) == requests
+
+        monkeypatch.setattr(Config, 'LISTENING_HISTORY_SYNC_INTERVAL', 0)
+        server.play('up75', START_MS + 20000)
+        server.play('up75', START_MS + 21000)
+        top = client.get('/api/top-playlists').get_json()['top_playlists']
+        # Ties keep the playlist listing order
+        assert [(playlist['name'], playlist['play_count']) for playlist in top[:2]] == [
+            ('User playlist 75', 3), ('User playlist 110', 3)
+        ]
+        # Only plays after the stored cursor were fetched, and the playlist listing is still fresh
+        assert len(server.paths('/v1/me/playlists')) == 3
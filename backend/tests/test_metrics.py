@@ -0,0 +1,104 @@
+import asyncio
+
+import httpx
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.asgi import create_asgi_app
+from app.services.metrics import MetricsRegistry, METRICS, stage, start_request_timing, stop_request_timing
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+REQUEST_STAGES = [
+    'spotify_snapshot', 'spotify_pagination', 'audio_features', 'playlist_vectorize', 'scoring',
+    'format_results', 'json_serialize',
+]
+
+
+def server_timing(header):
+    """Stage durations in ms from a Server-Timing header."""
+    entries = dict(entry.split(';dur=') for entry in header.split(', '))
+    return {name: float(duration) for name, duration in entries.items()}
+
+
+def test_histograms_render_as_prometheus_text():
+    metrics = MetricsRegistry(buckets=(0.1, 1.0))
+    metrics.observe('stage_duration_seconds', 0.1, stage='scoring')
+    metrics.observe('stage_duration_seconds', 0.5, stage='scoring')
+    metrics.observe('stage_duration_seconds', 2.0, stage='scoring')
+    metrics.inc('spotify_calls_total', method='playlist')
+
+    text = metrics.render([('cache_hit_ratio', 'gauge', 'Hit ratio.', {'cache': 'a"b'}, 0.5)])
+
+    assert '# TYPE recommender_stage_duration_seconds histogram' in text
+    assert 'recommender_stage_duration_seconds_bucket{stage="scoring",le="0.1"} 1' in text
+    assert 'recommender_stage_duration_seconds_bucket{stage="scoring",le="1.0"} 2' in text
+    assert 'recommender_stage_duration_seconds_bucket{stage="scoring",le="+Inf"} 3' in text
+    assert 'recommender_stage_duration_seconds_count{stage="scoring"} 3' in text
+    assert 'recommender_spotify_calls_total{method="playlist"} 1' in text
+    assert 'recommender_cache_hit_ratio{cache="a\\"b"} 0.5' in text
+
+
+def test_stages_are_collected_per_request():
+    timings = start_request_timing()
+    with stage('outer'):
+        with stage('inner'):
+            pass
+    stop_request_timing()
+    with stage('outer'):
+        pass
+
+    assert [name for name, seconds in timings] == ['inner', 'outer']
+
+
+def test_playlist_request_reports_stages_and_metrics(app_config):
+    app_config.SERVER_TIMING = True
+    app = create_app(app_config)
+    client = app.test_client()
+    playlist_calls = METRICS.counter('spotify_calls_total', method='playlist_tracks')
+
+    with FakeSpotifyServer(playlist_size=250) as server, app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+        response = client.get('/api/recommendations/playlist?playlist_id=p0&limit=5')
+        cached = client.get('/api/recommendations/playlist?playlist_id=p0&limit=5')
+
+    timings = server_timing(response.headers['Server-Timing'])
+    assert set(REQUEST_STAGES) <= set(timings)
+    assert 'spotify_audio_features_batch' in timings
+    assert timings['total'] >= timings['spotify_pagination'] + timings['scoring']
+    assert 'scoring' not in server_timing(cached.headers['Server-Timing'])
+    # 250 tracks take two more pages after the one embedded in the playlist
+    assert METRICS.counter('spotify_calls_total', method='playlist_tracks') == playlist_calls + 2
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'recommender_stage_duration_seconds_count{stage="spotify_pagination"}' in text
+    assert 'recommender_http_request_duration_seconds_count{endpoint="/api/recommendations/playlist",method="GET"}' in text
+    assert 'recommender_cache_hits_total{cache="recommendations"} 1' in text
+    assert 'recommender_cache_hit_ratio{cache="recommendations"} 0.5' in text
+    assert 'recommender_spotify_scheduler_requests_total' in text
+    assert 'recommender_catalog_rows 200' in text
+
+
+def test_server_timing_is_off_by_default(app_config):
+    response = create_app(app_config).test_client().get('/api/data/summary')
+
+    assert response.status_code == 200
+    assert 'Server-Timing' not in response.headers
+
+
+def test_asgi_requests_report_stages(app_config):
+    app_config.SERVER_TIMING = True
+    flask_app = create_app(app_config)
+
+    async def get(asgi_app, url):
+        transport = httpx.ASGITransport(app=asgi_app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://testserver') as client:
+            response = await client.get(url)
+        await asgi_app.aclose()
+        return response
+
+    with FakeSpotifyServer(playlist_size=150) as server, flask_app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+        response = asyncio.run(get(create_asgi_app(flask_app), '/api/recommendations/playlist?playlist_id=p1'))
+
+    assert response.status_code == 200
+    assert set(REQUEST_STAGES) <= set(server_timing(response.headers['server-timing']))
@@ -0,0 +1,251 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+from conftest import catalog_tracks, make_catalog
+from app.services.audio_feature_index import AudioFeatureIndex, parse_feature_weights
+from app.services.feature_index import (
+    FeatureIndex, HashedFeatureIndex, catalog_feature_strings, track_feature_string
+)
+from app.services.recommendation_params import RECOMMENDATION_FIELDS, parse_fields
+from app.services.recommendation_service import RecommendationService
+from app.services.scoring import chunked_top_k, chunked_top_k_columns, top_k
+from app.services.sharded_scorer import ShardedScorer
+
+
+def test_catalog_feature_strings_match_track_feature_string(spotify_data):
+    track = catalog_tracks(spotify_data, [3])[0]
+    assert catalog_feature_strings(spotify_data)[3] == track_feature_string(track)
+
+
+def test_feature_index_round_trip(spotify_data, tmp_path):
+    FeatureIndex.build(spotify_data).save(tmp_path)
+
+    loaded = FeatureIndex.load(tmp_path, spotify_data)
+    assert loaded is not None
+    assert loaded.catalog_matrix.shape[0] == len(spotify_data)
+
+    # An index built from a different catalog is ignored
+    assert FeatureIndex.load(tmp_path, spotify_data.iloc[:-1]) is None
+
+
+def test_hashed_index_matches_tfidf_without_fitted_vocabulary(spotify_data, tmp_path):
+    tfidf = FeatureIndex.build(spotify_data)
+    HashedFeatureIndex.build(spotify_data, n_features=2 ** 18).save(tmp_path)
+    hashed = HashedFeatureIndex.load(tmp_path, spotify_data, n_features=2 ** 18)
+    playlist = catalog_tracks(spotify_data, [4, 9])
+
+    assert hashed.catalog_matrix.dtype == np.float32
+    expected = tfidf.catalog_matrix @ tfidf.centroid(playlist)
+    scores = hashed.catalog_matrix @ hashed.centroid(playlist)
+    # Equal up to the odd hash collision between numeric tokens
+    assert scores == pytest.approx(expected, abs=1e-3)
+    assert list(np.argsort(-scores)[:5]) == list(np.argsort(-expected)[:5])
+    # A different dimension makes the persisted index stale
+    assert HashedFeatureIndex.load(tmp_path, spotify_data, n_features=2 ** 16) is None
+
+    # Rows added later are weighted the same way, including words the catalog never had
+    new_track = {**catalog_tracks(spotify_data, [4])[0], 'name': 'Zyzzyva'}
+    extended = hashed.with_rows(spotify_data.iloc[[4]].assign(track_name='Zyzzyva'))
+    row = extended.catalog_matrix[len(spotify_data):].toarray()
+    assert row[0] @ hashed.transform([new_track]).toarray()[0] == pytest.approx(1.0, abs=1e-5)
+
+
+def test_playlist_recommendations_use_prebuilt_index(spotify_data, tmp_path):
+    FeatureIndex.build(spotify_data).save(tmp_path)
+    service = RecommendationService(spotify_data, FeatureIndex.load(tmp_path, spotify_data))
+
+    recommendations = service.get_playlist_recommendations(catalog_tracks(spotify_data, [5]), limit=5)
+
+    assert len(recommendations) == 5
+    assert recommendations[0]['name'] == spotify_data.iloc[5]['track_name']
+    scores = [r['similarity_score'] for r in recommendations]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_audio_index_scores_identical_track_highest(spotify_data, tmp_path):
+    AudioFeatureIndex.build(spotify_data).save(tmp_path)
+    audio_index = AudioFeatureIndex.load(tmp_path, spotify_data)
+
+    assert audio_index.catalog_matrix.dtype == np.float32
+    scores = audio_index.score(catalog_tracks(spotify_data, [7]))
+    assert int(np.argmax(scores)) == 7
+    assert scores[7] == pytest.approx(1.0, abs=1e-5)
+
+    # Different weights make the persisted index stale
+    assert AudioFeatureIndex.load(tmp_path, spotify_data, weights={'energy': 3.0}) is None
+
+
+def test_audio_index_treats_missing_features_as_mean(spotify_data):
+    audio_index = AudioFeatureIndex.build(spotify_data)
+    vector = audio_index.transform([{'name': 'x', 'artist': 'y'}])
+    assert not np.any(vector)
+
+
+def test_parse_feature_weights():
+    assert parse_feature_weights('energy:2, tempo:0.5') == {'energy': 2.0, 'tempo': 0.5}
+    with pytest.raises(ValueError):
+        parse_feature_weights('loudness:1,unknown:2')
+
+
+@pytest.mark.parametrize('engine', ['audio', 'hybrid'])
+def test_numeric_engines_recommend_playlist_track_first(spotify_data, engine):
+    service = RecommendationService(spotify_data, engine=engine, text_weight=0.5)
+
+    recommendations = service.get_playlist_recommendations(catalog_tracks(spotify_data, [11]), limit=3)
+
+    assert recommendations[0]['name'] == spotify_data.iloc[11]['track_name']
+    if engine == 'hybrid':
+        assert service.feature_index.include_numeric is False
+
+
+def test_chunked_top_k_matches_full_sort():
+    scores = np.random.default_rng(1).random(1000)
+
+    indices, top_scores = chunked_top_k(lambda start, stop: scores[start:stop], len(scores), 10, chunk_size=64)
+
+    expected = np.argsort(scores)[::-1][:10]
+    assert indices.tolist() == expected.tolist()
+    assert top_scores.tolist() == scores[expected].tolist()
+    assert top_k(scores, 0)[0].size == 0
+
+
+def test_chunked_top_k_columns_matches_single_query_top_k():
+    rng = np.random.default_rng(3)
+    scores = rng.random((1000, 4))
+
+    indices, top_scores = chunked_top_k_columns(lambda start, stop: scores[start:stop], 1000, 10, 128)
+
+    for column in range(4):
+        expected_indices, expected_scores = top_k(scores[:, column], 10)
+        np.testing.assert_array_equal(indices[:, column], expected_indices)
+        np.testing.assert_allclose(top_scores[:, column], expected_scores)
+
+
+@pytest.mark.parametrize('engine', ['text', 'audio', 'hybrid'])
+def test_batch_recommendations_match_single_playlist_scoring(spotify_data, engine):
+    service = RecommendationService(spotify_data, engine=engine, chunk_size=64)
+    playlists = [catalog_tracks(spotify_data, positions) for positions in ([0, 1, 2], [10], [50, 60, 70, 80])]
+
+    batch = service.get_batch_recommendations(playlists, limit=5)
+
+    assert len(batch) == 3
+    for playlist, recommendations in zip(playlists, batch):
+        single = service.get_playlist_recommendations(playlist, limit=5, exact=True)
+        assert [r['similarity_score'] for r in recommendations] == pytest.approx(
+            [r['similarity_score'] for r in single]
+        )
+
+
+def test_recommendations_are_formatted_from_catalog_rows(spotify_data):
+    spotify_data.loc[7, 'energy'] = np.nan
+    service = RecommendationService(spotify_data, engine='audio')
+
+    recommendations = service._format_recommendations(np.array([7, 3]), np.array([0.5, 0.25], dtype=np.float32))
+
+    assert list(recommendations[0]) == RECOMMENDATION_FIELDS
+    assert recommendations[0]['name'] == spotify_data.loc[7, 'track_name']
+    assert recommendations[0]['album'] == ''
+    assert recommendations[0]['energy'] is None
+    assert recommendations[1]['energy'] == spotify_data.loc[3, 'energy']
+    assert type(recommendations[1]['duration_ms']) is int
+    assert [r['similarity_score'] for r in recommendations] == [0.5, 0.25]
+
+
+def test_recommendation_fields_projection(spotify_data):
+    service = RecommendationService(spotify_data, engine='text')
+    playlists = [catalog_tracks(spotify_data, [0, 1]), catalog_tracks(spotify_data, [9])]
+    fields = parse_fields('name,similarity_score')
+
+    single = service.get_playlist_recommendations(playlists[0], limit=3, fields=fields)
+    batch = service.get_batch_recommendations(playlists, limit=3, fields=fields)
+
+    full = service.get_playlist_recommendations(playlists[0], limit=3)
+    assert single == [{'name': r['name'], 'similarity_score': r['similarity_score']} for r in full]
+    assert [len(recommendations) for recommendations in batch] == [3, 3]
+    assert set(batch[1][0]) == {'name', 'similarity_score'}
+    with pytest.raises(ValueError):
+        parse_fields('name,colour')
+    with pytest.raises(ValueError):
+        parse_fields(' , ')
+
+
+def test_chunked_scoring_matches_pairwise_cosine_mean(spotify_data):
+    service = RecommendationService(spotify_data, engine='text', chunk_size=16)
+    playlist = catalog_tracks(spotify_data, [1, 2, 3, 40])
+
+    recommendations = service.get_playlist_recommendations(playlist, limit=5)
+
+    similarities = cosine_similarity(
+        service.feature_index.catalog_matrix, service.feature_index.transform(playlist)
+    ).mean(axis=1)
+    expected = np.sort(similarities)[::-1][:5]
+    assert [r['similarity_score'] for r in recommendations] == pytest.approx(expected.tolist())
+
+
+@pytest.mark.parametrize('engine', ['text', 'audio', 'hybrid'])
+def test_ivf_index_recall_and_exact_fallback(engine, tmp_path):
+    spotify_data = make_catalog(rows=2000, seed=3)
+    service = RecommendationService(spotify_data, engine=engine, ann_mode='ivf', nprobe=8)
+    playlist = catalog_tracks(spotify_data, [10, 20, 30])
+
+    exact = service.get_playlist_recommendations(playlist, limit=10, exact=True)
+    approximate = service.get_playlist_recommendations(playlist, limit=10, nprobe=service.ann_index.nlist // 2)
+    recall = len({r['name'] for r in exact} & {r['name'] for r in approximate}) / len(exact)
+    assert recall >= 0.7
+
+    # Probing every list is the same as an exact scan
+    full_probe = service.get_playlist_recommendations(playlist, limit=10, nprobe=service.ann_index.nlist)
+    assert [r['similarity_score'] for r in full_probe] == [r['similarity_score'] for r in exact]
+
+    service.save_indexes(tmp_path)
+    loaded = RecommendationService.from_index_dir(spotify_data, tmp_path, engine=engine, ann_mode='ivf')
+    assert loaded.ann_index.nlist == service.ann_index.nlist
+    assert np.array_equal(loaded.ann_index.list_rows, service.ann_index.list_rows)
+
+
+def test_sharded_scoring_matches_in_process_scoring():
+    spotify_data = make_catalog(rows=500, seed=4)
+    single = RecommendationService(spotify_data, engine='hybrid', shards=0)
+    sharded = RecommendationService(
+        spotify_data, single.feature_index, single.audio_index, engine='hybrid', shards=3, chunk_size=64
+    )
+    playlists = [catalog_tracks(spotify_data, [1, 2, 3]), catalog_tracks(spotify_data, [400])]
+
+    def scores(recommendations):
+        return [r['similarity_score'] for r in recommendations]
+
+    try:
+        for tracks, batch in zip(playlists, sharded.get_batch_recommendations(playlists, limit=8)):
+            expected = scores(single.get_playlist_recommendations(tracks, limit=8, exact=True))
+            assert scores(sharded.get_playlist_recommendations(tracks, limit=8, exact=True)) == pytest.approx(expected)
+            assert scores(batch) == pytest.approx(expected)
+    finally:
+        sharded.sharded_scorer.close()
+    assert not os.path.exists(sharded.sharded_scorer.shard_dir)
+
+
+def test_concurrent_first_requests_share_one_shard_pool():
+    scorer = ShardedScorer.build({'audio': np.random.default_rng(0).random((100, 4))}, {'audio': 1.0}, 2, 32)
+    try:
+        with ThreadPoolExecutor(4) as threads:
+            pools = list(threads.map(lambda _: scorer._pool(), range(4)))
+        assert all(pool is pools[0] for pool in pools)
+    finally:
+        scorer.close()
+
+
+def test_sharding_caps_shards_at_catalog_rows():
+    spotify_data = make_catalog(rows=5, seed=2)
+    single = RecommendationService(spotify_data, engine='audio', shards=0)
+    sharded = RecommendationService(spotify_data, single.feature_index, single.audio_index, engine='audio', shards=8)
+    playlists = [catalog_tracks(spotify_data, [0]), catalog_tracks(spotify_data, [3, 4])]
+
+    try:
+        assert sharded.sharded_scorer.n_shards == 5
+        batch = sharded.get_batch_recommendations(playlists, limit=3)
+        expected = single.get_batch_recommendations(playlists, limit=3)
+        assert [[r['name'] for r in result] for result in batch] == [[r['name'] for r in result] for result in expected]
+    finally:
+        sharded.close()
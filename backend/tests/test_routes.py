@@ -0,0 +1,227 @@
+import base64
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.services.data_service import DataService
+from app.services.recommendation_cache import encode_cursor
+from app.services.service_registry import get_registry
+from app.services.spotify_service import SpotifyService
+
+
+def test_registry_loads_catalog_once(app_config):
+    app = create_app(app_config)
+
+    with app.app_context():
+        registry = get_registry()
+        assert registry.ready
+        assert registry.status()['catalog_rows'] == 200
+        assert registry.recommendation_service.spotify_data is registry.data_service.spotify_data
+
+
+def test_recommendations_report_loading_state(app_config, tmp_path):
+    (tmp_path / 'spotify_data.csv').unlink()
+    app = create_app(app_config)
+
+    response = app.test_client().get('/api/recommendations/playlist?playlist_id=abc')
+
+    assert response.status_code == 503
+    assert response.get_json()['status']['state'] == 'failed'
+
+
+def test_tracks_batch_endpoint(app_config):
+    client = create_app(app_config).test_client()
+
+    response = client.post('/api/tracks/batch', json={'track_ids': ['track000001', 'nope']})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['total'] == 1
+    assert body['missing'] == ['nope']
+    assert client.post('/api/tracks/batch', json={}).status_code == 400
+    for track_ids in ([1, 'track000001'], [{'id': 'track000001'}], [None], ['']):
+        response = client.post('/api/tracks/batch', json={'track_ids': track_ids})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'track_ids must be non-empty strings'}
+
+
+def test_data_summary_endpoint(app_config):
+    client = create_app(app_config).test_client()
+
+    body = client.get('/api/data/summary').get_json()
+
+    assert body['total_rows'] == 200
+    assert body['summary_stats']['energy']['count'] == 200
+
+
+def test_playlist_recommendations_are_cached_per_snapshot(app_config):
+    app = create_app(app_config)
+    client = app.test_client()
+
+    with FakeSpotifyServer(playlist_size=30) as server, app.app_context():
+        registry = get_registry()
+        registry.spotify_service = SpotifyService(server.client())
+
+        first = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5')
+        second = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5')
+        assert (first.headers['X-Cache'], second.headers['X-Cache']) == ('MISS', 'HIT')
+        assert second.get_json() == first.get_json()
+        # The hit only cost the metadata call
+        assert len(server.page_requests('abc')) == 0
+        assert len(server.paths('/v1/playlists/abc')) == 3
+
+        server.playlist_size = 31  # new snapshot_id
+        assert client.get('/api/recommendations/playlist?playlist_id=abc&limit=5').headers['X-Cache'] == 'MISS'
+
+        registry.set_recommendation_service(registry.recommendation_service)
+        assert client.get('/api/recommendations/playlist?playlist_id=abc&limit=5').headers['X-Cache'] == 'MISS'
+
+
+def test_playlist_recommendations_field_projection(app_config):
+    app = create_app(app_config)
+    client = app.test_client()
+
+    with FakeSpotifyServer(playlist_size=30) as server, app.app_context():
+        get_registry().spotify_service = SpotifyService(server.client())
+
+        full = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5')
+        projected = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5&fields=name,artist')
+        invalid = client.get('/api/recommendations/playlist?playlist_id=abc&fields=name,colour')
+
+    assert projected.headers['X-Cache'] == 'MISS'
+    assert projected.get_json()['recommendations'] == [
+        {'name': r['name'], 'artist': r['artist']} for r in full.get_json()['recommendations']
+    ]
+    assert invalid.status_code == 400
+
+
+def test_playlist_recommendation_pages_follow_cursors(app_config):
+    app_config.RECOMMENDATION_RANKING_DEPTH = 60
+    app = create_app(app_config)
+    client = app.test_client()
+    url = '/api/recommendations/playlist?playlist_id=abc&min_popularity=10'
+
+    with FakeSpotifyServer(playlist_size=30) as server, app.app_context():
+        registry = get_registry()
+        registry.spotify_service = SpotifyService(server.client())
+
+        whole = client.get(f"{url}&limit=50").get_json()['recommendations']
+        requests = len(server.requests)
+        first = client.get(f"{url}&limit=25").get_json()
+        second = client.get(f"/api/recommendations/playlist?cursor={first['next_cursor']}&limit=25")
+        # Later pages are served from the ranked list without calling Spotify
+        assert len(server.requests) == requests + 1
+        assert second.headers['X-Cache'] == 'HIT'
+        assert first['recommendations'] + second.get_json()['recommendations'] == whole
+
+        # A worker without the list ranks it again from the cursor
+        registry.ranked_lists.invalidate()
+        last = client.get(f"/api/recommendations/playlist?cursor={second.get_json()['next_cursor']}&fields=name")
+        assert last.headers['X-Cache'] == 'MISS'
+        names = [r['name'] for r in last.get_json()['recommendations']]
+        assert len(names) == 10 and not set(names) & {r['name'] for r in whole}
+        assert last.get_json()['next_cursor'] is None
+
+        registry.set_recommendation_service(
+            registry.recommendation_service.with_catalog(registry.recommendation_service.spotify_data)
+        )
+        expired = client.get(f"/api/recommendations/playlist?cursor={first['next_cursor']}")
+        invalid = client.get('/api/recommendations/playlist?cursor=not-a-cursor')
+        # Well-formed cursors with values of the wrong type are rejected the same way
+        mistyped = [
+            client.get(f"/api/recommendations/playlist?cursor={encode_cursor(state, app.config['SECRET_KEY'])}")
+            for state in (
+                {'args': 5, 'offset': 'x', 'snapshot_id': 's', 'version': 'v', 'session': None},
+                {'args': [['playlist_id']], 'offset': 0, 'snapshot_id': 's', 'version': 'v', 'session': None},
+                {'args': [['playlist_id', 'abc']], 'offset': -5, 'snapshot_id': 's', 'version': 'v', 'session': None},
+                {'args': [['playlist_id', 'abc']], 'offset': 0, 'snapshot_id': None, 'version': 1, 'session': None},
+            )
+        ]
+        # Cursors cannot be made up without the key, nor reused from another session
+        state = {
+            'args': [['playlist_id', 'abc'], ['min_popularity', '10']], 'offset': 25,
+            'snapshot_id': 'snapshot-abc', 'version': registry.recommendation_service.version,
+        }
+        forged = [
+            client.get(f"/api/recommendations/playlist?cursor={cursor}")
+            for cursor in (
+                encode_cursor({**state, 'session': None}, app.config['SECRET_KEY']),
+                base64.urlsafe_b64encode(json.dumps({**state, 'session': None}).encode()).decode().rstrip('='),
+                encode_cursor({**state, 'session': None}, 'another-key'),
+                encode_cursor({**state, 'session': 'another-session'}, app.config['SECRET_KEY']),
+            )
+        ]
+
+    assert expired.status_code == 410
+    assert invalid.status_code == 400
+    assert [response.status_code for response in mistyped] == [400] * 4
+    assert [response.status_code for response in forged] == [200, 400, 400, 400]
+    assert mistyped[0].get_json() == {'error': 'Invalid cursor'}
+
+
+
+def test_health_and_readiness_during_background_warmup(app_config, monkeypatch):
+    release = threading.Event()
+    load_spotify_data = DataService.load_spotify_data
+
+    def slow_load(self, *args, **kwargs):
+        release.wait(10)
+        return load_spotify_data(self, *args, **kwargs)
+
+    monkeypatch.setattr(DataService, 'load_spotify_data', slow_load)
+    monkeypatch.setattr(app_config, 'SERVICE_WARMUP', 'background')
+    app = create_app(app_config)
+    client = app.test_client()
+
+    # The worker is live and reports the catalog as loading
+    assert client.get('/healthz').get_json() == {'status': 'ok'}
+    loading = client.get('/readyz')
+    assert loading.status_code == 503 and loading.get_json()['state'] == 'loading'
+    assert client.get('/api/data/summary').status_code == 503
+
+    release.set()
+    with app.app_context():
+        assert get_registry().load().ready
+    ready = client.get('/readyz')
+    assert ready.status_code == 200
+    assert ready.get_json()['catalog_rows'] == 200 and ready.get_json()['index_version']
+    assert client.get('/api/data/summary').status_code == 200
+
+
+def test_lazy_startup_defers_scoring_imports(app_config):
+    # A fresh interpreter, since this one has already imported the scoring modules
+    script = (
+        "import sys\n"
+        "from app import create_app\n"
+        "app = create_app()\n"
+        "heavy = sorted(name for name in ('pandas', 'sklearn', 'spotipy') if name in sys.modules)\n"
+        "response = app.test_client().get('/readyz')\n"
+        "print(heavy, response.status_code, response.get_json()['state'])\n"
+        "app.extensions['service_registry'].load()\n"
+        "print(app.test_client().get('/readyz').status_code)\n"
+    )
+    env = {
+        **os.environ,
+        'SERVICE_WARMUP': 'lazy',
+        'SPOTIFY_DATA_DIR': str(app_config.DATA_DIR),
+        'COLUMNAR_DIR': str(app_config.COLUMNAR_DIR),
+        'FEATURE_INDEX_DIR': str(app_config.FEATURE_INDEX_DIR),
+        'AUDIO_FEATURES_CACHE_PATH': '',
+        'SPOTIFY_TOKEN_STORE_PATH': '',
+        'LISTENING_HISTORY_PATH': '',
+        'SPOTIFY_CLIENT_ID': 'test-client',
+        'SPOTIFY_CLIENT_SECRET': 'test-secret',
+    }
+    result = subprocess.run(
+        [sys.executable, '-c', script], cwd=Path(__file__).parent.parent, env=env, capture_output=True, text=True
+    )
+
+    assert result.returncode == 0, result.stderr
+    # The /readyz request itself started the warm-up, which may or may not have finished
+    first, second = result.stdout.splitlines()
+    assert first.startswith("[] 503 ") or first.startswith("[] 200 ")
+    assert second == '200'
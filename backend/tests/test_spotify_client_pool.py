@@ -0,0 +1,116 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.routes.spotify_routes import SESSION_KEY
+from app.services.service_registry import get_registry
+from app.services.spotify_client_pool import SpotifyClientPool, SpotifyTokenStore, UserTokenManager
+
+
+def token(name, expires_in=3600):
+    return {'access_token': name, 'refresh_token': f"refresh-{name}", 'expires_at': int(time.time()) + expires_in}
+
+
+class FakeOAuth:
+    """Stands in for SpotifyOAuth.refresh_access_token, optionally blocking until released."""
+
+    def __init__(self, manager, release=None):
+        self.manager = manager
+        self.release = release
+        self.refreshes = 0
+
+    def refresh_access_token(self, refresh_token):
+        if self.release is not None:
+            self.release.wait(5)
+        self.refreshes += 1
+        self.manager.save_token_to_cache(token(f"{self.manager.session_id}-{self.refreshes}"))
+
+
+def make_manager(session_id, refresher, release=None, expires_in=3600):
+    manager = UserTokenManager(session_id, None, SpotifyTokenStore(), refresher, refresh_margin=300)
+    manager.oauth = FakeOAuth(manager, release)
+    manager.token_info = token(session_id, expires_in)
+    return manager
+
+
+def test_tokens_are_refreshed_ahead_of_expiry():
+    with ThreadPoolExecutor(1) as refresher:
+        fresh = make_manager('fresh', refresher)
+        assert fresh.get_access_token() == 'fresh'
+
+        # Inside the refresh margin the current token is still used while a refresh runs
+        expiring = make_manager('expiring', refresher, expires_in=200)
+        assert expiring.get_access_token() == 'expiring'
+
+        # An expired token is refreshed before use
+        expired = make_manager('expired', refresher, expires_in=0)
+        assert expired.get_access_token() == 'expired-1'
+
+    assert fresh.oauth.refreshes == 0
+    assert expiring.oauth.refreshes == 1
+    assert expiring.get_access_token() == 'expiring-1'
+
+
+def test_one_session_refreshing_does_not_block_another():
+    release = threading.Event()
+    with ThreadPoolExecutor(2) as pool:
+        slow = make_manager('slow', pool, release, expires_in=0)
+        other = make_manager('other', pool)
+        slow_token = pool.submit(slow.get_access_token)
+
+        start = time.perf_counter()
+        assert other.get_access_token() == 'other'
+        assert time.perf_counter() - start < 0.5
+        assert not slow_token.done()
+
+        release.set()
+        assert slow_token.result(5) == 'slow-1'
+
+
+def test_sessions_get_isolated_clients_shared_across_workers(app_config):
+    app = create_app(app_config)
+    client = app.test_client()
+
+    response = client.get('/api/login')
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        session_id = session[SESSION_KEY]
+    assert parse_qs(urlparse(response.headers['Location']).query)['state'] == [session_id]
+
+    with app.app_context():
+        registry = get_registry()
+        # A login completed in another worker lands in the shared token store
+        SpotifyTokenStore(app_config.SPOTIFY_TOKEN_STORE_PATH).save(session_id, token('user-a'))
+        registry.spotify_clients.token_store.save('other-session', token('user-b'))
+        other_worker = SpotifyClientPool(token_store=SpotifyTokenStore(app_config.SPOTIFY_TOKEN_STORE_PATH))
+
+        with FakeSpotifyServer() as server:
+            for service in (registry.spotify_clients.get(session_id), other_worker.get('other-session')):
+                service.spotify.prefix = server.prefix
+            response = client.get('/api/top-songs')
+            other_worker.get('other-session').get_top_songs()
+            fetched = len(server.authorizations)
+            # The session's private playlists are read with its own token too
+            recommendations = client.get('/api/recommendations/playlist?playlist_id=abc&limit=5')
+
+    assert response.get_json()['total'] == 5
+    assert server.authorizations[:fetched] == ['Bearer user-a', 'Bearer user-b']
+    assert recommendations.status_code == 200
+    assert set(server.authorizations[fetched:]) == {'Bearer user-a'}
+    assert registry.spotify_clients.get('unknown-session') is None
+
+
+def test_several_workers_require_a_shared_secret_key(app_config, monkeypatch):
+    monkeypatch.setattr(app_config, 'SECRET_KEY', None)
+    assert create_app(app_config).config['SECRET_KEY']
+
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    with pytest.raises(RuntimeError, match='SECRET_KEY'):
+        create_app(app_config)
+    monkeypatch.setattr(app_config, 'SECRET_KEY', 'shared')
+    assert create_app(app_config).config['SECRET_KEY'] == 'shared'
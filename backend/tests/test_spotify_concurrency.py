@@ -0,0 +1,121 @@
+import time
+import pytest
+from conftest import make_catalog
+from fake_spotify import FakeSpotifyServer
+from app.services.audio_features_cache import AudioFeaturesCache
+from app.services.data_service import DataService
+from app.services.spotify_service import AUDIO_FEATURE_FIELDS, SpotifyService, build_http_session
+
+
+@pytest.mark.parametrize('concurrent', [False, True])
+def test_playlist_tracks_are_complete_and_in_order(concurrent):
+    with FakeSpotifyServer(playlist_size=1234) as server:
+        service = SpotifyService(server.client(requests_session=build_http_session(8)), fetch_workers=8)
+
+        playlist_data = service.get_playlist_tracks('abc', concurrent=concurrent)
+
+    assert playlist_data['total_tracks'] == 1234
+    assert [track['id'] for track in playlist_data['tracks']] == [f"fake{i:06d}" for i in range(1234)]
+    assert all('energy' in track for track in playlist_data['tracks'])
+    # The first page comes embedded in the playlist response
+    assert len(server.page_requests('abc')) == 12
+    assert len(server.paths('/v1/audio-features')) == 13
+
+
+def test_concurrent_fetch_overlaps_round_trips():
+    with FakeSpotifyServer(playlist_size=1000, latency=0.05) as server:
+        service = SpotifyService(server.client(requests_session=build_http_session(8)), fetch_workers=8)
+
+        start = time.perf_counter()
+        service.get_playlist_tracks('abc', concurrent=True)
+        elapsed = time.perf_counter() - start
+
+    # 1 + 9 page requests and 10 audio-feature batches, sequentially about 1s
+    assert server.max_in_flight > 1
+    assert elapsed < 0.6
+
+
+def test_audio_features_come_from_cache_on_repeat_requests(tmp_path):
+    with FakeSpotifyServer(playlist_size=300) as server:
+        cache = AudioFeaturesCache(tmp_path / 'features.sqlite3', max_entries=1000)
+        service = SpotifyService(server.client(), audio_features_cache=cache)
+        first = service.get_playlist_tracks('abc')
+        assert len(server.paths('/v1/audio-features')) == 3
+
+        service.get_playlist_tracks('abc')
+        # A second worker sharing the SQLite file also skips the API
+        other_worker = SpotifyService(server.client(), audio_features_cache=AudioFeaturesCache(
+            tmp_path / 'features.sqlite3', max_entries=1000
+        ))
+        second = other_worker.get_playlist_tracks('abc')
+
+    assert len(server.paths('/v1/audio-features')) == 3
+    assert [track['energy'] for track in second['tracks']] == [track['energy'] for track in first['tracks']]
+    assert cache.stats()['memory']['hits'] == 300
+    assert other_worker.audio_features_cache.stats()['disk_hits'] == 300
+
+
+def test_audio_features_cache_evicts_least_recently_used(tmp_path):
+    cache = AudioFeaturesCache(tmp_path / 'features.sqlite3', max_entries=2, memory_entries=1)
+    cache.set_many({'a': {'energy': 0.1}})
+    cache.set_many({'b': {'energy': 0.2}})
+    cache.get_many(['a'])
+    cache.set_many({'c': {'energy': 0.3}})
+
+    found, missing = AudioFeaturesCache(tmp_path / 'features.sqlite3').get_many(['a', 'b', 'c'])
+    assert sorted(found) == ['a', 'c']
+    assert missing == ['b']
+
+
+def test_audio_features_cache_counts_rows_only_past_its_limit(tmp_path):
+    cache = AudioFeaturesCache(tmp_path / 'features.sqlite3', max_entries=100, memory_entries=1)
+    counts = []
+    cache._connection().set_trace_callback(lambda sql: counts.append(sql) if 'COUNT' in sql else None)
+    for start in range(0, 100, 10):
+        cache.set_many({f"t{i}": {'energy': 0.1} for i in range(start, start + 10)})
+    assert counts == []
+
+    # Past the limit the store is trimmed to its low-water mark in one go
+    cache.set_many({'new': {'energy': 0.2}})
+    assert len(counts) == 1
+    reopened = AudioFeaturesCache(tmp_path / 'features.sqlite3')
+    assert reopened._disk_rows == 90
+    found, missing = reopened.get_many(['new', 't0', 't99'])
+    assert sorted(found) == ['new', 't99'] and missing == ['t0']
+    for i in range(9):
+        cache.set_many({f"more{i}": {'energy': 0.3}})
+    assert len(counts) == 1
+
+
+def test_catalog_tracks_skip_the_audio_features_api(tmp_path):
+    catalog = make_catalog(rows=50)
+    catalog['track_id'] = [f"fake{i:06d}" for i in range(50)]
+    data_service = DataService(tmp_path, catalog_format='csv')
+    data_service._set_spotify_data(catalog)
+
+    with FakeSpotifyServer(playlist_size=120) as server:
+        service = SpotifyService(server.client(), catalog=data_service)
+        playlist_data = service.get_playlist_tracks('abc')
+
+    # Only the 70 tracks that are not in the catalog are requested
+    assert len(server.paths('/v1/audio-features')) == 1
+    assert playlist_data['tracks'][0]['energy'] == pytest.approx(catalog.loc[0, 'energy'])
+
+
+def test_catalog_audio_features_win_over_cached_ones(tmp_path):
+    catalog = make_catalog(rows=50)
+    catalog['track_id'] = [f"fake{i:06d}" for i in range(50)]
+    data_service = DataService(tmp_path, catalog_format='csv')
+    data_service._set_spotify_data(catalog)
+    cache = AudioFeaturesCache(tmp_path / 'features.sqlite3')
+    stale = {name: 0.5 for name in AUDIO_FEATURE_FIELDS}
+    cache.set_many({'fake000000': stale, 'fake000070': stale})
+
+    with FakeSpotifyServer() as server:
+        service = SpotifyService(server.client(), audio_features_cache=cache, catalog=data_service)
+        features, missing = service._get_known_audio_features(['fake000000', 'fake000070', 'fake000071'])
+
+    # The catalog's value is used for the catalog track, the cache for the track it does not have
+    assert features['fake000000']['energy'] == pytest.approx(catalog.loc[0, 'energy']) != 0.5
+    assert features['fake000070'] == stale
+    assert missing == ['fake000071']
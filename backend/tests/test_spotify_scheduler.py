@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+import spotipy
+from fake_spotify import FakeSpotifyServer
+from app import create_app
+from app.services.service_registry import get_registry
+from app.services.spotify_scheduler import RetryBudget, SpotifyCallScheduler, TokenBucket
+from app.services.spotify_service import SpotifyService, build_http_session
+
+
+class RateLimitedServer(FakeSpotifyServer):
+    """Answers the first `limited` audio-features requests with 429 and a Retry-After."""
+
+    def __init__(self, limited, retry_after=0.2, status=429, **kwargs):
+        super().__init__(**kwargs)
+        self.limited = limited
+        self.retry_after = retry_after
+        self.status = status
+        self.rejected_at = []
+        self.accepted_at = []
+
+    def respond(self, path, query):
+        if path.startswith('/v1/audio-features'):
+            with self._lock:
+                if self.limited:
+                    self.limited -= 1
+                    self.rejected_at.append(time.monotonic())
+                    return self.status, {'Retry-After': str(self.retry_after)}, {'error': {'status': self.status}}
+                self.accepted_at.append(time.monotonic())
+        return super().respond(path, query)
+
+
+def make_service(server, **scheduler_kwargs):
+    # A session without urllib3 status retries, so every 429 reaches the scheduler
+    client = server.client(requests_session=build_http_session(8))
+    return SpotifyService(client, fetch_workers=8, scheduler=SpotifyCallScheduler(**scheduler_kwargs))
+
+
+def test_rate_limited_fetch_honours_retry_after():
+    with RateLimitedServer(limited=2, retry_after=0.2, playlist_size=500) as server:
+        service = make_service(server, rate=100, burst=10)
+        playlist_data = service.get_playlist_tracks('abc')
+
+    assert all('energy' in track for track in playlist_data['tracks'])
+    # The rejected batches were only retried once the Retry-After had passed
+    retried = sorted(server.accepted_at)[-2:]
+    assert min(retried) - max(server.rejected_at) >= 0.15
+    stats = service.scheduler.stats()
+    assert stats['rate_limited'] == 2
+    assert stats['failures'] == 0
+
+
+def test_retry_budget_stops_error_storms():
+    with RateLimitedServer(limited=1000, status=503, playlist_size=1000) as server:
+        scheduler_kwargs = dict(rate=1000, burst=100, max_retries=5, retry_budget=RetryBudget(0.1, min_retries=3))
+        service = make_service(server, **scheduler_kwargs)
+        service.scheduler.base_delay = 0.001
+        playlist_data = service.get_playlist_tracks('abc')
+
+    # 10 feature batches fail; without a budget they would be tried 60 times
+    assert len(server.paths('/v1/audio-features')) <= 10 + 5
+    assert service.scheduler.stats()['budget_exhausted'] > 0
+    assert not any('energy' in track for track in playlist_data['tracks'])
+
+
+def test_identical_calls_in_flight_are_coalesced():
+    scheduler = SpotifyCallScheduler(rate=1000, burst=100)
+    calls = []
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return {'id': 'abc'}
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(scheduler.call(('playlist', 'abc'), fetch)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    while scheduler.stats()['coalesced'] < 9:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'id': 'abc'}] * 10
+
+
+def test_token_bucket_allows_bursts_then_paces_calls():
+    now = [0.0]
+    bucket = TokenBucket(rate=10, burst=5, clock=lambda: now[0])
+
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    assert bucket.reserve() == pytest.approx(0.1)
+
+    now[0] = 10.0
+    bucket.pause(2)
+    assert bucket.reserve() == pytest.approx(2.0)
+    assert bucket.reserve() == pytest.approx(2.1)
+
+
+def test_non_retryable_errors_fail_immediately():
+    scheduler = SpotifyCallScheduler(rate=1000, burst=100)
+
+    def fetch():
+        raise spotipy.SpotifyException(404, -1, 'not found')
+
+    with pytest.raises(spotipy.SpotifyException):
+        scheduler.call('missing', fetch)
+    assert scheduler.stats()['requests'] == 1
+
+
+def test_registry_scheduler_uses_the_configured_retry_budget(app_config, monkeypatch):
+    monkeypatch.setattr(app_config, 'SPOTIFY_RETRY_BUDGET', 0.5)
+    app = create_app(app_config)
+
+    with app.app_context():
+        scheduler = get_registry().spotify_scheduler
+        assert scheduler.call(('ping',), lambda: 'pong') == 'pong'
+
+    # Every call deposits the configured share of a retry on top of the 10 initial ones
+    assert scheduler.stats()['retry_budget'] == 10.5